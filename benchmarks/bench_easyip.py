@@ -0,0 +1,64 @@
+"""
+bench_easyip.py  times encoding and decoding the per-frame Festo packets
+
+Compares building a new packet with easyip.Factory.send_flagword every
+frame with refilling the preallocated easyip.FlagwordTemplate, and checks
+both produce the same bytes, also for the combined send and pressure
+request packet. Also times decoding a pressure readback reply.
+Run from the repository root:
+    python -m benchmarks.bench_easyip
+"""
+
+import timeit
+import numpy as np
+
+from output.fstlib import easyip
+
+
+def main(frames=20000):
+    rng = np.random.RandomState(1)
+    frames_words = [list(map(int, w)) for w in rng.randint(0, 6001, (frames, 7))]
+    template = easyip.FlagwordTemplate(7)
+
+    for counter, words in enumerate(frames_words[:1000]):
+        template.encode(words, counter)
+        expected = easyip.Factory.send_flagword(counter, words).pack()
+        assert bytes(template.pack()) == expected, "template differs from Packet.pack() for %s" % words
+    for words in ([0] * 7, [65535] * 7):
+        template.encode(words, 0)
+        assert bytes(template.pack()) == easyip.Factory.send_flagword(0, words).pack()
+    exchange = easyip.FlagwordTemplate(7, req_count=6, req_offset=10)
+    for counter, words in enumerate(frames_words[:1000]):
+        exchange.encode(words, counter)
+        expected = easyip.Factory.send_req_flagword(counter, words, 0, 6, 10).pack()
+        assert bytes(exchange.pack()) == expected, "exchange differs from Packet.pack() for %s" % words
+
+    def factory():
+        for words in frames_words:
+            easyip.Factory.send_flagword(0, words).pack()
+
+    def preallocated():
+        for words in frames_words:
+            template.encode(words)
+            template.pack()
+
+    request = easyip.Factory.req_flagword(1, 6, 10)
+    reply = easyip.Factory.response(request)
+    reply.reqdata_type, reply.reqdata_size = easyip.Operands.FLAG_WORD, 6
+    reply.payload = easyip.word_struct(6).pack(*frames_words[0][:6])
+    datagram = reply.pack()
+    assert list(easyip.Packet(datagram).decode_payload(easyip.Packet.DIRECTION_REQ)) == frames_words[0][:6]
+
+    def readback():
+        for _ in frames_words:
+            resp = easyip.Packet(datagram)
+            request.response_errors(resp)
+            resp.decode_payload(easyip.Packet.DIRECTION_REQ)
+
+    for name, func in (("factory", factory), ("template", preallocated), ("readback", readback)):
+        best = min(timeit.repeat(func, number=1, repeat=5))
+        print("%-10s %6.2f us per frame" % (name, best / frames * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+bench_pressure.py  times the actuator length to pressure conversion
+
+Compares OutputInterface._convert_MM_to_pressure with the per-muscle
+scalar loop it replaced and checks both give the same pressures.
+Run from the repository root:
+    python -m benchmarks.bench_pressure
+"""
+
+import timeit
+import numpy as np
+
+from output.platform_output import OutputInterface, MIN_PRESSURE, MAX_PRESSURE
+import platform_config
+import importlib
+
+cfg = importlib.import_module(platform_config.platform_selection).PlatformConfig()
+
+
+def legacy_move_to_pressures(chair, prev_pos, lengths, timeDelta, load):
+    # the scalar loop from before the conversion was vectorized
+    pressures = []
+    for idx, length in enumerate(lengths):
+        muscle_len = length - chair.fixed_len
+        percent = (chair.max_actuator_len - chair.fixed_len - muscle_len) / float(chair.max_actuator_len - chair.fixed_len)
+        distDelta = muscle_len - prev_pos[idx]
+        accel = (distDelta / 1000) / timeDelta
+        if distDelta < 0:
+            force = load * (1 - accel)
+            pressure = 35 * percent * percent + 15 * percent + .03
+        else:
+            force = load * (1 + accel)
+            pressure = 35 * percent * percent + 15 * percent + .03
+        prev_pos[idx] = muscle_len
+        pressure = max(min(MAX_PRESSURE, pressure), MIN_PRESSURE)
+        pressures.append(int(1000 * pressure))
+    return pressures
+
+
+def main(frames=20000):
+    chair = OutputInterface()
+    chair.begin(cfg.MIN_ACTUATOR_LEN, cfg.MAX_ACTUATOR_LEN, cfg.DISABLED_LEN, cfg.PROPPING_LEN,
+                cfg.FIXED_LEN, cfg.TOTAL_WEIGHT)
+    rng = np.random.RandomState(1)
+    requests = rng.uniform(cfg.MIN_ACTUATOR_LEN, cfg.MAX_ACTUATOR_LEN, (frames, 6))
+    rows = [list(r) for r in requests]  # python floats, the scalar loop's best case
+    load = cfg.TOTAL_WEIGHT / 6.0
+
+    prev_pos = [0.0] * 6
+    mismatched = 0
+    for r in requests[:1000]:
+        expected = legacy_move_to_pressures(chair, prev_pos, r, 0.05, load)
+        got = chair._convert_MM_to_pressure(r, 0.05, load).tolist()
+        # evaluating in millibar can round the last digit differently
+        mismatched += sum(abs(e - g) > 1 for e, g in zip(expected, got))
+    assert not mismatched, "%d pressures differ from the scalar loop" % mismatched
+
+    def legacy_list():
+        for r in rows:
+            legacy_move_to_pressures(chair, prev_pos, r, 0.05, load)
+
+    def legacy():
+        # kinematics hands over a numpy array, so the loop works on numpy scalars
+        for r in requests:
+            legacy_move_to_pressures(chair, prev_pos, r, 0.05, load)
+
+    def vectorized():
+        for r in requests:
+            chair._convert_MM_to_pressure(r, 0.05, load).tolist()
+
+    for name, func in (("scalar loop", legacy), ("scalar, list", legacy_list), ("vectorized", vectorized)):
+        best = min(timeit.repeat(func, number=1, repeat=5))
+        print("%-12s %6.2f us per frame" % (name, best / frames * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+nl2_activation.py  non-blocking chair activation
+
+ActivationSequencer replaces the loop in activate() that slept until
+NoLimits was back in play mode after the park reset: start() sends the
+reset and service(), called from the client's station task, waits for play
+mode, restores manual mode and selects the seat, then reports through a
+callback. The control loop keeps running (and kicking the frame watchdog)
+however long NoLimits takes to reset.
+"""
+
+import sys
+import time
+import logging
+
+# Perf counter compatible alias (Py3: perf_counter, Py2: clock/time)
+try:
+    perf_counter = time.perf_counter          # Py3
+except AttributeError:                        # Py2
+    perf_counter = time.clock if sys.platform.startswith('win') else time.time
+
+from .nl2_link import ConnState
+
+log = logging.getLogger(__name__)
+
+
+class ActivationState(object):
+    IDLE, RESETTING, CONFIGURING = list(range(3))
+
+    @staticmethod
+    def text(state):
+        return ("Idle", "Resetting", "Configuring")[state]
+
+
+class ActivationSequencer(object):
+
+    def __init__(self, nl2, activated_callback=None, timeout=20.0, step_interval=0.25, settle_time=0.5):
+        """
+        nl2 is the Nl2Messenger.
+        activated_callback(ok) is called when NoLimits is ready for the chair or activation failed.
+        timeout is the time allowed for the reset and the return to play mode.
+        settle_time is how long after the reset READY is trusted if NoLimits was not seen leaving play mode.
+        """
+        self.nl2 = nl2
+        self.activated_callback = activated_callback
+        self.timeout = float(timeout)
+        self.step_interval = float(step_interval)
+        self.settle_time = float(settle_time)
+        self.state = ActivationState.IDLE
+        self.seat = 0
+        self._start = 0.0
+        self._next_step = 0.0
+        self._left_play = False
+
+    def is_busy(self):
+        return self.state != ActivationState.IDLE
+
+    def start(self, seat):
+        if self.is_busy():
+            log.warning("activation already in progress (%s)", ActivationState.text(self.state))
+            return False
+        log.info("resetting park in manual mode for activation")
+        self.nl2.reset_park(False)
+        self.seat = int(seat)
+        self._start = self._next_step = perf_counter()
+        self._left_play = False
+        self.state = ActivationState.RESETTING
+        return True
+
+    def cancel(self):
+        if self.is_busy():
+            log.info("activation cancelled while %s", ActivationState.text(self.state).lower())
+        self.state = ActivationState.IDLE
+
+    def service(self):
+        """Advance the activation one step; returns the current ActivationState."""
+        if self.state == ActivationState.IDLE:
+            return self.state
+        now = perf_counter()
+        elapsed = now - self._start
+        if elapsed > self.timeout:
+            log.error("NoLimits not ready for activation within %.0f seconds", self.timeout)
+            self._finish(False)
+            return self.state
+        if now < self._next_step:
+            return self.state
+        self._next_step = now + self.step_interval
+
+        if self.state == ActivationState.RESETTING:
+            # READY straight after the reset request may predate it
+            ready = self.nl2.connection_state == ConnState.READY
+            if not ready:
+                self._left_play = True
+            if ready and (self._left_play or elapsed >= self.settle_time):
+                self.state = ActivationState.CONFIGURING
+
+        elif self.state == ActivationState.CONFIGURING:
+            # manual mode is re-checked each step rather than waited for
+            if not self.nl2.ensure_manual_mode(True, max_age=0):
+                return self.state
+            log.info("selecting seat %d", self.seat)
+            self.nl2.select_seat(self.seat)
+            self._finish(True)
+        return self.state
+
+    def _finish(self, ok):
+        self.state = ActivationState.IDLE
+        if self.activated_callback:
+            self.activated_callback(ok)
@@ -9,17 +9,28 @@ This version requires NoLimits attraction license and NL ver 2.5.3.5 or later
 import os
 import time
 import ctypes
-import tkinter.messagebox
+import logging
 
 from .nl2_messenger import Nl2Messenger, ConnState  
-from .coaster_gui import CoasterGui
+from .nl2_supervisor import Nl2Supervisor, LinkState
+from .nl2_dispatch import DispatchSequencer
+from .nl2_park_loader import ParkLoader
+from .nl2_activation import ActivationSequencer
 from .coaster_state import RideState, RideStateStr
 from .serial_remote import SerialRemote
-from platform_config import FRAME_RATE_SECS
+from platform_config import FRAME_RATE_SECS, HEADLESS
+from common.stats_server import StatsServer
+from common.gui_bridge import NullGui
+from common.frame_metrics import frame_metrics
 
 JITTER_MARGIN = 0.005  # assume frame rate jitter under 5 ms
 MAX_TELEM_AGE = max(0.0, FRAME_RATE_SECS - JITTER_MARGIN)
 
+STATS_PORT = 10011        # local udp port answering with NL2 link statistics, None to disable
+LINK_STATS_LOG_SECS = 60  # interval between link statistics log lines
+
+log = logging.getLogger(__name__)
+
 
 IS_RASPBERRYPI = False
 if os.name == 'posix':
@@ -111,7 +122,7 @@ class State(object):
 colors = ["green3","orange","red"] # for warning level text
 
 class InputInterface(object):
-    USE_GUI = True
+    USE_GUI = not HEADLESS
 
     def __init__(self):
         self.cmd_func = None
@@ -123,6 +134,19 @@ class InputInterface(object):
         # Use Nl2Messenger instead of legacy CoasterInterface
         self.nl2 = Nl2Messenger()
         self.nl2.set_telem_min_interval(MAX_TELEM_AGE)
+        self._max_tm_age = MAX_TELEM_AGE
+        # handshakes once per connection, then watches telemetry replies for liveness
+        self.supervisor = Nl2Supervisor(self.nl2, self._link_state_changed)
+        self._reset_park_when_online = False  # set by begin(), done on first connection
+        self.nl2.station_status = 0
+        self.nl2.add_station_listener(self._station_state_changed)
+        self.dispatcher = DispatchSequencer(self.nl2, self._dispatched, self._left_station)
+        self.park_loader = ParkLoader(self.nl2, self._park_load_progress, self._park_loaded)
+        self.activator = ActivationSequencer(self.nl2, self._activated)
+        self.stats_server = None
+        self._next_stats_log = time.time() + LINK_STATS_LOG_SECS
+        self._next_stats_label = 0.0
+        self._link_stats_text = ''  # telemetry round trip percentiles for the connection label
 
         # Minimal legacy-compatible status shim so GUI code can stay the same
         class _Status(object):
@@ -133,7 +157,16 @@ class InputInterface(object):
         self.nl2.system_status.is_in_play_mode = False
         self.nl2.system_status.is_paused = False
 
-        self.gui = CoasterGui(self.dispatch, self.pause, self.reset, self.set_activate_state, self.quit)
+        # set by the controller when the control loop runs on its own thread,
+        # GUI button presses are then handed to that thread to run
+        self.call_in_control = None
+        if self.USE_GUI:
+            from .coaster_gui import CoasterGui  # Tk is only imported when there is a display
+            self.gui = CoasterGui(self._from_gui(self.dispatch), self._from_gui(self.pause),
+                                  self._from_gui(self.reset), self._from_gui(self.set_activate_state),
+                                  self._from_gui(self.quit))
+        else:
+            self.gui = NullGui()
         actions = {
             'detected remote': self.detected_remote,
             'activate': self.activate,
@@ -166,6 +199,7 @@ class InputInterface(object):
         self.USE_UDP_MONITOR = False  # was True with heartbeat; off now
 
     def init_gui(self, master):
+        import tkinter.messagebox
         if self.local_control is not None:
             if self.local_control.is_activated():
                 while self.local_control.is_activated():
@@ -177,14 +211,18 @@ class InputInterface(object):
         self.gui.init_gui_bitfield(master)
 
     def connection_msgbox(self, msg):
+        import tkinter.messagebox
         result = tkinter.messagebox.askquestion(msg, icon='warning')
         return result != 'no'
 
-    def _sleep_func(self, duration):
-        start = time.time()
-        while time.time() - start < duration:
-            self.master.update_idletasks()
-            self.master.update()
+    def _from_gui(self, func):
+        # wraps a GUI callback so it runs on the control thread when there is one
+        def callback(*args):
+            if self.call_in_control:
+                self.call_in_control(func, *args)
+            else:
+                func(*args)
+        return callback
 
     def command(self, cmd):
         if self.cmd_func is not None:
@@ -195,35 +233,28 @@ class InputInterface(object):
 
     def dispatch(self):
         if self.is_chair_activated and self.coasterState.state == RideState.READY_FOR_DISPATCH:
+            if self.dispatcher.is_busy():
+                return
             print('dispatch')
             self.coasterState.coaster_event(CoasterEvent.DISPATCHED)
             print("preparing to dispatch")
 
             # Chair/platform choreography as before
             self.command("ready")           # slow rise of platform
-            self.command("unparkPlatform")
-            time.sleep(.2)
-
-            # Ensure we have a coaster/station context
-            self.nl2.get_nearest_station()
+            self.command("unparkPlatform")  # the controller holds it until the rise has finished
 
-            # Non-blocking prep loop on station bits (floor/harness/gates etc.)
-            while not self.nl2.prepare_for_dispatch():
-                self._sleep_func(1)
+            # station prep, dispatch and leaving the station are advanced from service()
+            self.dispatcher.start()
 
-            # Now it's safe to dispatch
-            self.nl2.dispatch()
-            print("dispatched")
-
-            self.prev_movement_time = time.time()
-            self.isLeavingStation = True
-            while self.nl2.is_train_in_station():
-                time.sleep(.05)
+    def _dispatched(self):
+        self.prev_movement_time = time.time()
+        self.isLeavingStation = True
 
-            self.isLeavingStation = False
-            print("left station")
-            self.start_time = time.time()
-            logger.start()
+    def _left_station(self):
+        self.isLeavingStation = False
+        print("left station")
+        self.start_time = time.time()
+        logger.start()
 
     def pause(self):
         print("in pause, ride state =", self.coasterState.state)
@@ -264,20 +295,15 @@ class InputInterface(object):
             self.deactivate()
 
     def activate(self):
-        # only activate if coaster is ready for dispatch
-        print("In activate, resetting park in manual mode")
-        self.nl2.reset_park(False)
-
-        # wait until play mode (messenger updates connection_state via telemetry)
-        while self.nl2.connection_state != ConnState.READY:
-            print("waiting for play mode")
-            time.sleep(0.5)
-            self.service()
-
-        self.nl2.ensure_manual_mode(True)
-        print("selecting seat", self.seat)
-        self.nl2.select_seat(self.seat)
-
+        # the park reset, play mode wait and seat selection are advanced from service_station()
+        if self.activator.start(self.seat):
+            self.gui.set_coaster_status_label(["Activating, waiting for NoLimits play mode", "orange"])
+
+    def _activated(self, ok):
+        if not ok:
+            self.gui.set_coaster_status_label(["Activation failed, NoLimits not in play mode", "red"])
+            self.gui.set_activation_buttons(False)
+            return
         self.coasterState.coaster_event(CoasterEvent.RESETEVENT)
         self.is_chair_activated = True
         self.coasterState.set_is_chair_active(True)
@@ -287,6 +313,7 @@ class InputInterface(object):
         self.RemoteControl.send(str(RideState.READY_FOR_DISPATCH))
 
     def deactivate(self):
+       self.activator.cancel()
        if self.coasterState.state == RideState.READY_FOR_DISPATCH:
            self.RemoteControl.send(str(RideState.DEACTIVATED))
        # disable motion output first
@@ -294,6 +321,7 @@ class InputInterface(object):
        self.gui.set_activation_buttons(False)
 
        # if running, pause/park; if already paused, ensure parked
+       # (parking waits for the move to the disabled position to finish)
        if self.coasterState.state == RideState.RUNNING:
            self.pause()
        elif self.coasterState.state == RideState.PAUSED:
@@ -380,23 +408,28 @@ class InputInterface(object):
     def load_park(self, isPaused, park, seat):
         print("load park", park, "seat", seat)
         self.seat = int(seat)
+        self.dispatcher.cancel()
         self.coasterState.coaster_event(CoasterEvent.RESETEVENT)
-        self.gui.set_coaster_connection_label(("loading: " + park, "orange"))
-        self._sleep_func(2)
-
-        self.nl2.load_park(isPaused, park)
+        # progress and seat selection are handled from service() by the park loader
+        self.park_loader.start(isPaused, park, seat)
 
-        # wait until play mode after load
-        while self.nl2.connection_state != ConnState.READY:
-            self.service()
+    def _park_load_progress(self, text):
+        self.gui.set_coaster_connection_label((text, "orange"))
 
-        print("selecting seat", seat)
-        self.nl2.select_seat(int(seat))
-        self.coasterState.coaster_event(CoasterEvent.STOPPED)
+    def _park_loaded(self, park, seat, ok):
+        if ok:
+            print("selected seat", seat)
+            self.gui.set_coaster_connection_label(("Connected to NoLimits", "green3"))
+            self.coasterState.coaster_event(CoasterEvent.STOPPED)
+        else:
+            self.gui.set_coaster_connection_label(("Park load failed, select park in NoLimits", "red"))
 
     def fin(self):
         # client exit code goes here (no heartbeat to close now)
-        pass
+        self.park_loader.remember_park()
+        log.info("NL2 link round trip times:\n%s", self.nl2.stats.report())
+        if self.stats_server:
+            self.stats_server.stop()
 
     def get_current_pos(self):
         return self.current_pos
@@ -412,93 +445,47 @@ class InputInterface(object):
         self.nl2.tcp.tcp_address = (server_ip, int(port))
 
         self.nl2.begin()
-        self.gui.set_park_callback(self.load_park)
+        self.gui.set_park_callback(self._from_gui(self.load_park))
 
-        while not self.connect():
-            self._sleep_func(0.5)
+        if STATS_PORT:
+            self.stats_server = StatsServer(STATS_PORT)
+            self.stats_server.add_provider('nl2 link', self.nl2.stats.report)
+            self.stats_server.start()
 
-        # Pick nearest coaster/station so ops have context
-        self.nl2.get_nearest_station()
-
-        self.nl2.reset_park(False)
+        # connection is made by the supervisor from service(), never blocking the frame loop
+        self._reset_park_when_online = True
         return True
 
-    def connect(self, wait_for_play=False, play_timeout=3.0):
-        nl = self.nl2
-
-        # TCP
-        if not nl.tcp.is_connected:
-            self.gui.set_coaster_status_label(["Connecting to NoLimits...", "red"])
-            if not nl.connect():
-                self.gui.set_coaster_connection_label(("No connection to NoLimits, is it running?", "red"))
-                self._last_conn_state = ConnState.DISCONNECTED
-                return False
-
-        # Version probe (reachability even if telemetry/menu not available)
-        ver = nl.get_nl2_version(force=True)
-        if not ver:
-            self.gui.set_coaster_connection_label(("Connected to PC, but NL2 not responding", "red"))
+    def connect(self, require_play=False):
+        # the supervisor only touches the network while (re)connecting
+        if not self.supervisor.service():
             return False
-
-        # UI after first success
-        self.gui.set_coaster_connection_label(["Connected to NoLimits v%s" % ver, "orange"])
-
-        # Align telemetry cache age with your frame interval
-        try:
-            import platform_controller as pc
-            frame = float(getattr(pc, "FRAME_RATE_SECS", 0.05))
-        except Exception:
-            frame = 0.05
-        jitter = 0.005
-        self._max_tm_age = max(0.0, frame - jitter)
-        if hasattr(nl, "set_telem_min_interval"):
-            nl.set_telem_min_interval(self._max_tm_age)
-            
-        if wait_for_play and nl.connection_state != ConnState.READY:
-           nl.wait_for_ready(timeout=float(play_timeout), poll=0.1) 
-
+        if require_play:
+            return self.nl2.poll_ready()  # never waits, False until NoLimits is in play mode
         return True
 
-    # -------- Runtime helpers --------
-
-
-    def recover_from_estop_NoLongerUsed(self, timeout=10.0, poll=0.2):
-       """
-       Recover NL2 after an emergency stop while chair is deactivated.
-       - Reset the park
-       - Wait for play mode
-       - Ensure manual mode
-       - Refresh nearest station
-       - Drive state machine: RESETEVENT -> (when train in station) STOPPED
-       """
-       # Enter RESETTING in the logical state machine (deactivated branch)
-       self.coasterState.coaster_event(CoasterEvent.RESETEVENT)
-
-       # Ask NL2 to reset the attraction (start_paused=False has matched prior usage)
-       self.nl2.reset_park(False)
-
-       # Wait until telemetry says READY (play mode)
-       self.nl2.wait_for_ready(timeout=float(timeout), poll=float(poll))
-
-       # Ensure we have a valid coaster/station and are in manual mode
-       self.nl2.get_nearest_station()
-       self.nl2.ensure_manual_mode(True)
-
-       # If the train is in station, transition to READY_FOR_DISPATCH
-       deadline = time.time() + float(timeout)
-       while time.time() < deadline:
-           if self.nl2.is_train_in_station():
-               self.coasterState.coaster_event(CoasterEvent.STOPPED)
-               break
-           time.sleep(poll)
+    def _link_state_changed(self, state, detail):
+        if state == LinkState.ONLINE:
+            self.gui.set_coaster_connection_label([detail, "orange"])
+            if self._reset_park_when_online:
+                self._reset_park_when_online = False
+                # Pick nearest coaster/station so ops have context
+                self.nl2.get_nearest_station()
+                self.nl2.reset_park(False)
+        elif state in (LinkState.CONNECTING, LinkState.HANDSHAKING):
+            self.gui.set_coaster_connection_label((detail, "orange"))
+        else:
+            self.dispatcher.cancel()
+            self.gui.set_coaster_status_label(["Connecting to NoLimits...", "red"])
+            self.gui.set_coaster_connection_label((detail, "red"))
+            self._last_conn_state = ConnState.DISCONNECTED
 
-       # UI hint: we're recovered but not yet activated
-       self.gui.set_coaster_status_label(["Coaster connected but not activated", "orange"])
+    # -------- Runtime helpers --------
 
 
     def check_is_stationary(self, speed):
         if speed < .5:
-            if self.nl2.is_train_in_station():
+            if self.nl2.is_train_in_station_cached():
                 if self.isLeavingStation is False:
                     if self.coasterState.state == RideState.RUNNING:
                         print("train arrived in station")
@@ -517,17 +504,19 @@ class InputInterface(object):
             self.gui.set_coaster_status_label([format("Coaster is Running %2.1fm/s" % speed), "green3"])
         return False
 
-    def show_coaster_status(self):
-        # refresh bitfield for GUI (legacy expects an int)
-        if self.nl2.update_station_state():
-            self.nl2.station_status = getattr(self.nl2, 'station_state_bitfield', 0)
-            self.gui.update_bitfield(self.nl2.station_status)
+    def _station_state_changed(self, bitfield, changed):
+        # published by the messenger's station cache, only when a bit changes
+        self.nl2.station_status = bitfield  # legacy expects an int
+        self.gui.update_bitfield(bitfield)
 
+    def show_coaster_status(self):
         # update legacy 'system_status' shim from messenger
         self.nl2.system_status.is_nl2_connected = bool(self.nl2.tcp.is_connected)
         self.nl2.system_status.is_in_play_mode = (self.nl2.connection_state == ConnState.READY)
         self.nl2.system_status.is_paused = self.nl2.is_paused()
 
+        if self.park_loader.is_busy():
+            return  # the connection label is showing park load progress
         if not self.nl2.system_status.is_pc_connected:
             self.gui.set_coaster_connection_label(("Not connected to VR server", "red"))
         if not self.nl2.system_status.is_nl2_connected:
@@ -535,7 +524,7 @@ class InputInterface(object):
         elif not self.nl2.system_status.is_in_play_mode:
             self.gui.set_coaster_connection_label(("NoLimits is not in play mode", "red"))
         else:
-            self.gui.set_coaster_connection_label(("Receiving NoLimits Telemetry", "green3"))
+            self.gui.set_coaster_connection_label(("Receiving NoLimits Telemetry" + self._link_stats_text, "green3"))
 
     def log(self, data):
         if logger.is_enabled and getattr(self.nl2, 'telemetry_msg', None):
@@ -554,23 +543,30 @@ class InputInterface(object):
             log_entry = format("%.2f,%s,%s\n" % (t, xyzrpy, processed))
             logger.write(log_entry)
 
-    def service(self):
-        if self.local_control:
-            self.local_control.service()
-        self.RemoteControl.service()
+    # housekeeping the controller runs at its own rate: (name, method, rate Hz, priority)
+    PERIODIC_TASKS = (
+        ('station', 'service_station', 10, 1),
+        ('remote', 'service_remote', 10, 2),
+        ('coaster status', 'service_status', 5, 3),
+    )
 
+    def periodic_tasks(self):
+        """Tasks to run besides service(), as (name, func, rate, priority) tuples."""
+        return [(name, getattr(self, method), rate, priority)
+                for name, method, rate, priority in self.PERIODIC_TASKS]
+
+    def service(self):
+        # frame rate: telemetry, ride state and motion only
         if not self.connect():
             return
 
         nl = self.nl2
 
-        # If not in READY, re-probe version each frame to keep reachability up-to-date
-        if nl.connection_state != ConnState.READY:
-            nl.get_nl2_version(force=True)
-
-        # Telemetry at most once per frame
-        max_age = getattr(self, "_max_tm_age", 0.045)
-        tm = nl.get_telemetry_throttled(max_age=max_age)
+        # Telemetry at most once per frame; its reply also proves the link is alive
+        t = frame_metrics.now()
+        tm = nl.get_telemetry_throttled(max_age=self._max_tm_age)
+        frame_metrics.since('telemetry', t)
+        self.supervisor.observe()
 
         # State-driven UI updates (includes the "connected but not activated" message)
         cs = nl.connection_state
@@ -583,7 +579,9 @@ class InputInterface(object):
            self.speed = tm.speed
            nl.system_status.is_paused = nl.is_paused()
 
-           if not nl.system_status.is_paused:
+           if self.dispatcher.is_busy():
+               pass  # ride state follows the dispatch sequence until the train has left
+           elif not nl.system_status.is_paused:
                if self.check_is_stationary(self.speed):
                    self.coasterState.coaster_event(CoasterEvent.STOPPED)
                else:
@@ -596,15 +594,52 @@ class InputInterface(object):
                self.coasterState.coaster_event(CoasterEvent.PAUSED)
 
            # send transform to motion if active and not waiting in station
+           t = frame_metrics.now()
            t6 = nl.get_transform()
            if t6 and len(t6) == 6:
                self.current_pos = t6
+           frame_metrics.since('transform', t)
            if self.is_chair_activated and self.coasterState.state != RideState.READY_FOR_DISPATCH:
                if self.move_func:
                    self.move_func(self.current_pos)
 
+    def service_station(self):
+        # park loading, dispatch sequencing and station polling, off the frame path
+        if not self.supervisor.is_online():
+            return
+        if self.park_loader.is_busy():
+            self.park_loader.service()
+        if self.activator.is_busy():
+            self.activator.service()
+        if self.nl2.connection_state != ConnState.READY:
+            return
+        # station state is cached and polled at the adaptive station rate
+        if self.dispatcher.is_busy():
+            self.dispatcher.service()
+        else:
+            self.nl2.poll_station_state()
+
+    def service_remote(self):
+        if self.local_control:
+            self.local_control.service()
+        self.RemoteControl.service()
+
+    def service_status(self):
+        self._report_link_stats()
         self.show_coaster_status()
 
+    def _report_link_stats(self):
+        now = time.time()
+        if now >= self._next_stats_label:
+            # telemetry round trip percentiles, refreshed once a second
+            self._next_stats_label = now + 1.0
+            tm = self.nl2.stats.summary()
+            if tm:
+                self._link_stats_text = " (p50 %.1f, p99 %.1f ms)" % (tm['p50'], tm['p99'])
+        if now >= self._next_stats_log:
+            self._next_stats_log = now + LINK_STATS_LOG_SECS
+            log.info("NL2 link round trip times:\n%s", self.nl2.stats.report())
+
     def _update_conn_ui(self, cs):
         if cs == ConnState.READY:            
             if not getattr(self, "_ready_init_done", False):
@@ -626,7 +661,7 @@ class InputInterface(object):
     def _on_enter_ready(self):
        # make sure we’re focused on the right coaster/station
        self.nl2.get_nearest_station()
-       # enforce manual mode early
+       # request manual mode early; station polling confirms it and asks again if needed
        self.nl2.ensure_manual_mode(True)
        # if already in station, advance to READY_FOR_DISPATCH
        if self.nl2.is_train_in_station():
@@ -638,7 +673,7 @@ class InputInterface(object):
             self.local_control.service()
         self.RemoteControl.service()
 
-        if not self.connect(wait_for_play=False):
+        if not self.connect():
             return
 
         nl = self.nl2
@@ -683,7 +718,7 @@ class InputInterface(object):
             self.local_control.service()
         self.RemoteControl.service()
 
-        if not self.connect(wait_for_play=False):
+        if not self.connect():
             return
 
         # Poll telemetry at most once per loop interval (or reuse last sample)
@@ -0,0 +1,100 @@
+"""
+nl2_dispatch.py  non-blocking dispatch sequencing
+
+DispatchSequencer replaces the sleep-polling dispatch loops: start() arms it
+and service(), called once per frame from the client's service loop,
+advances it by at most one step. Motion and GUI keep running while the
+station closes up and the train leaves.
+"""
+
+import sys
+import time
+import logging
+
+# Perf counter compatible alias (Py3: perf_counter, Py2: clock/time)
+try:
+    perf_counter = time.perf_counter          # Py3
+except AttributeError:                        # Py2
+    perf_counter = time.clock if sys.platform.startswith('win') else time.time
+
+log = logging.getLogger(__name__)
+
+
+class DispatchState(object):
+    IDLE, PREPARING, LEAVING = list(range(3))
+
+    @staticmethod
+    def text(state):
+        return ("Idle", "Preparing", "Leaving station")[state]
+
+
+class DispatchSequencer(object):
+
+    def __init__(self, nl2, dispatched_callback=None, left_station_callback=None,
+                 prepare_interval=0.25, prepare_timeout=20.0, leave_timeout=10.0):
+        """
+        nl2 is the Nl2Messenger.
+        dispatched_callback() is called when the dispatch message has been sent,
+        left_station_callback() when the train has left (or leave_timeout expired).
+        prepare_interval throttles station actions while NL2 animates gates etc.
+        """
+        self.nl2 = nl2
+        self.dispatched_callback = dispatched_callback
+        self.left_station_callback = left_station_callback
+        self.prepare_interval = float(prepare_interval)
+        self.prepare_timeout = float(prepare_timeout)
+        self.leave_timeout = float(leave_timeout)
+        self.state = DispatchState.IDLE
+        self._deadline = 0.0
+        self._next_step = 0.0
+
+    def is_busy(self):
+        return self.state != DispatchState.IDLE
+
+    def start(self):
+        if self.is_busy():
+            log.warning("dispatch already in progress (%s)", DispatchState.text(self.state))
+            return False
+        now = perf_counter()
+        self.state = DispatchState.PREPARING
+        self._deadline = now + self.prepare_timeout
+        self._next_step = now
+        return True
+
+    def cancel(self):
+        if self.is_busy():
+            log.info("dispatch cancelled while %s", DispatchState.text(self.state).lower())
+        self.state = DispatchState.IDLE
+
+    def service(self):
+        """Advance the sequence one step; returns the current DispatchState."""
+        if self.state == DispatchState.IDLE:
+            return self.state
+        now = perf_counter()
+
+        if self.state == DispatchState.PREPARING:
+            if now >= self._next_step:
+                self._next_step = now + self.prepare_interval
+                if self.nl2.prepare_for_dispatch():
+                    self.nl2.dispatch()
+                    log.info("dispatched")
+                    self.state = DispatchState.LEAVING
+                    self._deadline = now + self.leave_timeout
+                    if self.dispatched_callback:
+                        self.dispatched_callback()
+                elif now > self._deadline:
+                    log.error("unable to prepare station for dispatch within %.0f seconds", self.prepare_timeout)
+                    self.state = DispatchState.IDLE
+
+        elif self.state == DispatchState.LEAVING:
+            # the station cache polls quickly while the train is still in the station
+            left = self.nl2.poll_station_state() and not self.nl2.is_train_in_station_cached()
+            if not left and now > self._deadline:
+                log.warning("train still reported in station %.0f seconds after dispatch", self.leave_timeout)
+                left = True
+            if left:
+                self.state = DispatchState.IDLE
+                if self.left_station_callback:
+                    self.left_station_callback()
+
+        return self.state
@@ -0,0 +1,103 @@
+# nl2_framer.py  reassembles NL2 'N'...'L' frames from a TCP byte stream
+
+"""
+NL2 frames are:  'N' msg-type(uint16) request-id(uint32) size(uint16) payload 'L'
+all big endian.
+
+The framer owns one preallocated receive buffer. The link fills it with
+recv_into() in large chunks and pulls complete frames out of it; payloads are
+returned as memoryview slices of that buffer so decoders can unpack them
+without copying. A payload view is only valid until the next call to fill().
+"""
+
+from struct import Struct
+
+FRAME_START = 0x4E  # 'N'
+FRAME_END = 0x4C    # 'L'
+
+HEADER = Struct('>HIH')  # msg type, request id, payload size
+HEADER_SIZE = 1 + HEADER.size  # including the 'N' start byte
+OVERHEAD = HEADER_SIZE + 1  # header plus the 'L' trailer
+
+
+class Nl2FramingError(Exception):
+    pass
+
+
+class Nl2Framer(object):
+
+    def __init__(self, buffer_size=4096):
+        self._buf = bytearray(int(buffer_size))
+        self._view = memoryview(self._buf)
+        self._start = 0  # first unparsed byte
+        self._end = 0    # one past the last received byte
+
+    def reset(self):
+        """Discard any buffered bytes (call after reconnecting or a framing error)."""
+        self._start = 0
+        self._end = 0
+
+    def buffered(self):
+        """Number of received bytes not yet returned as frames."""
+        return self._end - self._start
+
+    def fill(self, recv_into):
+        """
+        Receive more data into the buffer.
+
+        recv_into is called with a writable memoryview and must return the
+        number of bytes written, 0 on EOF or None on timeout/error.
+        """
+        if self._start == self._end:
+            self._start = self._end = 0
+        elif self._end == len(self._buf):
+            self._compact()
+        nbytes = recv_into(self._view[self._end:])
+        if nbytes:
+            self._end += nbytes
+        return nbytes
+
+    def next_frame(self):
+        """
+        Return (msg_type, request_id, payload) for the next complete frame,
+        or None if more data is needed. Raises Nl2FramingError on a corrupt stream.
+        """
+        avail = self._end - self._start
+        if avail == 0:
+            return None
+        start = self._start
+        if self._buf[start] != FRAME_START:
+            raise Nl2FramingError("expected 0x4E got 0x%02X" % self._buf[start])
+        if avail < HEADER_SIZE:
+            return None
+        msg_type, request_id, size = HEADER.unpack_from(self._buf, start + 1)
+        frame_len = size + OVERHEAD
+        if avail < frame_len:
+            if frame_len > len(self._buf):
+                self._grow(frame_len)
+            return None
+        end = start + frame_len
+        if self._buf[end - 1] != FRAME_END:
+            raise Nl2FramingError("invalid message trailer (expected 'L')")
+        self._start = end
+        return msg_type, request_id, self._view[start + HEADER_SIZE:end - 1]
+
+    def _compact(self):
+        # move the partial frame to the front of the buffer
+        remaining = self._end - self._start
+        self._buf[:remaining] = self._buf[self._start:self._end]
+        self._start = 0
+        self._end = remaining
+
+    def _grow(self, frame_len):
+        # payload is larger than the buffer (eg long error strings); swap in a bigger one
+        size = len(self._buf)
+        while size < frame_len:
+            size *= 2
+        buf = bytearray(size)
+        remaining = self._end - self._start
+        buf[:remaining] = self._buf[self._start:self._end]
+        self._buf = buf
+        self._view = memoryview(buf)
+        self._start = 0
+        self._end = remaining
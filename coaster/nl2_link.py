@@ -1,7 +1,7 @@
 from __future__ import print_function
 
 import sys
-from struct import pack, unpack, calcsize
+from struct import Struct
 import ctypes  # for bit fields
 import os
 import traceback
@@ -19,6 +19,8 @@ log = logging.getLogger(__name__)
 
 sys.path.insert(0, os.getcwd())  # for runtime root
 from .tcp_tx_rx import TcpTxRx, socket
+from .nl2_framer import Nl2Framer, Nl2FramingError
+from common.histogram import LatencyHistogram, perf_counter_ns
 
 
 def is_bit_set(integer, position):
@@ -33,6 +35,7 @@ class Nl2MsgType(object):
     GET_TELEMETRY = 5  # datasize 0
     TELEMETRY = 6
     GET_NEAREST_STATION = 11  # size 0, gets nearest coaster and station
+    INT_VALUE_PAIR = 12  # datasize 8, reply to GET_NEAREST_STATION
     GET_STATION_STATE = 14  # size=8 (int32=coaster index, int32=station index)
     STATION_STATE = 15  # DataSize = 4
     SET_MANUAL_MODE = 16  # datasize 9
@@ -50,6 +53,97 @@ class Nl2MsgType(object):
     RECENTER_VR = 31  # datasize 0
 
 
+MSG_TYPE_NAMES = dict((v, k) for k, v in vars(Nl2MsgType).items() if not k.startswith('_'))
+
+
+FRAME_HEADER_STRUCT = Struct('>cHIH')
+SIMPLE_FRAME_STRUCT = Struct('>cHIHc')
+
+# Precompiled payload layouts, the messenger packs requests with them.
+# REPLY_STRUCTS decode the reply to the given request type.
+STATION_STRUCT = Struct('>ii')     # coaster index, station index
+STATION_BOOL_STRUCT = Struct('>ii?')  # coaster, station, flag
+BOOL_STRUCT = Struct('>?')
+SEAT_STRUCT = Struct('>iiii')      # coaster, train, car, seat
+TELEMETRY_STRUCT = Struct('>IIIIIIIIfffffffffff')
+
+REPLY_STRUCTS = {
+    Nl2MsgType.GET_VERSION: Struct('4B'),
+    Nl2MsgType.GET_TELEMETRY: TELEMETRY_STRUCT,
+    Nl2MsgType.GET_NEAREST_STATION: STATION_STRUCT,
+    Nl2MsgType.GET_STATION_STATE: Struct('>I'),
+}
+
+
+class TelemetryRecord(object):
+    """
+    Decoded NL2 telemetry. The link owns one instance and decodes every
+    telemetry reply into it in place, so readers share the latest values.
+    """
+    __slots__ = ('state', 'frame', 'viewMode', 'coasterIndex', 'coasterStyle', 'train', 'car', 'seat',
+                 'speed', 'posX', 'posY', 'posZ', 'quatX', 'quatY', 'quatZ', 'quatW',
+                 'gForceX', 'gForceY', 'gForceZ')
+
+    def __init__(self):
+        for field in self.__slots__:
+            setattr(self, field, 0)
+
+    def decode(self, buf):
+        (self.state, self.frame, self.viewMode, self.coasterIndex, self.coasterStyle,
+         self.train, self.car, self.seat, self.speed, self.posX, self.posY, self.posZ,
+         self.quatX, self.quatY, self.quatZ, self.quatW,
+         self.gForceX, self.gForceY, self.gForceZ) = TELEMETRY_STRUCT.unpack_from(buf)
+
+    def __repr__(self):
+        return "TelemetryRecord(%s)" % ", ".join("%s=%r" % (f, getattr(self, f)) for f in self.__slots__)
+
+
+class Nl2LinkStats(object):
+    """
+    Round trip times of every request, one fixed-size histogram per
+    message type, plus counts of the ways a request can fail.
+    The link thread adds histograms while the stats server reads them,
+    so the dict is only changed, and copied for reading, under a lock.
+    """
+
+    def __init__(self):
+        self.histograms = {}   # Nl2MsgType -> LatencyHistogram
+        self._lock = threading.Lock()
+        self.timeouts = 0      # no reply (timeout or connection lost)
+        self.framing_errors = 0
+        self.not_in_play = 0   # 'Not in play mode' / 'Application is busy' replies
+        self.errors = 0        # other ERROR replies
+
+    def record_ns(self, msg_type, ns):
+        hist = self.histograms.get(msg_type)
+        if hist is None:
+            with self._lock:
+                hist = self.histograms.setdefault(msg_type, LatencyHistogram())
+        hist.record_ns(ns)
+
+    def items(self):
+        """(msg_type, histogram) pairs sorted by message type, safe to call from any thread."""
+        with self._lock:
+            return sorted(self.histograms.items())
+
+    def reset(self):
+        for _, hist in self.items():
+            hist.reset()
+        self.timeouts = self.framing_errors = self.not_in_play = self.errors = 0
+
+    def summary(self, msg_type=Nl2MsgType.GET_TELEMETRY):
+        """p50/p95/p99/max dict for one message type (see LatencyHistogram.summary)."""
+        hist = self.histograms.get(msg_type)
+        return hist.summary() if hist else None
+
+    def report(self):
+        lines = ["%-20s %s" % (MSG_TYPE_NAMES.get(t, t), h)
+                 for t, h in self.items() if h.count]
+        lines.append("timeouts=%d framing_errors=%d not_in_play=%d errors=%d" %
+                     (self.timeouts, self.framing_errors, self.not_in_play, self.errors))
+        return "\n".join(lines)
+
+
 class ConnState(object):
     DISCONNECTED, NOT_IN_SIM_MODE, READY = list(range(3))
 
@@ -61,18 +155,27 @@ class ConnState(object):
 class Nl2_Link(object):
     def __init__(self):
         self.tcp = TcpTxRx()
+        self.framer = Nl2Framer()          # preallocated receive buffer
         self.connection_state = ConnState.DISCONNECTED
         self._next_request_id = 1          # simple rolling uint32
         self.telemetry_latency_ms = None   # only for GET_TELEMETRY
+        self.telemetry = TelemetryRecord()  # decoded in place by each telemetry reply
+        self.stats = Nl2LinkStats()        # round trip histograms per message type
         self._io_lock = threading.RLock()  # serialize send/recv cycles
 
     def connect(self):
+        self.framer.reset()  # nothing buffered belongs to a new connection
         try:
             return self.tcp.connect()
         except Exception as e:
             print(e)
         return False
 
+    def start_connect(self):
+        """Begin a non-blocking connect, poll it with self.tcp.poll_connect()."""
+        self.framer.reset()
+        return self.tcp.start_connect()
+
     def is_connected(self):
         # return true if tcp connected but may not be in sim mode
         return self.tcp.is_connected
@@ -80,6 +183,7 @@ class Nl2_Link(object):
     def send_msg(self, msg_type, data=None):
         """
         Send one NL2 message and return the payload bytes, or None on failure.
+        GET_TELEMETRY returns the shared TelemetryRecord instead of bytes.
 
         Rules:
           - Only GET_TELEMETRY updates:
@@ -87,65 +191,79 @@ class Nl2_Link(object):
               * self.telemetry_latency_ms  (int milliseconds)
           - For all other messages, connection_state is NOT modified here,
             except when there is NO reply (treated as DISCONNECTED).
+          - Every round trip is recorded in self.stats.
         """
-        # measure latency only for telemetry
-        start = perf_counter() if msg_type == Nl2MsgType.GET_TELEMETRY else None
-
-        # Build, send, and wait atomically to avoid interleaving replies
+        # Build, send, wait and decode atomically: the reply is a view of the
+        # framer buffer that the next receive will overwrite
         with self._io_lock:
-            if data is not None:
-                frame = self._create_NL2_message(msg_type, self._get_msg_id(), data)
-            else:
-                frame = self._create_simple_message(msg_type, self._get_msg_id())
-            self._send_raw(frame)
-            reply = self._listen_for(msg_type)
+            request_id = self._get_msg_id()
+            start = perf_counter_ns()
+            self._send_raw(self._create_frame(msg_type, request_id, data))
+            return self._handle_reply(msg_type, self._listen_for(request_id), start)
 
+    def send_msgs(self, requests):
+        """
+        Pipeline several messages: send all (msg_type, data) requests in one
+        write, then collect the replies. Returns a list of payload bytes (or
+        None for a request that got no usable reply) in request order.
+        """
+        with self._io_lock:
+            ids = [self._get_msg_id() for _ in requests]
+            frames = [self._create_frame(msg_type, rid, data)
+                      for (msg_type, data), rid in zip(requests, ids)]
+            start = perf_counter_ns()
+            self._send_raw(b''.join(frames))
+            replies = []
+            for (msg_type, _), rid in zip(requests, ids):
+                reply = self._listen_for(rid) if self.tcp.is_connected else None
+                replies.append(self._handle_reply(msg_type, reply, start))
+            return replies
+
+    def _handle_reply(self, msg_type, reply, start):
         if reply is None:
             # No reply => assume link problem
             self.connection_state = ConnState.DISCONNECTED
             return None
 
+        reply_type, payload = reply
+        elapsed = perf_counter_ns() - start
+        self.stats.record_ns(msg_type, elapsed)
+        if reply_type == Nl2MsgType.ERROR:
+            if self._is_not_in_play_text(self._reply_to_text(bytes(payload))):
+                self.stats.not_in_play += 1
+            else:
+                self.stats.errors += 1
+
         # Non-telemetry: just return bytes; state handled elsewhere
         if msg_type != Nl2MsgType.GET_TELEMETRY:
-            return reply
+            return bytes(payload)
 
         # --- Telemetry handling: update latency + state ---
-        # Try parsing binary telemetry
-        try:
-            _ = unpack('>IIIIIIIIfffffffffff', reply)  # only need t[0] bit 0 to set state
-        except Exception:
+        # Decode binary telemetry once, straight from the receive buffer
+        if len(payload) == TELEMETRY_STRUCT.size:
+            self.telemetry.decode(payload)
+        else:
             # Some NL2 builds return text like "Not in play mode"
-            try:
-                sreply = reply.decode('utf-8', 'ignore')
-            except Exception:
-                sreply = None
+            sreply = self._reply_to_text(bytes(payload))
 
-            if sreply and ('Not in play mode' in sreply or 'Application is busy' in sreply):
+            if self._is_not_in_play_text(sreply):
                 self.connection_state = ConnState.NOT_IN_SIM_MODE
                 return None
 
             # Malformed/unexpected payload: treat as link trouble
             self.connection_state = ConnState.DISCONNECTED
-            log.error("Telemetry parse failed (len=%d)", len(reply))
+            log.error("Telemetry parse failed (len=%d)", len(payload))
             return None
 
-        # Latency for telemetry only
-        if start is not None:
-            self.telemetry_latency_ms = int((perf_counter() - start) * 1000.0)
+        self.telemetry_latency_ms = int(elapsed // 1000000)
 
         # Determine play mode from telemetry state bit (bit 0)
-        try:
-            t = unpack('>IIIIIIIIfffffffffff', reply)
-            state_flags = t[0]
-            if is_bit_set(state_flags, 0):
-                self.connection_state = ConnState.READY
-            else:
-                self.connection_state = ConnState.NOT_IN_SIM_MODE
-        except Exception:
-            # If second unpack fails (shouldn't), keep previous state
-            pass
+        if is_bit_set(self.telemetry.state, 0):
+            self.connection_state = ConnState.READY
+        else:
+            self.connection_state = ConnState.NOT_IN_SIM_MODE
 
-        return reply
+        return self.telemetry
 
     def _send_raw(self, msg):
         try:
@@ -153,88 +271,55 @@ class Nl2_Link(object):
         except Exception as e:
             print(str(e))
 
-    def _listen_for(self, msg_id):
-        """Return msg or None if no connection, invalid msg, or not in sim mode."""
+    def _listen_for(self, request_id):
+        """
+        Return (reply msg type, payload memoryview) replying to request_id,
+        or None if no connection, timeout or corrupt stream. Replies to
+        earlier requests (eg ones that timed out) are skipped.
+        The view is only valid until the next receive on this link.
+        """
+        framer = self.framer
         try:
-            # Start byte
-            startb = self._recv_exact(1)
-            if not startb or startb[:1] != b'N':
-                got = startb[:1] if startb else None
-                log.error("sock header error: expected 0x4E got %r", got)
-                return None
-
-            # Header (8 bytes): >HIH
-            hdr = self._recv_exact(8)
-            if not hdr:
-                log.error("incomplete NL2 header")
-                return None
-            try:
-                msg_type, requestId, size = unpack('>HIH', hdr)
-            except Exception as e:
-                log.error("invalid NL2 header: %s", e)
-                return None
-
-            # Payload
-            if size < 0:
-                log.error("negative payload size: %d", size)
-                return None
-            data = self._recv_exact(size) if size else b''
-            if size and not data:
-                log.error("incomplete NL2 payload, expected %d bytes", size)
-                return None
-
-            # End byte
-            endb = self._recv_exact(1)
-            if not endb or endb[:1] != b'L':
-                log.warning("Invalid message trailer (expected 'L')")
-                return None
-
-            return data
-
-        except socket.timeout:
-            log.error("timout waiting for Nl2 reply for msg id %d", msg_id)
+            while True:
+                frame = framer.next_frame()
+                if frame is None:
+                    if not framer.fill(self.tcp.receive_into):
+                        log.error("no Nl2 reply for request id %d", request_id)
+                        self.stats.timeouts += 1
+                        return None
+                    continue
+                msg_type, reply_id, payload = frame
+                if reply_id == request_id:
+                    return msg_type, payload
+                log.debug("discarding stale Nl2 reply (type %d, request id %d)", msg_type, reply_id)
+
+        except Nl2FramingError as e:
+            log.error("sock framing error: %s", e)
+            self.stats.framing_errors += 1
+            framer.reset()  # stream is out of sync, drop what we have
         except Exception as e:
             log.error("error waiting for Nl2 reply: %s", str(e))
             print(traceback.format_exc())
         return None
 
+    def _create_frame(self, msgId, requestId, data):
+        if data is not None:
+            return self._create_NL2_message(msgId, requestId, data)
+        return self._create_simple_message(msgId, requestId)
+
     def _create_simple_message(self, msgId, requestId):
         # fields are: 'N' Message-Id request-Id 0 'L'
-        result = pack('>cHIHc', b'N', msgId, requestId, 0, b'L')
-        return result
+        return SIMPLE_FRAME_STRUCT.pack(b'N', msgId, requestId, 0, b'L')
 
     def _create_NL2_message(self, msgId, requestId, data):
         # fields are: 'N' Message-Id request-Id data-size data 'L'
-        start = pack('>cHIH', b'N', msgId, requestId, len(data))
-        end = pack('>c', b'L')
-        result = start + data + end
-        return result
+        return FRAME_HEADER_STRUCT.pack(b'N', msgId, requestId, len(data)) + data + b'L'
 
     def _get_msg_id(self):
         rid = self._next_request_id & 0xFFFFFFFF
         self._next_request_id = (rid + 1) & 0xFFFFFFFF
         return rid
 
-    def _recv_exact(self, nbytes):
-        """
-        Read exactly nbytes from the socket via TcpTxRx.receive(),
-        looping until complete or a timeout/EOF occurs. Returns bytes or None.
-        """
-        total = bytearray()
-        remaining = int(nbytes)
-        while remaining > 0:
-            chunk = self.tcp.receive(remaining)
-            if not chunk:
-                return None
-            if not isinstance(chunk, (bytes, bytearray)):
-                try:
-                    chunk = bytes(chunk)
-                except Exception:
-                    return None
-            total.extend(chunk)
-            remaining = nbytes - len(total)
-        return bytes(total)
-
     # ------ shared helpers for callers (to avoid duplication elsewhere) ------
 
     def _reply_to_text(self, reply):
@@ -288,16 +373,17 @@ class Nl2_Link(object):
             log.debug("%s: unexpected non-bytes reply type %s", label, type(reply))
         return None
 
-    def _unpack_exact(self, fmt, reply, label):
+    def _unpack_reply(self, msg_type, reply, label):
         """
-        Combine size-check and struct.unpack. Returns tuple on success or None.
+        Decode the reply to msg_type with its precompiled struct.
+        Combines size-check and unpack. Returns tuple on success or None.
         """
-        expected_len = calcsize(fmt)
-        buf = self._expect_len(reply, expected_len, label)
+        fmt = REPLY_STRUCTS[msg_type]
+        buf = self._expect_len(reply, fmt.size, label)
         if buf is None:
             return None
         try:
-            return unpack(fmt, buf)
+            return fmt.unpack(buf)
         except Exception as e:
             log.error("%s: unpack failed: %s", label, e)
             return None
@@ -4,9 +4,6 @@ Copyright Michael Margolis, Middlesex University 2019; see LICENSE for software
 This version requires NoLimits attraction license and NL ver 2.5.3.5 or later
 """
 
-import sys
-from struct import pack, unpack, calcsize
-import collections
 import sys
 import ctypes  # for bit fields
 import os
@@ -25,6 +22,7 @@ sys.path.insert(0, os.getcwd())  # for runtime root
 
 from .transform import Transform
 from .nl2_link import Nl2_Link, Nl2MsgType, ConnState, is_bit_set
+from .nl2_link import STATION_STRUCT, STATION_BOOL_STRUCT, BOOL_STRUCT, SEAT_STRUCT
 
 VERBOSE_LOG = True  # set true for verbose debug logging
 
@@ -68,29 +66,31 @@ station_bit_flags = {
 
 class Nl2Messenger(Nl2_Link):
 
-    telemetryMsg = collections.namedtuple('telemetryMsg', 'state, frame, viewMode, coasterIndex,'
-                                           'coasterStyle, train, car, seat, speed, posX, posY,'
-                                           'posZ, quatX, quatY, quatZ, quatW, gForceX, gForceY, gForceZ')
-
     def __init__(self):
         super(Nl2Messenger, self).__init__()
         self.coaster = 0  # the current coaster
         self.station = 0  # current station
         self.station_msg_time = 0
-        self.telemetry_msg = None  # most recent nl2 telemetry msg
+        self.telemetry_msg = None  # most recent nl2 telemetry msg (the link's shared TelemetryRecord)
         self.is_pause_state = False
         self.transform = Transform()
         self.station_state_bitfield = 0     # cached 32-bit flags
         self._station_ts = 0.0              # last successful poll time (perf_counter units)
-        self._station_min_interval = 1.0    # default throttle (seconds)
+        self._station_listeners = []        # called with (bitfield, changed_bits) on change
+        # adaptive station poll intervals (seconds)
+        self.station_poll_in_station = 0.2  # train at (or entering) the station
+        self.station_poll_stopped = 0.5     # stationary away from the station
+        self.station_poll_moving = 1.0      # train running on the track
+        self._decode_station_state(0)
         self.version_str = None             # last successful version string
         self.handshake_ok = False           # last version probe result
-        self.telemetry_latency_ms = None    # set only on GET_TELEMETRY success
         self._last_telem_ts = 0.0
         self._telem_min_interval = 0.05     # default 50ms
         self._moving_speed_thresh = 0.5     # "moving" heuristic based on telemetry speed
         self._prev_conn_state = ConnState.DISCONNECTED
         self.desired_manual = True          # we always want manual when in play
+        self.manual_retry_interval = 0.5    # seconds between SET_MANUAL_MODE requests while not yet manual
+        self._manual_request_ts = -1e9      # time of the last SET_MANUAL_MODE request
 
         log.debug("Verbose debug logging is %s", VERBOSE_LOG)
 
@@ -116,27 +116,13 @@ class Nl2Messenger(Nl2_Link):
             self.handshake_ok = False
             return None
 
-        # Keep your existing parse logic (cccc with +48), plus safe fallbacks
-        try:
-            v0, v1, v2, v3 = unpack('cccc', reply)
-            vs = "%c.%c.%c.%c" % (
-                chr(ord(v0) + 48), chr(ord(v1) + 48),
-                chr(ord(v2) + 48), chr(ord(v3) + 48)
-            )
-        except Exception:
-            vs = None
-            try:
-                b = bytearray(reply)
-                if len(b) >= 4:
-                    vs = "%d.%d.%d.%d" % (b[0], b[1], b[2], b[3])
-            except Exception:
-                pass
-            if vs is None:
-                try:
-                    s = reply.decode("ascii", "ignore").strip()
-                    vs = s if s else None
-                except Exception:
-                    vs = None
+        res = self._unpack_reply(Nl2MsgType.GET_VERSION, reply, "get_nl2_version")
+        if res:
+            vs = "%d.%d.%d.%d" % res
+        else:
+            # fall back to a text version string
+            s = self._reply_to_text(reply)
+            vs = s.strip() if s and s.strip() else None
 
         if not vs:
             self.handshake_ok = False
@@ -168,39 +154,13 @@ class Nl2Messenger(Nl2_Link):
         return tm
 
     def get_telemetry(self):
-        start = perf_counter()
-        reply = self.send_msg(Nl2MsgType.GET_TELEMETRY)
-        if not reply:
+        # the link decodes telemetry (and sets connection state and latency) exactly once
+        tm = self.send_msg(Nl2MsgType.GET_TELEMETRY)
+        if tm is None:
             return None
-
-        # Try binary
-        try:
-            t = unpack('>IIIIIIIIfffffffffff', reply)
-            # Note: telemetry_latency_ms is also set by the link layer; keeping this is harmless
-            self.telemetry_latency_ms = int((perf_counter() - start) * 1000.0)
-            self.telemetry_msg = self.telemetryMsg._make(t)
-            state_flags = t[0]
-            self.is_pause_state = bool(state_flags & 0x4)  # bit 2
-            if state_flags & 0x1:
-                self.connection_state = ConnState.READY
-            else:
-                self.connection_state = ConnState.NOT_IN_SIM_MODE
-            return self.telemetry_msg
-        except Exception:
-            pass
-
-        # Maybe a text reply
-        try:
-            s = reply.decode('utf-8', 'ignore')
-        except Exception:
-            s = None
-
-        if s and ('Not in play mode' in s or 'Application is busy' in s):
-            self.connection_state = ConnState.NOT_IN_SIM_MODE
-            return None
-
-        # Unexpected payload
-        return None
+        self.telemetry_msg = tm
+        self.is_pause_state = bool(tm.state & 0x4)  # bit 2
+        return tm
 
     def get_transform(self):
         """ returns transform from latest telemetry msg as: xyzrpy
@@ -215,105 +175,79 @@ class Nl2Messenger(Nl2_Link):
         return self.is_pause_state
 
     def update_station_state(self):
-        # returns True if state is available (ie, play mode)
-        data = pack(">ii", self.coaster, self.station)
-        reply = self.send_msg(Nl2MsgType.GET_STATION_STATE, data)
-        res = self._unpack_exact(">I", reply, "update_station_state")
-        if not res:
+        # returns True if state is available (ie, play mode); always polls NL2
+        return self._ensure_station_state(force=True)
+
+    def add_station_listener(self, callback):
+        """callback(bitfield, changed_bits) is called whenever the station state changes."""
+        self._station_listeners.append(callback)
+
+    def poll_station_state(self):
+        """
+        Refresh the station cache if it is older than the adaptive interval;
+        call once per frame. Listeners are notified of any change, and manual
+        mode is requested again if the station has left it.
+        """
+        if not self._ensure_station_state():
             return False
-        self.station_state_bitfield = res[0]
-        self._decode_station_state(self.station_state_bitfield)
+        if self.desired_manual is not None and self.manual_dispatch != bool(self.desired_manual):
+            self.ensure_manual_mode(self.desired_manual)
         return True
 
+    def station_poll_interval(self):
+        """Fast while the train is in the station, slow while it runs on the track."""
+        if self.train_in_station and self.train_in_station_is_current:
+            return self.station_poll_in_station
+        if self._is_moving():
+            return self.station_poll_moving
+        return self.station_poll_stopped
+
     def _on_ready_transition(self):
         """Called once when we enter play mode (READY)."""
         self.get_nearest_station()  # ignore None result; indexes remain as-is on failure
-        # Enforce manual mode and verify
+        # Request manual mode; poll_station_state verifies it and asks again if needed
         self.ensure_manual_mode(self.desired_manual)
 
-    def _wait_station(self, expect_set=None, expect_clear=None, timeout=4.0, poll=0.05):
+    # station actions needed before dispatch: (ready bit, message, value)
+    DISPATCH_ACTIONS = (
+        (StationStatus.bit_gates_can_close, Nl2MsgType.SET_GATES, False),          # close gates
+        (StationStatus.bit_harness_can_close, Nl2MsgType.SET_HARNESS, False),      # close harness
+        (StationStatus.bit_flyercar_can_lock, Nl2MsgType.SET_FLYER_CAR, False),    # lock flyer
+        (StationStatus.bit_platform_can_lower, Nl2MsgType.SET_PLATFORM, True),     # lower platform
+    )
+
+    def prepare_for_dispatch(self, max_age=0.2):
         """
-        Poll station bits until conditions are met or timeout.
-        expect_set:   iterable of masks that must be 1
-        expect_clear: iterable of masks that must be 0
+        One non-blocking preparation step; call repeatedly until it returns True.
+        Every station action NL2 currently allows (gates, harness, flyer, floor)
+        is issued together in one pipelined write; NL2 only raises an action's
+        'can' bit once it is allowed, so later actions follow on later calls.
+        Returns True when the train can be dispatched.
         """
-        end = perf_counter() + float(timeout)
-        expect_set = tuple(expect_set or ())
-        expect_clear = tuple(expect_clear or ())
-
-        while perf_counter() < end:
-            if not self._ensure_station_state(force=True):
-                time.sleep(poll)
-                continue
-            bf = self.station_state_bitfield
-            ok = all(bf & m for m in expect_set) and all((bf & m) == 0 for m in expect_clear)
-            if ok:
-                return True
-            time.sleep(poll)
-        return False
-
-    def prepare_for_dispatch(self):
-        FRESH = 0.2
-
-        # Ensure manual mode
-        if not self.ensure_manual_mode(True):
-            self.set_manual_mode(True)
-            self._ensure_station_state(force=True)
+        if not self._ensure_station_state(max_age=max_age):
             return False
+        bf = self.station_state_bitfield
 
-        # If we can dispatch already, we're done.
-        if self.get_station_status(StationStatus.bit_can_dispatch, max_age=FRESH):
-            return True
-
-        # 1) Close gates
-        if self.get_station_status(StationStatus.bit_gates_can_close, max_age=FRESH):
-            self.set_gates(False)  # close
-            # Wait for "closed" condition: can_open=1, can_close=0
-            self._wait_station(
-                expect_set=[StationStatus.bit_gates_can_open],
-                expect_clear=[StationStatus.bit_gates_can_close]
-            )
-            return False
-
-        # 2) Close harness
-        if self.get_station_status(StationStatus.bit_harness_can_close, max_age=FRESH):
-            self.set_harness(False)  # close
-            # Wait for "closed": can_open=1, can_close=0
-            self._wait_station(
-                expect_set=[StationStatus.bit_harness_can_open],
-                expect_clear=[StationStatus.bit_harness_can_close]
-            )
+        if not bf & StationStatus.bit_manual:
+            self.ensure_manual_mode(True, max_age=max_age)
             return False
 
-        # 3) Lock flyer (flyers like Pterodactyl)
-        if self.get_station_status(StationStatus.bit_flyercar_can_lock, max_age=FRESH):
-            self.lock_flyer()
-            # Wait for "locked": can_unlock=1, can_lock=0
-            self._wait_station(
-                expect_set=[StationStatus.bit_flyercar_can_unlock],
-                expect_clear=[StationStatus.bit_flyercar_can_lock]
-            )
-            return False
-
-        # 4) Lower platform
-        if self.get_station_status(StationStatus.bit_platform_can_lower, max_age=FRESH):
-            self.set_floor(True)  # lower
-            # Wait for "lowered": can_raise=1, can_lower=0
-            self._wait_station(
-                expect_set=[StationStatus.bit_platform_can_raise],
-                expect_clear=[StationStatus.bit_platform_can_lower]
-            )
-            return False
+        if bf & StationStatus.bit_can_dispatch:
+            return True
 
-        # If nothing to do, check can_dispatch again
-        return self.get_station_status(StationStatus.bit_can_dispatch, max_age=FRESH)
+        requests = [(msg_type, STATION_BOOL_STRUCT.pack(self.coaster, self.station, value))
+                    for bit, msg_type, value in self.DISPATCH_ACTIONS if bf & bit]
+        if requests:
+            self.send_msgs(requests)
+            self._station_ts = 0.0  # our actions changed the station, poll again next call
+        return False
 
     def dispatch(self, coaster=None, station=None):
         if coaster is None:
             coaster = self.coaster
         if station is None:
             station = self.station
-        data = pack('>ii', coaster, station)  # coaster, station
+        data = STATION_STRUCT.pack(coaster, station)
         _ = self.send_msg(Nl2MsgType.DISPATCH, data)
 
     def get_nearest_station(self):
@@ -322,28 +256,30 @@ class Nl2Messenger(Nl2_Link):
         Returns (coaster, station) on success, or None on failure.
         """
         reply = self.send_msg(Nl2MsgType.GET_NEAREST_STATION)
-        res = self._unpack_exact(">ii", reply, "get_nearest_station")
+        res = self._unpack_reply(Nl2MsgType.GET_NEAREST_STATION, reply, "get_nearest_station")
         if not res:
             return None
         coaster, station = res
+        if (coaster, station) != (self.coaster, self.station):
+            self._station_ts = 0.0  # cached state belongs to the previous station
         self.coaster, self.station = coaster, station
         log.debug("Nearest coaster: %d, nearest station: %d", coaster, station)
         return coaster, station
 
     def set_gates(self, mode=True):  # True opens, False closes
-        data = pack('>ii?', self.coaster, self.station, mode)
+        data = STATION_BOOL_STRUCT.pack(self.coaster, self.station, mode)
         _ = self.send_msg(Nl2MsgType.SET_GATES, data)
 
     def set_harness(self, mode=True):  # True opens, False closes
-        data = pack('>ii?', self.coaster, self.station, mode)
+        data = STATION_BOOL_STRUCT.pack(self.coaster, self.station, mode)
         _ = self.send_msg(Nl2MsgType.SET_HARNESS, data)
 
     def set_floor(self, mode=True):  # True lowers, False raises
-        data = pack('>ii?', self.coaster, self.station, mode)
+        data = STATION_BOOL_STRUCT.pack(self.coaster, self.station, mode)
         _ = self.send_msg(Nl2MsgType.SET_PLATFORM, data)
 
     def set_flyer(self, mode=True):  # True on, False off
-        data = pack('>ii?', self.coaster, self.station, mode)
+        data = STATION_BOOL_STRUCT.pack(self.coaster, self.station, mode)
         _ = self.send_msg(Nl2MsgType.SET_FLYER_CAR, data)
 
     def lock_flyer(self):
@@ -353,48 +289,46 @@ class Nl2Messenger(Nl2_Link):
         return self.set_flyer(True)   # unlock == True
 
     def set_manual_mode(self, mode=True):
-        data = pack('>ii?', self.coaster, self.station, mode)  # True sets manual mode, false sets auto
+        data = STATION_BOOL_STRUCT.pack(self.coaster, self.station, mode)  # True sets manual mode, false sets auto
         _ = self.send_msg(Nl2MsgType.SET_MANUAL_MODE, data)
+        self._manual_request_ts = perf_counter()
+        self._station_ts = 0.0  # the cached manual bit predates the request, poll again
 
     def reset_vr(self):
         _ = self.send_msg(Nl2MsgType.RECENTER_VR)
         log.info("reset rift")
 
     def load_park(self, isPaused, park):
+        """
+        Request NoLimits to load a park; returns without waiting for the load.
+        NoLimits leaves play mode while loading, ParkLoader follows it back to
+        READY and restores manual mode and the station context.
+        """
         path = park.encode('utf-8')
-        data = pack('>?', isPaused) + path
+        data = BOOL_STRUCT.pack(isPaused) + path
         reply = self.send_msg(Nl2MsgType.LOAD_PARK, data)
-        if reply is None:
-            return False
-
-        # Ensure we are in play mode and have a station context
-        self.wait_for_ready(timeout=10.0)
-        self.get_nearest_station()
-
-        # Switch to manual and verify
-        self.ensure_manual_mode(True)
-        return True
+        return reply is not None
 
     def close_park(self):
         _ = self.send_msg(Nl2MsgType.CLOSE_PARK)
 
     def set_pause(self, isPaused=True):
-        data = pack('>?', isPaused)  # pause if arg is True
+        data = BOOL_STRUCT.pack(isPaused)  # pause if arg is True
         _ = self.send_msg(Nl2MsgType.SET_PAUSE, data)
 
     def unpause(self):
         self.set_pause(False)
 
     def reset_park(self, start_paused=True):
-        data = pack('>?', start_paused)  # start paused if arg is True
+        data = BOOL_STRUCT.pack(start_paused)  # start paused if arg is True
         _ = self.send_msg(Nl2MsgType.RESET_PARK, data)
 
     def select_seat(self, seat):
-        data = pack('>iiii', self.coaster, 0, 0, seat)  # coaster, train, car, seat
+        data = SEAT_STRUCT.pack(self.coaster, 0, 0, seat)  # coaster, train, car, seat
         _ = self.send_msg(Nl2MsgType.SELECT_SEAT, data)
 
     def set_attraction_mode(self, state=True):
-        data = pack('>?', state)   # enable mode if state True
+        data = BOOL_STRUCT.pack(state)   # enable mode if state True
         _ = self.send_msg(Nl2MsgType.SET_ATTRACTION_MODE, data)
 
     def get_station_status(self, mask, max_age=None, force=False):
@@ -422,37 +356,47 @@ class Nl2Messenger(Nl2_Link):
         self.train_in_station = is_bit_set(state, 11)
         self.train_in_station_is_current = is_bit_set(state, 12)
 
-    def is_train_in_station(self):
-        if self.update_station_state():
-            ret = self.train_in_station and self.train_in_station_is_current
-            return ret
+    def is_train_in_station(self, max_age=None):
+        # answered from the station cache, polled only if older than max_age (None: adaptive)
+        if self._ensure_station_state(max_age=max_age):
+            return self.train_in_station and self.train_in_station_is_current
         else:
             return False
 
+    def is_train_in_station_cached(self):
+        # never polls; the cache is refreshed by poll_station_state()
+        return self.train_in_station and self.train_in_station_is_current
+
     def _ensure_station_state(self, max_age=None, force=False):
         """
         Ensure station_state_bitfield is recent enough.
+        This is the only place GET_STATION_STATE is sent, so all callers share one cache.
         - max_age: None -> adaptive throttle; else seconds
         - force: True -> always poll now
         Returns True if we have a (possibly newly) updated bitfield.
         """
         now = perf_counter()
-        age = now - getattr(self, "_station_ts", 0.0)
+        age = now - self._station_ts
 
         if max_age is None:
-            max_age = 0.25 if not self._is_moving() else 1.0
+            max_age = self.station_poll_interval()
 
         if not force and age <= max_age:
             return True  # cached is fresh enough
 
-        data = pack(">ii", self.coaster, self.station)
+        data = STATION_STRUCT.pack(self.coaster, self.station)
         reply = self.send_msg(Nl2MsgType.GET_STATION_STATE, data)
-        res = self._unpack_exact(">I", reply, "_ensure_station_state")
+        res = self._unpack_reply(Nl2MsgType.GET_STATION_STATE, reply, "_ensure_station_state")
         if not res:
             return False
 
-        self.station_state_bitfield = res[0]
         self._station_ts = now
+        changed = res[0] ^ self.station_state_bitfield
+        if changed:
+            self.station_state_bitfield = res[0]
+            self._decode_station_state(res[0])
+            for callback in self._station_listeners:
+                callback(res[0], changed)
         return True
 
     def _is_moving(self):
@@ -463,36 +407,27 @@ class Nl2Messenger(Nl2_Link):
         """True if station is in manual mode bit."""
         return self.get_station_status(StationStatus.bit_manual, max_age=max_age)
 
-    def ensure_manual_mode(self, desired=True, retries=3, wait=0.2):
+    def ensure_manual_mode(self, desired=True, max_age=0.25):
         """
-        Ensure manual mode matches `desired` (True=manual, False=auto).
-        Verifies via station bit and retries a few times.
-        Returns True if final state matches desired else False.
+        One non-blocking step towards manual mode matching `desired` (True=manual, False=auto).
+        Answered from the station cache (polled if older than max_age); if it does not match,
+        SET_MANUAL_MODE is sent, at most once per manual_retry_interval.
+        Returns True if the station state matches desired, else False; call again later.
         """
         target = bool(desired)
-        for _ in range(int(retries)):
-            cur = self.is_manual(max_age=0.25)
-            if cur == target:
-                return True
-            # send request, wait, refresh
+        if self._ensure_station_state(max_age=max_age) and self.manual_dispatch == target:
+            return True
+        if perf_counter() - self._manual_request_ts >= self.manual_retry_interval:
             self.set_manual_mode(target)
-            time.sleep(wait)
-            self._ensure_station_state(force=True)
-        # final check
-        return self.is_manual(max_age=0.25)
+        return False
 
-    def wait_for_ready(self, timeout=8.0, poll=0.2):
+    def poll_ready(self, max_age=None):
         """
-        Poll telemetry until ConnState.READY or timeout.
-        Returns True if READY, else False.
+        Non-blocking: refreshes telemetry if older than max_age (None: the telemetry interval).
+        Returns True if NoLimits is in play mode (ConnState.READY).
         """
-        deadline = perf_counter() + float(timeout)
-        while perf_counter() < deadline:
-            self.get_telemetry()
-            if self.connection_state == ConnState.READY:
-                return True
-            time.sleep(poll)
-        return False
+        self.get_telemetry_throttled(max_age=max_age)
+        return self.connection_state == ConnState.READY
 
     def print_station_state(self):
         """
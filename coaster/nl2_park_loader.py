@@ -0,0 +1,203 @@
+"""
+nl2_park_loader.py  non-blocking park loading
+
+ParkLoader replaces the blocking load/wait loop: start() sends the load
+request and service(), called once per frame, follows NoLimits until it is
+back in play mode, then restores manual mode and selects the seat.
+Progress and the outcome are reported through callbacks so the Input tab
+can show them, and a load that never completes times out.
+
+While NoLimits loads, the values the client learned for the park on earlier
+runs, the lift height used to scale heave and the coaster/station indices,
+are fetched from ParkCache and applied, so the first ride after a park
+change starts with the right scaling instead of relearning it.
+"""
+
+import os
+import sys
+import time
+import json
+import logging
+
+# Perf counter compatible alias (Py3: perf_counter, Py2: clock/time)
+try:
+    perf_counter = time.perf_counter          # Py3
+except AttributeError:                        # Py2
+    perf_counter = time.clock if sys.platform.startswith('win') else time.time
+
+# Atomic file replace compatible alias (Py3: os.replace, Py2: rename, which Windows refuses over an existing file)
+try:
+    replace_file = os.replace                 # Py3
+except AttributeError:                        # Py2
+    def replace_file(src, dst):
+        if os.path.exists(dst):
+            os.remove(dst)
+        os.rename(src, dst)
+
+from .nl2_link import ConnState
+
+log = logging.getLogger(__name__)
+
+PARK_CACHE_FILE = 'coaster/park_cache.json'
+
+
+class ParkLoadState(object):
+    IDLE, LOADING, CONFIGURING = list(range(3))
+
+    @staticmethod
+    def text(state):
+        return ("Idle", "Loading", "Configuring")[state]
+
+
+class ParkCache(object):
+    """Lift height and coaster/station indices learned per park, kept in a small json file keyed by park path."""
+
+    def __init__(self, path=PARK_CACHE_FILE):
+        self.path = path
+        self.parks = {}
+        try:
+            with open(self.path) as f:
+                self.parks = json.load(f)
+        except (IOError, OSError):
+            pass  # no cache yet
+        except ValueError as e:
+            log.warning("ignoring unreadable park cache %s: %s", self.path, e)
+
+    def get(self, park):
+        return self.parks.get(park, {})
+
+    def update(self, park, **values):
+        entry = self.parks.setdefault(park, {})
+        if all(entry.get(k) == v for k, v in values.items()):
+            return
+        entry.update(values)
+        try:
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(self.parks, f, indent=1, sort_keys=True)
+            replace_file(tmp, self.path)
+        except (IOError, OSError) as e:
+            log.warning("unable to save park cache %s: %s", self.path, e)
+
+
+class ParkLoader(object):
+
+    def __init__(self, nl2, progress_callback=None, loaded_callback=None,
+                 timeout=30.0, step_interval=0.25, settle_time=2.0, cache=None):
+        """
+        nl2 is the Nl2Messenger.
+        progress_callback(text) is called with a short status string as loading proceeds,
+        loaded_callback(park, seat, ok) when the park is ready or loading failed.
+        timeout is the time allowed for NoLimits to load the park and return to play mode.
+        settle_time is how long after the request READY is taken to be the new park
+        even if NoLimits was never seen leaving play mode (a very quick load).
+        """
+        self.nl2 = nl2
+        self.progress_callback = progress_callback
+        self.loaded_callback = loaded_callback
+        self.timeout = float(timeout)
+        self.step_interval = float(step_interval)
+        self.settle_time = float(settle_time)
+        self.cache = cache if cache is not None else ParkCache()
+        self.state = ParkLoadState.IDLE
+        self.park = None      # park being loaded, or the last park loaded
+        self.seat = 0
+        self._name = ''
+        self._start = 0.0
+        self._next_step = 0.0
+        self._last_progress = -1
+        self._left_play = False  # NoLimits has left play mode since the load request
+
+    def is_busy(self):
+        return self.state != ParkLoadState.IDLE
+
+    def start(self, is_paused, park, seat):
+        """Request a park load; returns False if NoLimits did not accept the request."""
+        if self.is_busy():
+            log.warning("park load of %s cancelled by new load request", self._name)
+        self.remember_park()
+        self.park = park
+        self.seat = int(seat)
+        self._name = os.path.splitext(os.path.basename(park))[0]
+        self._start = self._next_step = perf_counter()
+        self._last_progress = -1
+        self._left_play = False
+        self.state = ParkLoadState.LOADING
+        self._progress("loading: " + self._name)
+
+        if not self.nl2.load_park(is_paused, park):
+            self._finish(False, "unable to load " + self._name)
+            return False
+        self._prefetch()
+        return True
+
+    def cancel(self):
+        if self.is_busy():
+            log.info("park load of %s cancelled", self._name)
+        self.state = ParkLoadState.IDLE
+
+    def remember_park(self):
+        """Store what was learned about the current park (eg its lift height) in the cache."""
+        if self.park and not self.is_busy():
+            self.cache.update(self.park, lift_height=round(self.nl2.transform.lift_height, 2),
+                              coaster=self.nl2.coaster, station=self.nl2.station)
+
+    def service(self):
+        """Advance the load one step; returns the current ParkLoadState."""
+        if self.state == ParkLoadState.IDLE:
+            return self.state
+        now = perf_counter()
+        elapsed = now - self._start
+        if elapsed > self.timeout:
+            self._finish(False, "timeout loading " + self._name)
+            return self.state
+        if now < self._next_step:
+            return self.state
+        self._next_step = now + self.step_interval
+
+        if self.state == ParkLoadState.LOADING:
+            # the client's throttled telemetry requests keep connection_state current;
+            # right after the request READY is still the old park's, so it only counts
+            # once NoLimits has left play mode or the settle time has passed
+            ready = self.nl2.connection_state == ConnState.READY
+            if not ready:
+                self._left_play = True
+            if ready and (self._left_play or elapsed >= self.settle_time):
+                self.nl2.get_nearest_station()
+                self.state = ParkLoadState.CONFIGURING
+                self._progress("configuring: " + self._name)
+            elif int(elapsed) != self._last_progress:
+                self._last_progress = int(elapsed)
+                self._progress("loading: %s (%ds)" % (self._name, self._last_progress))
+
+        elif self.state == ParkLoadState.CONFIGURING:
+            # manual mode is re-checked each step rather than waited for
+            if not self.nl2.ensure_manual_mode(True, max_age=0):
+                return self.state
+            self.nl2.select_seat(self.seat)
+            self._finish(True, "loaded: %s in %.1fs" % (self._name, elapsed))
+        return self.state
+
+    def _prefetch(self):
+        cached = self.cache.get(self.park)
+        transform = self.nl2.transform
+        transform.set_lift_height(cached.get('lift_height', transform.default_lift_height))
+        if 'coaster' in cached:
+            self.nl2.coaster = cached['coaster']
+            self.nl2.station = cached.get('station', 0)
+        if cached:
+            log.debug("park cache for %s: %s", self._name, cached)
+
+    def _finish(self, ok, text):
+        if ok:
+            log.info(text)
+        else:
+            log.error(text)
+        self.state = ParkLoadState.IDLE
+        self._progress(text)
+        if self.loaded_callback:
+            self.loaded_callback(self.park, self.seat, ok)
+
+    def _progress(self, text):
+        if self.progress_callback:
+            self.progress_callback(text)
@@ -0,0 +1,418 @@
+"""
+nl2_sim_server.py  local stand-in for the NoLimits 2 telemetry server
+
+Speaks the subset of the NL2 protocol used by Nl2_Link/Nl2Messenger
+(version, telemetry, nearest station, station state, manual mode, dispatch,
+gates/harness/platform/flyer, load/close/reset park, pause, seat select,
+attraction mode, recenter VR) so the coaster client can be run, timed and
+regression tested without a Windows PC running NoLimits.
+
+Telemetry is replayed from a csv file, or from a built-in synthetic ride if
+no file is given. The file has a header row naming its columns; 'time'
+(seconds since dispatch) is required, the other columns are any of the
+TelemetryRecord fields from speed to gForceZ. Missing fields are zero
+(quatW defaults to 1). Lines starting with '#' are ignored.
+
+Replies can be delayed (latency plus random jitter) and dropped to exercise
+the client's timeout, reconnect and pacing behaviour.
+
+Run from the project root, eg:
+    python -m coaster.nl2_sim_server --file ride.csv --speed 2 --latency 5 --jitter 3 --drop 0.01
+"""
+
+from __future__ import print_function
+
+import sys
+import time
+import math
+import random
+import socket
+import argparse
+import bisect
+import threading
+import logging
+
+# Perf counter compatible alias (Py3: perf_counter, Py2: clock/time)
+try:
+    perf_counter = time.perf_counter          # Py3
+except AttributeError:                        # Py2
+    perf_counter = time.clock if sys.platform.startswith('win') else time.time
+
+from struct import Struct
+
+from .nl2_link import Nl2MsgType, FRAME_HEADER_STRUCT, TELEMETRY_STRUCT
+from .nl2_link import STATION_STRUCT, STATION_BOOL_STRUCT, BOOL_STRUCT, SEAT_STRUCT
+from .nl2_framer import Nl2Framer, Nl2FramingError
+from .nl2_messenger import StationStatus
+
+log = logging.getLogger(__name__)
+
+VERSION = (2, 5, 7, 0)  # reported NoLimits version
+# TelemetryRecord fields taken from the replayed track
+MOTION_FIELDS = ('speed', 'posX', 'posY', 'posZ', 'quatX', 'quatY', 'quatZ', 'quatW',
+                 'gForceX', 'gForceY', 'gForceZ')
+UINT32_STRUCT = Struct('>I')
+
+
+class TelemetryTrack(object):
+    """Telemetry samples of one ride from dispatch until back in the station."""
+
+    def __init__(self, samples):
+        # samples: list of (time, tuple of MOTION_FIELDS values), time ascending
+        self.times = [t for t, _ in samples]
+        self.values = [v for _, v in samples]
+        self.duration = self.times[-1]
+
+    def sample(self, t):
+        """Sample held from the last recorded time at or before t."""
+        idx = bisect.bisect_right(self.times, t) - 1
+        return self.values[min(max(idx, 0), len(self.values) - 1)]
+
+    @classmethod
+    def from_csv(cls, path):
+        samples = []
+        with open(path) as f:
+            header = None
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                cols = [c.strip() for c in line.split(',')]
+                if header is None:
+                    header = cols
+                    if 'time' not in header:
+                        raise ValueError("%s: header has no 'time' column" % path)
+                    continue
+                row = dict(zip(header, cols))
+                values = tuple(float(row.get(f, 1.0 if f == 'quatW' else 0.0)) for f in MOTION_FIELDS)
+                samples.append((float(row['time']), values))
+        if not samples:
+            raise ValueError("%s: no telemetry rows" % path)
+        samples.sort(key=lambda s: s[0])
+        return cls(samples)
+
+    @classmethod
+    def synthetic(cls, rate=50.0):
+        """
+        A 60 second out-and-back ride: roll out of the station, chain lift to
+        32m, drop, a banked turn and airtime hills, then brake into the station.
+        """
+        samples = []
+        x = y = 0.0
+        prev_pitch = 0.0
+        dt = 1.0 / rate
+        t = 0.0
+        while t <= 60.0:
+            if t < 5.0:        # leave station
+                speed, pitch, roll = 2.0 * t / 5.0, 0.0, 0.0
+            elif t < 16.0:     # chain lift
+                speed, pitch, roll = 3.0, math.radians(30), 0.0
+            elif t < 20.0:     # first drop
+                speed, pitch, roll = 3.0 + 5.5 * (t - 16.0), -math.radians(50) * math.sin(math.pi * (t - 16.0) / 4.0), 0.0
+            elif t < 32.0:     # banked turn
+                speed, pitch, roll = 25.0 - (t - 20.0), 0.0, math.radians(60) * math.sin(math.pi * (t - 20.0) / 12.0)
+            elif t < 50.0:     # airtime hills
+                speed, pitch, roll = 13.0, math.radians(20) * math.cos(math.pi * (t - 32.0) / 3.0), 0.0
+            else:              # brakes and return to station
+                speed, pitch, roll = max(0.0, 13.0 * (1.0 - (t - 50.0) / 8.0)), 0.0, 0.0
+            x += speed * dt * math.cos(pitch)
+            y = max(0.0, y + speed * dt * math.sin(pitch)) if t < 50.0 else max(0.0, y - 4.0 * dt)
+            # quaternion from pitch (about x) and roll (about z), y up
+            cp, sp = math.cos(pitch / 2.0), math.sin(pitch / 2.0)
+            cr, sr = math.cos(roll / 2.0), math.sin(roll / 2.0)
+            quat = (sp * cr, -sp * sr, cp * sr, cp * cr)
+            g_vert = 1.0 + speed * (pitch - prev_pitch) / dt / 9.81
+            g_lat = math.sin(roll) * speed / 25.0
+            prev_pitch = pitch
+            samples.append((t, (speed, x, y, 0.0) + quat + (g_lat, g_vert, 0.0)))
+            t += dt
+        return cls(samples)
+
+
+class SimPark(object):
+    """Ride and station state of the simulated park, shared by all client connections."""
+
+    def __init__(self, track, speed=1.0, load_time=3.0, dwell_time=8.0):
+        self.track = track
+        self.speed = float(speed)          # replay speed factor
+        self.load_time = float(load_time)  # seconds not in play mode after LOAD_PARK
+        self.dwell_time = float(dwell_time)  # station time before an auto mode dispatch
+        self.lock = threading.Lock()
+        self.start = perf_counter()
+        self.play_from = self.start  # in play mode from this time
+        self.park_open = True
+        self.paused = False
+        self.manual = False
+        self.estop = False
+        self.ride_time = None        # seconds into the current ride, None in station
+        self.clock = self.start      # perf_counter time ride_time was last advanced
+        self.seat = 0
+        self._train_to_station()
+
+    # -------- state --------
+
+    def _train_to_station(self):
+        self.ride_time = None
+        self.arrived = perf_counter()
+        self.gates_closed = False
+        self.harness_closed = False
+        self.platform_lowered = False
+        self.flyer_locked = False
+
+    def in_play(self, now):
+        return self.park_open and now >= self.play_from
+
+    def advance(self, now):
+        """Move the ride clock on to now."""
+        if self.ride_time is not None and not self.paused:
+            self.ride_time += (now - self.clock) * self.speed
+            if self.ride_time >= self.track.duration:
+                self._train_to_station()
+        elif self.ride_time is None and not self.manual and not self.paused \
+                and self.in_play(now) and now - self.arrived > self.dwell_time / self.speed:
+            self.ride_time = 0.0  # auto mode dispatch
+        self.clock = now
+
+    def in_station(self):
+        # still counts as in the station while rolling out of it
+        return self.ride_time is None or self.ride_time < 1.0
+
+    def station_state(self):
+        s = StationStatus
+        in_station = self.ride_time is None
+        manual = self.manual and in_station
+        bits = 0
+        if self.estop:
+            bits |= s.bit_e_stop
+        if self.manual:
+            bits |= s.bit_manual
+        if manual:
+            if not self.gates_closed:
+                bits |= s.bit_gates_can_close
+            else:
+                bits |= s.bit_gates_can_open
+            if not self.harness_closed:
+                bits |= s.bit_harness_can_close
+            elif not self.platform_lowered:
+                bits |= s.bit_harness_can_open
+            if self.harness_closed and not self.platform_lowered:
+                bits |= s.bit_platform_can_lower
+            elif self.platform_lowered:
+                bits |= s.bit_platform_can_raise
+            if self.gates_closed and self.harness_closed and self.platform_lowered and not self.paused:
+                bits |= s.bit_can_dispatch
+        if self.in_station():
+            bits |= s.bit_train_in_station | s.bit_current_train_in_station
+        return bits
+
+    def telemetry(self, now):
+        state = 0
+        if self.in_play(now):
+            state |= 0x1
+        if self.paused:
+            state |= 0x4
+        values = self.track.sample(self.ride_time or 0.0)
+        if self.ride_time is None:
+            values = (0.0,) + values[1:]  # standing in the station
+        frame = int((now - self.start) * 60.0) & 0xFFFFFFFF
+        return TELEMETRY_STRUCT.pack(state, frame, 0, 0, 0, 0, 0, self.seat, *values)
+
+    # -------- requests --------
+
+    def handle(self, msg_type, payload):
+        """Returns (reply msg type, reply payload bytes)."""
+        now = perf_counter()
+        with self.lock:
+            self.advance(now)
+            if msg_type == Nl2MsgType.GET_VERSION:
+                return Nl2MsgType.VERSION, bytes(bytearray(VERSION))
+            if msg_type == Nl2MsgType.LOAD_PARK:
+                self.paused = BOOL_STRUCT.unpack_from(payload)[0]
+                self.park_open = True
+                self.play_from = now + self.load_time
+                self.manual = False
+                self._train_to_station()
+                log.info("loading park %s", bytes(payload[1:]).decode('utf-8', 'replace'))
+                return Nl2MsgType.OK, b''
+            if msg_type == Nl2MsgType.CLOSE_PARK:
+                self.park_open = False
+                return Nl2MsgType.OK, b''
+            if not self.in_play(now):
+                return Nl2MsgType.ERROR, b'Not in play mode'
+
+            if msg_type == Nl2MsgType.GET_TELEMETRY:
+                return Nl2MsgType.TELEMETRY, self.telemetry(now)
+            if msg_type == Nl2MsgType.GET_NEAREST_STATION:
+                return Nl2MsgType.INT_VALUE_PAIR, STATION_STRUCT.pack(0, 0)
+            if msg_type == Nl2MsgType.GET_STATION_STATE:
+                return Nl2MsgType.STATION_STATE, UINT32_STRUCT.pack(self.station_state())
+            if msg_type in self._station_actions:
+                _, _, value = STATION_BOOL_STRUCT.unpack_from(payload)
+                return self._station_actions[msg_type](self, value)
+            if msg_type == Nl2MsgType.DISPATCH:
+                if not self.station_state() & StationStatus.bit_can_dispatch:
+                    return Nl2MsgType.ERROR, b'Cannot dispatch'
+                self.ride_time = 0.0
+                return Nl2MsgType.OK, b''
+            if msg_type == Nl2MsgType.SET_PAUSE:
+                self.paused = BOOL_STRUCT.unpack_from(payload)[0]
+                return Nl2MsgType.OK, b''
+            if msg_type == Nl2MsgType.RESET_PARK:
+                self.paused = BOOL_STRUCT.unpack_from(payload)[0]
+                self._train_to_station()
+                return Nl2MsgType.OK, b''
+            if msg_type == Nl2MsgType.SELECT_SEAT:
+                self.seat = SEAT_STRUCT.unpack_from(payload)[3]
+                return Nl2MsgType.OK, b''
+            if msg_type in (Nl2MsgType.SET_ATTRACTION_MODE, Nl2MsgType.RECENTER_VR):
+                return Nl2MsgType.OK, b''
+            return Nl2MsgType.ERROR, b'Unsupported message'
+
+    def _set_manual(self, value):
+        self.manual = bool(value)
+        return Nl2MsgType.OK, b''
+
+    def _set_gates(self, value):  # True opens
+        if self.ride_time is not None or not self.manual or self.gates_closed != bool(value):
+            return Nl2MsgType.ERROR, b'Gates cannot be changed'
+        self.gates_closed = not value
+        return Nl2MsgType.OK, b''
+
+    def _set_harness(self, value):  # True opens
+        if self.ride_time is not None or not self.manual or self.platform_lowered:
+            return Nl2MsgType.ERROR, b'Harness cannot be changed'
+        self.harness_closed = not value
+        return Nl2MsgType.OK, b''
+
+    def _set_platform(self, value):  # True lowers
+        if self.ride_time is not None or not self.manual or not self.harness_closed:
+            return Nl2MsgType.ERROR, b'Platform cannot be changed'
+        self.platform_lowered = bool(value)
+        return Nl2MsgType.OK, b''
+
+    def _set_flyer(self, value):
+        return Nl2MsgType.ERROR, b'Not a flying coaster'
+
+    _station_actions = {
+        Nl2MsgType.SET_MANUAL_MODE: _set_manual,
+        Nl2MsgType.SET_GATES: _set_gates,
+        Nl2MsgType.SET_HARNESS: _set_harness,
+        Nl2MsgType.SET_PLATFORM: _set_platform,
+        Nl2MsgType.SET_FLYER_CAR: _set_flyer,
+    }
+
+
+class Nl2SimServer(object):
+
+    def __init__(self, park, address=('127.0.0.1', 15151), latency=0.0, jitter=0.0, drop_rate=0.0):
+        """
+        latency and jitter are in seconds; each reply is delayed by
+        latency + uniform(0, jitter), replies stay in request order.
+        drop_rate is the fraction of requests that get no reply.
+        """
+        self.park = park
+        self.address = address
+        self.latency = float(latency)
+        self.jitter = float(jitter)
+        self.drop_rate = float(drop_rate)
+        self.requests = 0
+        self.dropped = 0
+        self.clients = 0
+        self._sck = None
+        self._running = False
+
+    def start(self):
+        self._sck = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sck.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sck.bind(self.address)
+        self._sck.listen(4)
+        self.address = self._sck.getsockname()
+        self._running = True
+        t = threading.Thread(target=self._accept_loop)
+        t.daemon = True
+        t.start()
+        log.info("NL2 sim server listening on %s:%d", self.address[0], self.address[1])
+
+    def stop(self):
+        self._running = False
+        if self._sck:
+            self._sck.close()
+            self._sck = None
+
+    def _accept_loop(self):
+        while self._running:
+            try:
+                conn, addr = self._sck.accept()
+            except (OSError, socket.error):
+                break
+            self.clients += 1
+            log.info("client connected from %s:%d", addr[0], addr[1])
+            t = threading.Thread(target=self._client_loop, args=(conn, addr))
+            t.daemon = True
+            t.start()
+
+    def _client_loop(self, conn, addr):
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        framer = Nl2Framer()
+        due = 0.0  # send time of the previous reply, keeps replies in order
+        try:
+            while self._running:
+                if not framer.fill(conn.recv_into):
+                    break
+                while True:
+                    frame = framer.next_frame()
+                    if frame is None:
+                        break
+                    msg_type, request_id, payload = frame
+                    received = perf_counter()
+                    self.requests += 1
+                    reply_type, reply = self.park.handle(msg_type, payload)
+                    if self.drop_rate and random.random() < self.drop_rate:
+                        self.dropped += 1
+                        continue
+                    due = max(due, received + self.latency + random.uniform(0.0, self.jitter))
+                    delay = due - perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                    conn.sendall(FRAME_HEADER_STRUCT.pack(b'N', reply_type, request_id, len(reply)) + reply + b'L')
+        except Nl2FramingError as e:
+            log.error("framing error from %s:%d, closing: %s", addr[0], addr[1], e)
+        except (OSError, socket.error) as e:
+            log.info("client %s:%d: %s", addr[0], addr[1], e)
+        finally:
+            conn.close()
+            log.info("client %s:%d disconnected", addr[0], addr[1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local NoLimits 2 telemetry server stand-in")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=15151)
+    parser.add_argument('--file', help="csv telemetry to replay (default: synthetic ride)")
+    parser.add_argument('--speed', type=float, default=1.0, help="replay speed factor")
+    parser.add_argument('--latency', type=float, default=0.0, help="reply latency in ms")
+    parser.add_argument('--jitter', type=float, default=0.0, help="extra random latency up to this many ms")
+    parser.add_argument('--drop', type=float, default=0.0, help="fraction of replies to drop")
+    parser.add_argument('--load-time', type=float, default=3.0, help="seconds to load a park")
+    parser.add_argument('--manual', action='store_true', help="start in manual dispatch mode")
+    parser.add_argument('--seed', type=int, help="random seed for repeatable jitter and drops")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)-8s %(module)s: %(message)s',
+                        datefmt='%H:%M:%S')
+    if args.seed is not None:
+        random.seed(args.seed)
+    track = TelemetryTrack.from_csv(args.file) if args.file else TelemetryTrack.synthetic()
+    park = SimPark(track, speed=args.speed, load_time=args.load_time)
+    park.manual = args.manual
+    server = Nl2SimServer(park, (args.host, args.port), args.latency / 1000.0,
+                          args.jitter / 1000.0, args.drop)
+    server.start()
+    print("replaying %.1fs ride at %gx, ctrl-c to stop" % (track.duration, args.speed))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    server.stop()
+    print("%d clients, %d requests, %d replies dropped" % (server.clients, server.requests, server.dropped))
@@ -0,0 +1,151 @@
+"""
+nl2_supervisor.py  keeps the NoLimits link up without probing it every frame
+
+The supervisor handshakes (version request) once per connection, then
+judges liveness from the replies to the telemetry requests the client
+makes anyway. A link is only re-probed after it has failed: the socket is
+closed and reconnection is retried with exponential backoff and jitter.
+
+Connecting is non-blocking: service() starts a connect and then only polls
+it, so the caller's frame loop keeps running while NoLimits is unreachable.
+"""
+
+import sys
+import time
+import random
+import logging
+
+# Perf counter compatible alias (Py3: perf_counter, Py2: clock/time)
+try:
+    perf_counter = time.perf_counter          # Py3
+except AttributeError:                        # Py2
+    perf_counter = time.clock if sys.platform.startswith('win') else time.time
+
+from .nl2_link import ConnState
+
+log = logging.getLogger(__name__)
+
+
+class LinkState(object):
+    DISCONNECTED, CONNECTING, HANDSHAKING, ONLINE = list(range(4))
+
+    @staticmethod
+    def text(state):
+        return ("Disconnected", "Connecting", "Handshaking", "Online")[state]
+
+
+class Nl2Supervisor(object):
+
+    def __init__(self, nl2, state_callback=None, max_missed=3, min_backoff=0.5, max_backoff=8.0,
+                 connect_timeout=2.0):
+        """
+        nl2 is the Nl2Messenger to supervise.
+        state_callback(state, detail) is called on every LinkState change,
+        more listeners can be added with add_listener().
+        max_missed consecutive unanswered requests mark the link as lost.
+        """
+        self.nl2 = nl2
+        self.listeners = []
+        if state_callback:
+            self.listeners.append(state_callback)
+        self.max_missed = int(max_missed)
+        self.min_backoff = float(min_backoff)
+        self.max_backoff = float(max_backoff)
+        self.connect_timeout = float(connect_timeout)
+        self.state = LinkState.DISCONNECTED
+        self.missed = 0
+        self.backoff = self.min_backoff
+        self.next_attempt = 0.0       # perf_counter time of next connect attempt
+        self.connect_deadline = 0.0   # perf_counter time a pending connect is abandoned
+        self.last_alive = 0.0         # perf_counter time of last reply
+        self.reconnects = 0
+
+    def add_listener(self, callback):
+        self.listeners.append(callback)
+
+    def is_online(self):
+        return self.state == LinkState.ONLINE
+
+    def service(self):
+        """
+        Advance the state machine; call once per frame before using the link.
+        Never blocks on connect, only the handshake waits for a reply.
+        Returns True if the link is online.
+        """
+        if self.state == LinkState.ONLINE:
+            if not self.nl2.is_connected():
+                self._lost("connection closed")
+            return self.state == LinkState.ONLINE
+
+        now = perf_counter()
+        if self.state == LinkState.DISCONNECTED:
+            if now < self.next_attempt:
+                return False
+            if not self.nl2.start_connect():
+                self._retry_later(now, "No connection to NoLimits, is it running?")
+                return False
+            self.connect_deadline = now + self.connect_timeout
+            self._set_state(LinkState.CONNECTING, "Connecting to NoLimits...")
+
+        if self.state == LinkState.CONNECTING:
+            result = self.nl2.tcp.poll_connect(0)
+            if result is None:
+                if now > self.connect_deadline:
+                    self.nl2.tcp.close_socket()
+                    self._retry_later(now, "No connection to NoLimits, is it running?")
+                return False
+            if not result:
+                self._retry_later(now, "No connection to NoLimits, is it running?")
+                return False
+            self._set_state(LinkState.HANDSHAKING, "Connected to PC, waiting for NoLimits")
+
+        # one version probe per connection
+        ver = self.nl2.get_nl2_version(force=True)
+        if not ver:
+            self.nl2.tcp.close_socket()
+            self._retry_later(now, "Connected to PC, but NL2 not responding")
+            return False
+        self.missed = 0
+        self.backoff = self.min_backoff
+        self.last_alive = now
+        self._set_state(LinkState.ONLINE, "Connected to NoLimits v%s" % ver)
+        return True
+
+    def observe(self):
+        """
+        Update liveness from the outcome of the latest request on the link;
+        call after each telemetry request. Text replies such as
+        'Not in play mode' still prove the link is alive.
+        """
+        if self.state != LinkState.ONLINE:
+            return
+        if self.nl2.connection_state == ConnState.DISCONNECTED:
+            self.missed += 1
+            if self.missed >= self.max_missed:
+                self._lost("no reply to %d requests" % self.missed)
+        else:
+            self.missed = 0
+            self.last_alive = perf_counter()
+
+    def _lost(self, reason):
+        log.warning("NoLimits link lost: %s", reason)
+        self.nl2.tcp.close_socket()
+        self.nl2.connection_state = ConnState.DISCONNECTED
+        self.reconnects += 1
+        self.next_attempt = 0.0  # try once straight away, then back off
+        self._set_state(LinkState.DISCONNECTED, "Connection to NoLimits lost, reconnecting")
+
+    def _retry_later(self, now, detail):
+        # "equal jitter": wait between half and all of the current backoff
+        self.next_attempt = now + self.backoff * (0.5 + 0.5 * random.random())
+        self.backoff = min(self.backoff * 2.0, self.max_backoff)
+        self._set_state(LinkState.DISCONNECTED, detail)
+
+    def _set_state(self, state, detail):
+        if state == self.state and state != LinkState.DISCONNECTED:
+            return
+        prev, self.state = self.state, state
+        if prev != state:
+            log.info("NL2 link %s: %s", LinkState.text(state), detail)
+        for callback in self.listeners:
+            callback(state, detail)
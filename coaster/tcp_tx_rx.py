@@ -4,6 +4,7 @@ from __future__ import print_function, unicode_literals
 
 import sys
 import socket
+import select
 import errno
 import logging
 
@@ -18,6 +19,16 @@ else:
     text_type = str
     bytes_types = (bytes, bytearray)
 
+# connect_ex() results meaning a non-blocking connect is under way
+_CONNECT_PENDING = (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY,
+                    getattr(errno, 'WSAEWOULDBLOCK', 10035), 10035)
+
+# keepalive tuning: notice a rebooted or unplugged NoLimits PC within a few
+# seconds even while no requests are outstanding (probe after 2s idle, 3 probes 1s apart)
+KEEPALIVE_IDLE = 2
+KEEPALIVE_INTERVAL = 1
+KEEPALIVE_COUNT = 3
+
 
 def _to_bytes(data, encoding='utf-8', errors='strict'):
     """
@@ -44,23 +55,81 @@ class TcpTxRx(object):
         self.is_connected = False
 
     def connect(self):
+        """Blocking connect, waits up to self.timeout. Returns True if connected."""
+        if not self.start_connect():
+            return False
+        if self.poll_connect(self.timeout):
+            return True
+        if self.sck is not None:
+            log.debug('Timeout connecting to %s:%d', self.tcp_address[0], self.tcp_address[1])
+            self.close_socket()
+        return False
+
+    def start_connect(self):
+        """
+        Begin a non-blocking connect; completion is checked with poll_connect().
+        Returns False if the attempt failed immediately.
+        """
         host, port = self.tcp_address
         log.debug('Attempting to connect to %s:%d', host, port)
+        self.close_socket()
         try:
-            # Respect configured timeout
-            self.sck = socket.create_connection(self.tcp_address, self.timeout)
-            self.sck.settimeout(self.timeout)
-            self.is_connected = True
-            log.debug('Connected to %s:%d', host, port)
-            return True
-        except socket.timeout:
-            pass            
+            self.sck = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.sck.setblocking(False)
+            err = self.sck.connect_ex(self.tcp_address)
         except Exception as e:
-            # Allow caller to handle/log if they want
             log.error('Connection to %s:%d failed: %s', host, port, e)
-            self.is_connected = False
-            self.sck = None
+            self.close_socket()
+            return False
+        if err == 0 or err in _CONNECT_PENDING:
+            return True
+        log.error('Connection to %s:%d failed: %s', host, port, errno.errorcode.get(err, err))
+        self.close_socket()
+        return False
+
+    def poll_connect(self, timeout=0):
+        """
+        Check a connect started with start_connect(), waiting at most timeout seconds.
+        Returns True when connected, False if it failed, None if still in progress.
+        """
+        if self.is_connected:
+            return True
+        if self.sck is None:
+            return False
+        try:
+            _, writable, errored = select.select([], [self.sck], [self.sck], timeout)
+        except Exception as e:
+            log.error('select failed while connecting: %s', e)
+            self.close_socket()
+            return False
+        if not writable and not errored:
+            return None
+        err = self.sck.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if err:
+            host, port = self.tcp_address
+            log.debug('Connection to %s:%d failed: %s', host, port, errno.errorcode.get(err, err))
+            self.close_socket()
             return False
+        self.sck.settimeout(self.timeout)
+        self._tune_socket()
+        self.is_connected = True
+        log.debug('Connected to %s:%d', self.tcp_address[0], self.tcp_address[1])
+        return True
+
+    def _tune_socket(self):
+        # small request/reply messages: send immediately, and notice a dead peer
+        try:
+            self.sck.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.sck.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            if hasattr(socket, 'TCP_KEEPIDLE'):  # Linux
+                self.sck.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, KEEPALIVE_IDLE)
+                self.sck.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, KEEPALIVE_INTERVAL)
+                self.sck.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, KEEPALIVE_COUNT)
+            elif hasattr(socket, 'SIO_KEEPALIVE_VALS'):  # Windows, times in ms
+                self.sck.ioctl(socket.SIO_KEEPALIVE_VALS,
+                               (1, KEEPALIVE_IDLE * 1000, KEEPALIVE_INTERVAL * 1000))
+        except Exception as e:
+            log.warning("unable to set socket options: %s", e)
 
     def send(self, msg):
         if not self.is_connected or self.sck is None:
@@ -103,7 +172,32 @@ class TcpTxRx(object):
             self.is_connected = False
             return None
 
-    def close(self):
+    def receive_into(self, buf):
+        """
+        Receive into a writable buffer (eg memoryview slice).
+        Returns the number of bytes received, 0 if the peer closed, None on timeout/error.
+        """
+        if self.sck is None:
+            return None
+        try:
+            nbytes = self.sck.recv_into(buf)
+            if nbytes == 0:
+                log.warning("connection closed by %s:%d", self.tcp_address[0], self.tcp_address[1])
+                self.is_connected = False
+            return nbytes
+        except socket.timeout:
+            log.warning("timeout in receive")
+            return None
+        except socket.error as e:
+            log.error("socket error in receive: %s", e)
+            self.is_connected = False
+            return None
+        except Exception as e:
+            log.error("unhandled receive error: %s", e)
+            self.is_connected = False
+            return None
+
+    def close_socket(self):
         if self.sck:
             try:
                 self.sck.shutdown(socket.SHUT_RDWR)
@@ -114,6 +208,9 @@ class TcpTxRx(object):
             finally:
                 self.sck = None
         self.is_connected = False
+
+    def close(self):
+        self.close_socket()
         print("connection closed")
 
     # Context manager support
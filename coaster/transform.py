@@ -11,7 +11,8 @@ class Transform(object):
     def __init__(self, gain=0.6):
         self.prev_yaw = None
         self.gain = float(gain)  # adjusts level of outputs
-        self.lift_height = 32.0  # max height of lift in meters
+        self.default_lift_height = 32.0  # used for parks not seen before
+        self.lift_height = self.default_lift_height  # max height of lift in meters
 
     def reset_xform(self):
         # call this when train is dispatched (todo test if needed)
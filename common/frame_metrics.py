@@ -0,0 +1,179 @@
+"""
+frame_metrics.py  per-stage frame timing
+
+Each control frame gets one row in a fixed-size ring buffer holding the
+time spent in every stage of the motion path (telemetry receive,
+transform, shape, IK, pressure conversion, Festo send) plus the frame
+total. A stage that did not run in a frame is left as NaN, so stages
+that only run in some frames are not pulled down by zeros. Percentiles
+and deadline misses are computed on demand from the rows recorded so far,
+so recording costs only a clock read and an add.
+
+Modules time their stage against the shared frame_metrics instance:
+    t = frame_metrics.now()
+    ... stage work ...
+    t = frame_metrics.since('ik', t)
+GUI redraws run on the Tk thread and do not delay the frame, so their
+times go to a ring buffer of their own with record('gui', ns).
+Stage times are only kept from the thread that began the frame, the one
+writer of the frame rows; the watchdog thread sends pressures through
+the same stages while that thread is stalled, which is not frame time.
+"""
+
+import threading
+import time
+import numpy as np
+
+from common.scheduler import monotonic_ns
+
+STAGES = ('telemetry', 'transform', 'shape', 'ik', 'pressure', 'festo')
+BACKGROUND = ('gui',)  # work on other threads, timed per run rather than per frame
+CAPACITY = 1200  # one minute of frames at 20 Hz
+
+
+class FrameMetrics(object):
+
+    def __init__(self, stages=STAGES, capacity=CAPACITY, budget=0.05, background=BACKGROUND):
+        """budget is the frame period in seconds"""
+        self.stages = tuple(stages)
+        self.index = dict((name, i) for i, name in enumerate(self.stages))
+        self.total_col = len(self.stages)  # last column is the whole frame
+        self.rows = np.zeros((int(capacity), len(self.stages) + 1))  # microseconds
+        self.background = tuple(background)
+        self.runs = dict((name, np.zeros(int(capacity))) for name in self.background)  # microseconds
+        self.set_budget(budget)
+        self.reset()
+
+    def set_budget(self, budget):
+        self.budget_us = budget * 1e6
+
+    def reset(self):
+        self.rows[:] = np.nan
+        for runs in self.runs.values():
+            runs[:] = np.nan
+        self.run_count = dict((name, 0) for name in self.background)
+        self.pos = 0        # row being filled
+        self.filled = 0     # completed rows in the buffer
+        self.frames = 0
+        self.misses = 0
+        self.frame_start = None
+        self.late_us = 0.0
+        self.frame_thread = None  # thread that began the last frame, the only one recording stages
+
+    def now(self):
+        return monotonic_ns()
+
+    def since(self, stage, start_ns):
+        """Add the time from start_ns to now to stage; returns now for timing the next stage."""
+        now = monotonic_ns()
+        self.add(stage, now - start_ns)
+        return now
+
+    def add(self, stage, ns):
+        if threading.current_thread() is not self.frame_thread:
+            return  # eg a watchdog fade while the frame is stalled
+        row, col = self.pos, self.index[stage]
+        value = self.rows[row, col]
+        self.rows[row, col] = ns / 1000.0 if value != value else value + ns / 1000.0  # NaN until the stage runs
+
+    def record(self, name, ns):
+        """Time of one run of background work (eg a GUI redraw), called from the thread doing it."""
+        runs = self.runs[name]
+        runs[self.run_count[name] % len(runs)] = ns / 1000.0
+        self.run_count[name] += 1
+
+    def begin_frame(self, late_ns=0):
+        """late_ns is how late the frame started after its deadline"""
+        self.rows[self.pos] = np.nan
+        self.late_us = late_ns / 1000.0
+        self.frame_thread = threading.current_thread()
+        self.frame_start = monotonic_ns()
+
+    def end_frame(self):
+        if self.frame_start is None or threading.current_thread() is not self.frame_thread:
+            return
+        total = (monotonic_ns() - self.frame_start) / 1000.0 + self.late_us
+        self.rows[self.pos, self.total_col] = total
+        self.frames += 1
+        if total > self.budget_us:
+            self.misses += 1
+        self.pos = (self.pos + 1) % len(self.rows)
+        self.filled = min(self.filled + 1, len(self.rows))
+        self.frame_start = None
+
+    def percentiles(self, pcts=(50, 95, 99)):
+        """
+        Array of shape (len(pcts), stages + 1) in milliseconds over the buffered
+        frames, each stage over the frames it ran in (0 if it never ran).
+        """
+        if not self.filled:
+            return np.zeros((len(pcts), len(self.stages) + 1))
+        if self.filled < len(self.rows):
+            rows = self.rows[:self.filled]  # not wrapped yet, pos == filled
+        else:
+            rows = np.delete(self.rows, self.pos, axis=0)  # all but the frame in progress
+        return _nanpercentile(rows, pcts) / 1000.0
+
+    def background_percentiles(self, pcts=(50, 95, 99)):
+        """Array of shape (len(pcts), background) in milliseconds over the buffered runs."""
+        columns = [self.runs[name].copy() for name in self.background]  # copied, the owning thread keeps writing
+        if not columns:
+            return np.zeros((len(pcts), 0))
+        return _nanpercentile(np.column_stack(columns), pcts) / 1000.0
+
+    def recent_misses(self):
+        """Deadline misses among the buffered frames."""
+        totals = self.rows[:self.filled, self.total_col] if self.filled < len(self.rows) \
+            else np.delete(self.rows[:, self.total_col], self.pos)
+        return int(np.count_nonzero(totals > self.budget_us))
+
+    def status_line(self):
+        """Compact one line summary: frame p95 and misses, then the p95 of each stage."""
+        p95 = self.percentiles((95,))[0]
+        stages = " ".join("%s %.1f" % (name[:4], p95[i]) for i, name in enumerate(self.stages))
+        background = self.background_percentiles((95,))[0]
+        stages += "".join(" %s %.1f" % (name[:4], background[i]) for i, name in enumerate(self.background))
+        return "frame p95 %.1fms misses %d/%d | %s" % (p95[self.total_col], self.recent_misses(),
+                                                       self.filled, stages)
+
+    def report(self):
+        pct = self.percentiles((50, 95, 99, 100))
+        lines = ["%d frames, %d deadline misses (budget %.1f ms)" %
+                 (self.frames, self.misses, self.budget_us / 1000.0),
+                 "%-10s %7s %7s %7s %7s ms" % ('stage', 'p50', 'p95', 'p99', 'max')]
+        for i, name in enumerate(self.stages + ('frame',)):
+            lines.append("%-10s %7.2f %7.2f %7.2f %7.2f" % (name, pct[0, i], pct[1, i], pct[2, i], pct[3, i]))
+        pct = self.background_percentiles((50, 95, 99, 100))
+        for i, name in enumerate(self.background):
+            lines.append("%-10s %7.2f %7.2f %7.2f %7.2f  (%d runs, off the frame)" %
+                         (name, pct[0, i], pct[1, i], pct[2, i], pct[3, i], self.run_count[name]))
+        return "\n".join(lines)
+
+
+def _nanpercentile(rows, pcts):
+    # percentiles per column ignoring NaN, 0 for columns with no values
+    result = np.zeros((len(pcts), rows.shape[1]))
+    ran = ~np.isnan(rows).all(axis=0)
+    if ran.any():
+        result[:, ran] = np.nanpercentile(rows[:, ran], pcts, axis=0)
+    return result
+
+
+frame_metrics = FrameMetrics()  # shared by the modules on the motion path
+
+
+if __name__ == "__main__":
+    import random
+    m = FrameMetrics(budget=0.005)
+    for i in range(2000):
+        m.begin_frame()
+        t = m.now()
+        time.sleep(random.uniform(0, 0.002))
+        t = m.since('telemetry', t)
+        if i % 4 == 0:
+            time.sleep(0.001)
+            m.since('ik', t)  # only runs in some frames
+        m.record('gui', random.randint(1000000, 3000000))
+        m.end_frame()
+    print(m.report())
+    print(m.status_line())
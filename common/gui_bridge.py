@@ -0,0 +1,70 @@
+"""
+gui_bridge.py  passes calls between the control thread and the Tk thread
+
+Tk may only be used from the thread that created it, and the control loop
+must never wait for a redraw. Each side owns a CallQueue that the other
+posts to: the Tk thread drains its queue from a periodic after() callback,
+the control loop drains its own once per frame. GuiProxy wraps a GUI
+object so the control thread can keep calling its methods as before; the
+calls are queued and run later on the Tk thread. NullGui replaces the
+GUI when running headless.
+"""
+
+try:
+    import queue            # Py3
+except ImportError:
+    import Queue as queue   # Py2
+
+
+class CallQueue(object):
+
+    def __init__(self):
+        self._calls = queue.Queue()
+
+    def post(self, func, *args):
+        """Queue func(*args) to run on the thread that owns this queue."""
+        self._calls.put((func, args))
+
+    def run_pending(self):
+        """Run the calls queued so far; returns how many ran."""
+        count = 0
+        while True:
+            try:
+                func, args = self._calls.get_nowait()
+            except queue.Empty:
+                return count
+            func(*args)
+            count += 1
+
+
+def _ignore(*args):
+    pass
+
+
+class NullGui(object):
+    """GUI stand-in for headless operation, every method call does nothing."""
+
+    def __getattr__(self, name):
+        return _ignore
+
+
+class GuiProxy(object):
+    """
+    Stands in for a GUI object used from another thread: method calls are
+    posted to the GUI thread's CallQueue and return None; plain attributes
+    are read directly.
+    """
+
+    def __init__(self, target, calls):
+        self._target = target
+        self._calls = calls
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if not callable(attr):
+            return attr
+
+        def post(*args):
+            self._calls.post(attr, *args)
+        setattr(self, name, post)  # cache, later lookups skip __getattr__
+        return post
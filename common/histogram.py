@@ -0,0 +1,112 @@
+"""
+histogram.py  fixed-memory latency histogram
+
+HDR-style log-linear buckets: values below 2**SUB_BITS microseconds get
+one bucket each, above that every power of two is split into
+2**(SUB_BITS-1) buckets, so the relative error of any reported
+percentile is under 2**(1-SUB_BITS) (about 3% with the default 5 bits).
+Recording is a few integer operations and never allocates; memory is
+fixed by the largest trackable value.
+"""
+
+import sys
+import time
+
+# Nanosecond counter compatible alias (Py3.7+: perf_counter_ns)
+try:
+    perf_counter_ns = time.perf_counter_ns
+except AttributeError:
+    _perf_counter = getattr(time, 'perf_counter', None) or \
+        (time.clock if sys.platform.startswith('win') else time.time)
+
+    def perf_counter_ns():
+        return int(_perf_counter() * 1e9)
+
+SUB_BITS = 5
+
+
+class LatencyHistogram(object):
+    __slots__ = ('max_us', 'half', 'counts', 'count', 'total_us', 'min_us', 'max_seen_us')
+
+    def __init__(self, max_us=60 * 1000 * 1000):
+        """max_us is the largest trackable value in microseconds, larger values are clamped."""
+        self.max_us = int(max_us)
+        self.half = 1 << (SUB_BITS - 1)
+        self.counts = [0] * (self._index(self.max_us) + 1)
+        self.reset()
+
+    def reset(self):
+        for i in range(len(self.counts)):
+            self.counts[i] = 0
+        self.count = 0
+        self.total_us = 0
+        self.min_us = None
+        self.max_seen_us = 0
+
+    def _index(self, us):
+        shift = us.bit_length() - SUB_BITS
+        if shift <= 0:
+            return us
+        return shift * self.half + (us >> shift)
+
+    def _value(self, index):
+        # highest value that maps to this bucket
+        shift = index // self.half - 1
+        if shift <= 0:
+            return index
+        offset = index - shift * self.half
+        return ((offset + 1) << shift) - 1
+
+    def record(self, us):
+        """Record a value in microseconds."""
+        us = min(max(int(us), 0), self.max_us)
+        self.counts[self._index(us)] += 1
+        self.count += 1
+        self.total_us += us
+        if self.min_us is None or us < self.min_us:
+            self.min_us = us
+        if us > self.max_seen_us:
+            self.max_seen_us = us
+
+    def record_ns(self, ns):
+        self.record(ns // 1000)
+
+    def percentile(self, pct):
+        """Value in microseconds at or below which pct percent of the recorded values fall."""
+        if not self.count:
+            return 0
+        target = max(1, int(self.count * pct / 100.0 + 0.5))
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if seen >= target:
+                return min(self._value(index), self.max_seen_us)
+        return self.max_seen_us
+
+    def mean(self):
+        return self.total_us / float(self.count) if self.count else 0.0
+
+    def summary(self):
+        """Dict of count and p50/p95/p99/max in milliseconds."""
+        return {'count': self.count,
+                'p50': self.percentile(50) / 1000.0,
+                'p95': self.percentile(95) / 1000.0,
+                'p99': self.percentile(99) / 1000.0,
+                'max': self.max_seen_us / 1000.0}
+
+    def __str__(self):
+        return "n=%(count)d p50=%(p50).2f p95=%(p95).2f p99=%(p99).2f max=%(max).2f ms" % self.summary()
+
+
+if __name__ == "__main__":
+    import random
+    h = LatencyHistogram()
+    values = [random.lognormvariate(8, 0.5) for _ in range(100000)]  # ~3ms typical
+    start = perf_counter_ns()
+    for v in values:
+        h.record(v)
+    dur = (perf_counter_ns() - start) / float(len(values))
+    values.sort()
+    print(h)
+    print("exact p50=%.2f p99=%.2f ms" % (values[len(values) // 2] / 1000.0, values[int(len(values) * .99)] / 1000.0))
+    print("%d buckets, %.0f ns per record" % (len(h.counts), dur))
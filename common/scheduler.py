@@ -0,0 +1,182 @@
+"""
+scheduler.py  drift-free frame pacing
+
+FrameScheduler paces a loop to a fixed period using absolute deadlines on
+the monotonic clock: deadline n is start + n * period, so time spent in
+the frame or an oversleep never shifts later frames. Waiting sleeps until
+shortly before the deadline and spins only for the last SPIN_SECS, which
+gives sub-millisecond wakeups without keeping a core busy.
+
+A frame that starts after its deadline is an overrun; if the loop falls
+more than a whole period behind, the missed deadlines are skipped (and
+counted) rather than run back to back.
+
+TaskScheduler runs periodic tasks at their own rates from that frame loop,
+so housekeeping (station polling, GUI, remote control) does not run at the
+frame rate alongside the critical telemetry-to-output path. Given a
+FrameMetrics object it also marks the start and end of every frame there.
+"""
+
+import sys
+import time
+
+from common.histogram import LatencyHistogram
+
+# Monotonic nanosecond clock compatible alias (Py3.7+: monotonic_ns)
+try:
+    monotonic_ns = time.monotonic_ns
+except AttributeError:
+    _monotonic = getattr(time, 'monotonic', None) or \
+        (time.clock if sys.platform.startswith('win') else time.time)
+
+    def monotonic_ns():
+        return int(_monotonic() * 1e9)
+
+SPIN_SECS = 0.002  # spin for the last part of the wait, covers OS sleep granularity on Linux
+OVERRUN_SECS = 0.001  # a frame starting later than this after its deadline is an overrun
+
+
+class FrameScheduler(object):
+
+    def __init__(self, period, spin=SPIN_SECS, sleep_func=time.sleep):
+        """period and spin are in seconds"""
+        self.period_ns = int(period * 1e9)
+        self.spin_ns = int(spin * 1e9)
+        self.sleep_func = sleep_func
+        self.lateness = LatencyHistogram()  # wakeup time after the deadline
+        self.start()
+
+    def start(self):
+        """(Re)start pacing from now and clear the statistics."""
+        self.deadline = monotonic_ns() + self.period_ns
+        self.frames = 0
+        self.overruns = 0   # frames that started after their deadline
+        self.skipped = 0    # deadlines dropped after falling a whole period behind
+        self.lateness.reset()
+
+    def wait(self):
+        """
+        Block until the start of the next frame.
+        Returns how late (in ns) the frame starts, 0 or more.
+        """
+        deadline = self.deadline
+        now = monotonic_ns()
+        remaining = deadline - now
+        if remaining > self.spin_ns:
+            self.sleep_func((remaining - self.spin_ns) / 1e9)
+            now = monotonic_ns()
+        while now < deadline:
+            now = monotonic_ns()
+
+        late = now - deadline
+        if late > OVERRUN_SECS * 1e9:
+            self.overruns += 1
+        if late >= self.period_ns:
+            # too far behind to catch up, keep the phase but drop missed frames
+            missed = late // self.period_ns
+            self.skipped += missed
+            deadline += missed * self.period_ns
+        self.deadline = deadline + self.period_ns
+        self.frames += 1
+        self.lateness.record_ns(late)
+        return late
+
+    def report(self):
+        return ("frames=%d overruns=%d skipped=%d\nlateness %s" %
+                (self.frames, self.overruns, self.skipped, self.lateness))
+
+
+class PeriodicTask(object):
+    __slots__ = ('name', 'func', 'period_ns', 'priority', 'budget_ns', 'next_due', 'deferred',
+                 'runs', 'defers', 'over_budget', 'durations')
+
+    def __init__(self, name, func, period_ns, priority, budget_ns):
+        self.name = name
+        self.func = func
+        self.period_ns = period_ns  # 0 runs every frame
+        self.priority = priority
+        self.budget_ns = budget_ns
+        self.next_due = 0
+        self.deferred = 0       # consecutive frames deferred
+        self.runs = 0
+        self.defers = 0
+        self.over_budget = 0    # runs that took longer than budget
+        self.durations = LatencyHistogram()
+
+
+class TaskScheduler(object):
+    """
+    Cooperative multi-rate scheduler run from one frame loop.
+
+    Each task has a rate, a priority (0 is highest) and a budget. Every
+    frame, due tasks run in priority order. Priority 0 tasks always run;
+    others are deferred to a later frame if their budget no longer fits
+    before the next frame deadline, but never more than MAX_DEFER frames
+    running. Run times are recorded per task.
+    """
+    MAX_DEFER = 5
+
+    def __init__(self, frame_scheduler, metrics=None):
+        self.frames = frame_scheduler
+        self.metrics = metrics  # optional FrameMetrics, told where each frame begins and ends
+        self.tasks = []
+
+    def add(self, name, func, rate=None, priority=0, budget=0.005):
+        """
+        Register func() to be called rate times a second (None: every frame).
+        budget is the time in seconds the task is expected to need.
+        """
+        period_ns = int(1e9 / rate) if rate else 0
+        task = PeriodicTask(name, func, period_ns, int(priority), int(budget * 1e9))
+        self.tasks.append(task)
+        self.tasks.sort(key=lambda t: t.priority)  # stable, so registration order within a priority
+        return task
+
+    def run_frame(self):
+        """Wait for the next frame, then run the tasks that are due."""
+        late = self.frames.wait()
+        if self.metrics:
+            self.metrics.begin_frame(late)
+        frame_deadline = self.frames.deadline  # start of the frame after this one
+        for task in self.tasks:
+            now = monotonic_ns()
+            if now < task.next_due:
+                continue
+            if task.priority and task.deferred < self.MAX_DEFER and now + task.budget_ns > frame_deadline:
+                task.deferred += 1
+                task.defers += 1
+                continue
+            task.func()
+            end = monotonic_ns()
+            duration = end - now
+            task.durations.record_ns(duration)
+            task.runs += 1
+            task.deferred = 0
+            if duration > task.budget_ns:
+                task.over_budget += 1
+            if task.period_ns:
+                # next run relative to the schedule, not to when it actually ran
+                due = task.next_due + task.period_ns
+                task.next_due = due if due > now else now + task.period_ns
+        if self.metrics:
+            self.metrics.end_frame()
+
+    def report(self):
+        lines = [self.frames.report()]
+        for t in self.tasks:
+            rate = "%gHz" % (1e9 / t.period_ns) if t.period_ns else "frame"
+            lines.append("%-14s %-6s pri=%d runs=%d defers=%d over_budget=%d %s" %
+                         (t.name, rate, t.priority, t.runs, t.defers, t.over_budget, t.durations))
+        return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import random
+    sched = FrameScheduler(0.05)
+    for i in range(100):
+        sched.wait()
+        # simulate 0-30 ms of frame work
+        end = time.time() + random.uniform(0, 0.03)
+        while time.time() < end:
+            pass
+    print(sched.report())
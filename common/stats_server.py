@@ -0,0 +1,63 @@
+"""
+stats_server.py  answers local UDP queries with runtime statistics
+
+Any datagram sent to the port is answered with the text returned by the
+registered providers, eg:
+    python -c "import socket; s=socket.socket(2,2); s.sendto(b'?',('127.0.0.1',10011)); print(s.recv(65000).decode())"
+The server runs in a daemon thread and only binds to localhost by default.
+"""
+
+import socket
+import threading
+import logging
+
+log = logging.getLogger(__name__)
+
+STATS_PORT = 10011
+
+
+class StatsServer(object):
+
+    def __init__(self, port=STATS_PORT, host='127.0.0.1'):
+        self.address = (host, int(port))
+        self.providers = []   # (name, callable returning text)
+        self._sck = None
+
+    def add_provider(self, name, provider):
+        self.providers.append((name, provider))
+
+    def start(self):
+        try:
+            self._sck = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._sck.bind(self.address)
+        except (OSError, socket.error) as e:
+            log.warning("stats server not started on %s:%d: %s", self.address[0], self.address[1], e)
+            self._sck = None
+            return False
+        t = threading.Thread(target=self._serve)
+        t.daemon = True
+        t.start()
+        log.info("stats available on udp %s:%d", self.address[0], self.address[1])
+        return True
+
+    def stop(self):
+        if self._sck:
+            self._sck.close()
+            self._sck = None
+
+    def report(self):
+        lines = []
+        for name, provider in self.providers:
+            try:
+                lines.append("[%s]\n%s" % (name, provider()))
+            except Exception as e:
+                lines.append("[%s]\nerror: %s" % (name, e))
+        return "\n".join(lines) + "\n"
+
+    def _serve(self):
+        while self._sck:
+            try:
+                _, addr = self._sck.recvfrom(256)
+                self._sck.sendto(self.report().encode('utf-8')[:65000], addr)
+            except (OSError, socket.error):
+                break
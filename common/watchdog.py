@@ -0,0 +1,249 @@
+"""
+watchdog.py  frame deadline watchdog
+
+The control loop kicks the watchdog once per frame; a separate thread
+checks that the kicks keep arriving on time. A frame that ends more than
+a period plus margin after the previous one is a miss, and while the loop
+is stalled every further period without a kick counts as another miss.
+Consecutive misses escalate:
+    LATE    first miss, logged
+    FADING  fade_misses reached, fade_func(fraction) is called from the
+            watchdog thread with fraction rising from 0 to 1 over fade_secs
+    PARKED  park_misses reached, park_func() is called (it returns False
+            if the platform could not be parked yet and is retried)
+An on-time frame ends a LATE or FADING episode; PARKED stays until
+reset(), normally when the platform is enabled again.
+
+Each episode is appended as a json line to the log file, with a summary
+line when the watchdog stops, so miss statistics survive the session.
+Episodes ended by a kick are queued and written by the watchdog thread,
+so the control loop never waits for the file.
+"""
+
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from common.scheduler import monotonic_ns
+
+log = logging.getLogger(__name__)
+
+MARGIN_SECS = 0.01  # frame interval tolerated beyond the period before counting a miss
+
+
+class WatchdogLevel(object):
+    OK, LATE, FADING, PARKED = list(range(4))
+
+    @staticmethod
+    def text(level):
+        return ("OK", "LATE", "FADING", "PARKED")[level]
+
+
+class FrameWatchdog(object):
+
+    def __init__(self, period, fade_func, park_func, fade_misses=3, park_misses=20,
+                 fade_secs=1.0, log_path=None, margin=MARGIN_SECS):
+        """period, fade_secs and margin are in seconds; park_misses of 0 never parks"""
+        self.period_ns = int(period * 1e9)
+        self.limit_ns = self.period_ns + int(margin * 1e9)
+        self.fade_func = fade_func
+        self.park_func = park_func
+        self.fade_misses = fade_misses
+        self.park_misses = park_misses
+        self.fade_ns = int(fade_secs * 1e9)
+        self.log_path = log_path
+        self.level = WatchdogLevel.OK
+        self.frames = 0
+        self.misses = 0          # all missed deadlines
+        self.episodes = 0        # runs of consecutive misses
+        self.worst = 0           # most consecutive misses in one episode
+        self.fades = 0
+        self.parks = 0
+        self._lock = threading.Lock()
+        self._late = 0           # consecutive misses in this episode
+        self._gap_counted = 0    # misses already counted since the last kick
+        self._last_kick = None
+        self._suspended = 0
+        self._episode = None     # dict describing the current episode
+        self._records = []       # ended episodes not yet written to the log file
+        self._fade_start = None
+        self._thread = None
+        self._running = False
+
+    def start(self):
+        self._last_kick = monotonic_ns()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="frame watchdog")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread:
+            self._thread.join(1.0)
+            self._thread = None
+        with self._lock:
+            self._end_episode(monotonic_ns())
+        self._write_records()
+        self._persist({'summary': self.summary()})
+
+    def kick(self):
+        """Called by the control loop at the end of every frame."""
+        now = monotonic_ns()
+        with self._lock:
+            self.frames += 1
+            if self._last_kick is not None and not self._suspended:
+                gap = now - self._last_kick
+                if gap > self.limit_ns:
+                    self._count_misses(gap, now)  # the thread may already have counted some of them
+                else:
+                    self._late = 0
+                    if self.level in (WatchdogLevel.LATE, WatchdogLevel.FADING):
+                        self._end_episode(now)
+            self._gap_counted = 0
+            self._last_kick = now
+
+    def reset(self):
+        """Leave PARKED, eg when the platform is enabled again."""
+        with self._lock:
+            self._end_episode(monotonic_ns())
+            self._late = 0
+            self._gap_counted = 0
+            self._last_kick = monotonic_ns()
+
+    @contextmanager
+    def suspended(self):
+        """Frames run inside this block are expected to be slow and do not count as misses."""
+        with self._lock:
+            self._suspended += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._suspended -= 1
+                self._gap_counted = 0
+                self._last_kick = monotonic_ns()
+
+    def summary(self):
+        return {'frames': self.frames, 'misses': self.misses, 'episodes': self.episodes,
+                'worst': self.worst, 'fades': self.fades, 'parks': self.parks}
+
+    def report(self):
+        summary = self.summary()
+        summary['level'] = WatchdogLevel.text(self.level)
+        return ("level=%(level)s frames=%(frames)d misses=%(misses)d episodes=%(episodes)d "
+                "worst=%(worst)d fades=%(fades)d parks=%(parks)d" % summary)
+
+    def _count_misses(self, gap, now):
+        # called with the lock held; a gap of gap ns since the last kick holds this many missed deadlines
+        stalled = 1 + (gap - self.limit_ns) // self.period_ns if gap > self.limit_ns else 0
+        while self._gap_counted < stalled:
+            self._gap_counted += 1
+            self._late += 1
+            self._miss(now)
+
+    def _run(self):
+        interval = self.period_ns / 2e9
+        while self._running:
+            time.sleep(interval)
+            self._write_records()  # episodes ended by kicks
+            action = None
+            with self._lock:
+                if self._suspended or self._last_kick is None:
+                    continue
+                now = monotonic_ns()
+                self._count_misses(now - self._last_kick, now)
+                if self.level == WatchdogLevel.FADING:
+                    fraction = min(1.0, (now - self._fade_start) / float(self.fade_ns)) if self.fade_ns else 1.0
+                    action = (self.fade_func, fraction)
+                elif self.level == WatchdogLevel.PARKED and self._episode and not self._episode.get('parked'):
+                    action = (self.park_func,)
+            if action:
+                self._act(action)
+
+    def _act(self, action):
+        # callbacks run outside the lock so a slow park does not block kicks
+        try:
+            done = action[0](*action[1:])
+        except Exception:
+            log.exception("frame watchdog action failed")
+            return
+        if action[0] is self.park_func and done is not False:
+            with self._lock:
+                if self._episode:
+                    self._episode['parked'] = True
+                self.parks += 1
+            log.error("frame watchdog parked the platform after %d missed frames", self._late)
+
+    def _miss(self, now):
+        # called with the lock held for each new consecutive miss
+        self.misses += 1
+        if self._episode is None:
+            self.episodes += 1
+            self.level = WatchdogLevel.LATE
+            self._episode = {'start': time.strftime("%Y-%m-%d %H:%M:%S"), 'start_ns': now, 'misses': 0}
+            log.warning("frame deadline missed (%.0f ms since the last frame)",
+                        (now - self._last_kick) / 1e6)
+        self._episode['misses'] = self._late
+        self.worst = max(self.worst, self._late)
+        if self.park_misses and self._late >= self.park_misses and self.level < WatchdogLevel.PARKED:
+            self.level = WatchdogLevel.PARKED
+        elif self._late >= self.fade_misses and self.level < WatchdogLevel.FADING:
+            self.level = WatchdogLevel.FADING
+            self.fades += 1
+            self._fade_start = now
+            log.error("%d frame deadlines missed, fading motion to neutral", self._late)
+
+    def _end_episode(self, now):
+        # called with the lock held
+        episode = self._episode
+        if episode is None:
+            return
+        episode['level'] = WatchdogLevel.text(self.level)
+        episode['duration_ms'] = round((now - episode.pop('start_ns')) / 1e6, 1)
+        episode.pop('parked', None)
+        self._episode = None
+        self.level = WatchdogLevel.OK
+        self._fade_start = None
+        log.info("frame deadlines recovered after %d misses (%s)", episode['misses'], episode['level'])
+        self._records.append(episode)  # written by _write_records, outside the lock
+
+    def _write_records(self):
+        with self._lock:
+            records, self._records = self._records, []
+        for record in records:
+            self._persist(record)
+
+    def _persist(self, record):
+        if not self.log_path:
+            return
+        try:
+            with open(self.log_path, 'a') as f:
+                f.write(json.dumps(record) + "\n")
+        except (IOError, OSError) as e:
+            log.warning("unable to write %s: %s", self.log_path, e)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    def fade(fraction):
+        print("fade %.2f" % fraction)
+
+    def park():
+        print("park")
+
+    dog = FrameWatchdog(0.05, fade, park, park_misses=20)
+    dog.start()
+    for stall in (0, 0.08, 0.3, 1.5, 0):
+        for i in range(10):
+            time.sleep(0.05)
+            dog.kick()
+        time.sleep(stall)
+        dog.kick()
+        if dog.level == WatchdogLevel.PARKED:
+            dog.reset()
+    dog.stop()
+    print(dog.report())
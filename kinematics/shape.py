@@ -10,7 +10,6 @@
 
 import traceback
 import numpy as np
-import tkinter as tk
 # from moving_average import MovingAverage
 
 
@@ -34,9 +33,13 @@ class Shape(object):
         self.prev_washed = np.array([0.0, 0.0, 0.0, 0.0, 0.0, 0.0])  # previous washout values
         self.prev_value = np.array([0.0, 0.0, 0.0, 0.0, 0.0, 0.0])  # previous request
         self.intensity = 1.0 #  factor to adjust final gain from remote control
+        # set by the controller when the control loop runs on its own thread,
+        # gain and washout changes from the GUI are then handed to that thread
+        self.call_in_control = None
 
     #  method to init gui is called after begin method
     def init_gui(self, master):
+        import tkinter as tk  # only needed with a GUI
         self.master = master
         frame = tk.Frame(master)
         frame.pack()
@@ -50,13 +53,13 @@ class Shape(object):
         sLabels = ("X", "Y", "Z", "R", "P", "Y")
         for i in range(6):
             s = tk.Scale(frame, from_=2, to=0, resolution=0.1, length=120,
-                         command=lambda g, i=i: self.set_gain(i, g), label=sLabels[i])
+                         command=lambda g, i=i: self._from_gui(self.set_gain, i, g), label=sLabels[i])
             #  print "g=",self.gains[i], "<"
             s.set(float(self.gains[i]))
             s.pack(side=tk.LEFT, padx=(6, 4))
 
         s = tk.Scale(frame, from_=2, to=0, resolution=0.1, length=120,
-                     command=self.set_master_gain, label="Master")
+                     command=lambda g: self._from_gui(self.set_master_gain, g), label="Master")
         s.set(self.master_gain)
 
         s.pack(side=tk.LEFT, padx=(12, 4))
@@ -70,7 +73,7 @@ class Shape(object):
         for i in range(6):
             #  washVars.append(StringVar())
             t = tk.Entry(frame1, width=4, validate="focusout",
-                         vcmd=lambda i=i: self.set_washout(i, int(self.wash_entry_widget[i].get())))
+                         vcmd=lambda i=i: self._washout_entered(i))
             self.wash_entry_widget.append(t)
             #  t.set(float(washout_time))
             t.delete(0, tk.END)              # delete current text
@@ -191,8 +194,24 @@ class Shape(object):
         return request
 
     def update_washouts(self):
+        # the entries are read here on the Tk thread, the washouts are set between frames
         for i in range(6):
-            self.set_washout(i, int(self.wash_entry_widget[i].get()))
+            self._washout_entered(i)
+
+    def _washout_entered(self, idx):
+        try:
+            value = int(self.wash_entry_widget[idx].get())
+        except ValueError:
+            return False
+        self._from_gui(self.set_washout, idx, value)
+        return True
+
+    def _from_gui(self, func, *args):
+        # runs a GUI change on the control thread when there is one
+        if self.call_in_control:
+            self.call_in_control(func, *args)
+        else:
+            func(*args)
 
     def read_shape_config(self):
         options = {}
@@ -1,12 +1,37 @@
+"""
+d_to_p.py  table driven muscle distance to pressure conversion
+
+The csv file starts with a '# weights' (or '#weights') line listing the
+loads in kg the table was measured at, followed by one row of pressures
+(millibar, indexed by muscle compression in mm) per load for increasing
+pressure, then the same number of rows for decreasing pressure. When the
+file is loaded it is compiled into a dense int16 grid indexed by
+[load in 1 kg steps, up/down branch, compression in mm], interpolated
+between the measured loads, so set_load only selects a slice. Switching
+between the up and down rows gives the muscle hysteresis.
+
+The compiled grid is cached in CACHE_DIR as a .npy file with a json
+sidecar, named after the csv and the hash of its contents. Later loads of
+an unchanged csv memory-map the cached grid instead of parsing the text;
+editing the csv changes the hash, so the grid is rebuilt.
+"""
+
+import os
+import json
+import hashlib
 import numpy as np
 import traceback
 import logging
 
 log = logging.getLogger(__name__)
 
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dtop_cache')  # None disables the cache
+CACHE_VERSION = 1  # bump when the grid layout changes
+
 class DistanceToPressure:
-    def __init__(self, nbr_columns, max_length):
+    def __init__(self, nbr_columns, max_length, cache_dir=CACHE_DIR):
         self.nbr_columns = nbr_columns
+        self.cache_dir = cache_dir
         self.loads = None    # tuple of loads
         self.previous_compressions = None
         self.max_muscle_lengths = np.full(6, max_length, dtype=int)
@@ -16,76 +41,139 @@ class DistanceToPressure:
         self.d_to_p_up = None  # numpy rows of interpolated up values
         self.d_to_p_down = None  # numpy rows of interpolated down values
         self.d_to_p = None # self.d_to_p[0] → up table, self.d_to_p[1] → down table
+        self.grid = None  # int16 [load - loads[0] kg, branch, compression], see _compile_grid
         self.threshold = 5
 
-    def _get_loads(self, csv_path):
+    def _get_loads(self, lines):
         # returns first data row, loads tuple (or none if invalid data)
-        with open(csv_path, 'r') as file:
-            skiped_lines = 0
-            for line in file:
-                skiped_lines += 1
-                if line.startswith('# weights'):
-                    fields = line.strip().split(',')[1:] # Extract fields after '# weights'
-                    last_non_empty_index = next((i for i in reversed(range(len(fields))) if fields[i] != ''), -1)
-                    fields = fields[:last_non_empty_index + 1]
-                    loads_tuple = tuple(map(int, fields))
-                    return skiped_lines, loads_tuple
-            return None, None
+        skiped_lines = 0
+        for line in lines:
+            skiped_lines += 1
+            if line.replace(' ', '').startswith('#weights'):
+                fields = line.strip().split(',')[1:] # Extract fields after '# weights'
+                last_non_empty_index = next((i for i in reversed(range(len(fields))) if fields[i] != ''), -1)
+                fields = fields[:last_non_empty_index + 1]
+                loads_tuple = tuple(map(int, fields))
+                return skiped_lines, loads_tuple
+        return None, None
    
-    def _interpolate_load(self, d_to_p, l):
-        """Interpolate d_to_p rows between two nearest loads."""
-        d_to_p = np.asarray(d_to_p)
-
-        # Handle edge cases
-        if l <= self.loads[0]:
-            return d_to_p[0]
-        if l >= self.loads[-1]:
-            return d_to_p[-1]
-
-        # Find lower/upper bounds 
-        idx_upper = np.searchsorted(self.loads, l)
-        idx_lower = idx_upper - 1
-
-        l_lower, l_upper = self.loads[idx_lower], self.loads[idx_upper]
-        d_lower, d_upper = d_to_p[idx_lower], d_to_p[idx_upper]
-
-        interpolation_factor = (l - l_lower) / (l_upper - l_lower)
-        interpolated = (1 - interpolation_factor) * d_lower + interpolation_factor * d_upper
-        return np.round(interpolated).astype(int)
-        
+    def _compile_grid(self):
+        """Interpolate the up and down rows for every whole kg from the lowest to the highest load."""
+        tables = np.stack([self.all_d_to_p_up, self.all_d_to_p_down], axis=1).astype(float)  # [load, branch, mm]
+        loads = self.loads.astype(float)
+        kgs = np.arange(int(loads[0]), int(loads[-1]) + 1, dtype=float)
+        if len(loads) == 1:
+            grid = tables
+        else:
+            # index of the measured load at or below each kg, and the fraction of the way to the next
+            lower = np.clip(np.searchsorted(loads, kgs, side='right') - 1, 0, len(loads) - 2)
+            frac = ((kgs - loads[lower]) / (loads[lower + 1] - loads[lower]))[:, None, None]
+            grid = (1 - frac) * tables[lower] + frac * tables[lower + 1]
+        self.grid = np.ascontiguousarray(np.round(grid), dtype=np.int16)
+
     def load_data(self, csv_path):
         log.info("Using distance to Pressure file: %s" , csv_path)
+        with open(csv_path, 'rb') as file:
+            content = file.read()  # read once, for the hash and the parser
+        key = hashlib.sha1(content).hexdigest()[:16]
+        if self._load_cache(csv_path, key):
+            return True
+        if self._parse(csv_path, content.decode('utf-8').splitlines()):
+            self._save_cache(csv_path, key)
+            return True
+        return False
+
+    def _parse(self, csv_path, lines):
         try:
-            skiped_lines, loads = self._get_loads(csv_path)
+            skiped_lines, loads = self._get_loads(lines)
             # print(skiped_lines, loads)
             if loads:
                 self.loads = np.asarray(loads)
                 # Ensure sorted loads
                 if not np.all(np.diff(loads) > 0):
                     raise ValueError("loads must be in strictly ascending order.")
-                d_to_p = np.loadtxt(csv_path, delimiter=',', skiprows=skiped_lines, dtype=int)
+                d_to_p = np.atleast_2d(np.loadtxt(lines[skiped_lines:], delimiter=',', dtype=int))
                 # print(d_to_p, d_to_p.shape[1])
                 if d_to_p.shape[1] != self.nbr_columns:
                     raise ValueError(f"In {csv_path} expected {int(self.nbr_columns)} distance values, but found {d_to_p.shape[1]}")
+                if d_to_p.shape[0] % 2:
+                    raise ValueError("Up and down DtoP rows don't match")
                 self.all_d_to_p_up, self.all_d_to_p_down = np.split(d_to_p, 2)
                 # print( "up", self.all_d_to_p_up)
                 # print("down",  self.all_d_to_p_down)
-                if self.all_d_to_p_up.shape[0] != self.all_d_to_p_down.shape[0]:
-                    raise ValueError("Up and down DtoP rows don't match")
                 self.rows = self.all_d_to_p_up.shape[0]
+                if self.rows < len(self.loads):
+                    # table only measured at the first loads listed in the header
+                    log.warning("%s has %d up/down row pairs for %d loads, using loads %s",
+                                csv_path, self.rows, len(self.loads), tuple(self.loads[:self.rows].tolist()))
+                    self.loads = self.loads[:self.rows]
+                elif self.rows > len(self.loads):
+                    raise ValueError("%s has more up/down row pairs than loads" % csv_path)
                 if self.nbr_columns != self.all_d_to_p_up.shape[1]:
                     print(f"number of columns {self.all_d_to_p_up.shape[1]}, expected {self.nbr_columns} " )
+                self._compile_grid()
                 return True
             return False    
         except Exception as e:
             log.error("Error loading file: %s\n%s", e, traceback.format_exc())
             raise
+
+    def _cache_base(self, csv_path, key=None):
+        name = os.path.splitext(os.path.basename(csv_path))[0]
+        return os.path.join(self.cache_dir, "%s-%s" % (name, key) if key else name + "-")
+
+    def _load_cache(self, csv_path, key):
+        """Memory-map the grid compiled from this csv content, False if there is no usable cache."""
+        if not self.cache_dir:
+            return False
+        base = self._cache_base(csv_path, key)
+        try:
+            with open(base + '.json') as f:
+                meta = json.load(f)
+            if meta.get('version') != CACHE_VERSION or meta.get('columns') != self.nbr_columns:
+                return False
+            grid = np.load(base + '.npy', mmap_mode='r')
+            loads = np.asarray(meta['loads'])
+            if grid.shape != (loads[-1] - loads[0] + 1, 2, self.nbr_columns) or grid.dtype != np.int16:
+                return False
+        except (IOError, OSError, ValueError, KeyError) as e:
+            log.debug("no cached grid for %s: %s", csv_path, e)
+            return False
+        self.loads = loads
+        self.rows = len(loads)
+        self.grid = grid
+        log.info("Using cached distance to pressure grid %s.npy", base)
+        return True
+
+    def _save_cache(self, csv_path, key):
+        # the json sidecar is written last, a grid without one is never used
+        if not self.cache_dir:
+            return
+        base = self._cache_base(csv_path, key)
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            prefix = self._cache_base(csv_path)
+            for name in os.listdir(self.cache_dir):  # grids compiled from earlier versions of this csv
+                path = os.path.join(self.cache_dir, name)
+                if path.startswith(prefix) and not path.startswith(base):
+                    os.remove(path)
+            with open(base + '.npy.tmp', 'wb') as f:
+                np.save(f, self.grid)
+            os.replace(base + '.npy.tmp', base + '.npy')
+            meta = {'version': CACHE_VERSION, 'csv': csv_path, 'columns': self.nbr_columns,
+                    'loads': [int(l) for l in self.loads]}
+            with open(base + '.json.tmp', 'w') as f:
+                json.dump(meta, f)
+            os.replace(base + '.json.tmp', base + '.json')
+        except (IOError, OSError) as e:
+            log.warning("unable to cache distance to pressure grid in %s: %s", self.cache_dir, e)
             
     def set_load(self, load):
-        """Set load and calculate interpolation parameters."""
-        self.d_to_p_up = self._interpolate_load(self.all_d_to_p_up, load)
-        self.d_to_p_down = self._interpolate_load(self.all_d_to_p_down, load)
-        self.d_to_p = np.stack([self.d_to_p_up, self.d_to_p_down], axis=0)
+        """Select the tables for load (kg, to the nearest kg, clamped to the measured loads)."""
+        index = min(max(int(round(load)) - int(self.loads[0]), 0), len(self.grid) - 1)
+        self.d_to_p = self.grid[index]  # view, no copy
+        self.d_to_p_up, self.d_to_p_down = self.d_to_p
        #  print(f"in set_load, d_to_p stack is: {self.d_to_p}")
 
     def muscle_length_to_pressure(self, muscle_lengths):
@@ -137,6 +225,7 @@ class DistanceToPressure:
         # Convert to integer indices (truncating) and clip to [0, N-1]
         compressions = np.asarray(compressions, dtype=int)
         indices      = np.clip(compressions, 0, self.d_to_p.shape[1] - 1)
+        self.last_indices = indices  # with active_row, the cells used for this lookup
 
         # First call – initialise state & use the up row (row 0)
         if not hasattr(self, "prev_compressions"):
@@ -0,0 +1,137 @@
+"""
+d_to_p_learner.py  online refinement of the distance to pressure table
+
+There is no length sensing on the muscles, but the Festo controller
+reports the pressure it actually reached (flag words 10-15). With the
+table model each frame commands, per muscle, the pressure found at a
+compression on the up or down branch. The learner keeps an exponential
+moving average of achieved / commanded pressure for every muscle, branch
+and compression (a running mean until a cell has 1/ALPHA readings), an
+O(1) update of six cells per frame. Readings are paired with the command
+of the previous frame since the pressure lags the command: the reading
+returned with a frame's packet is taken before the Festo acts on it.
+
+save() writes the table divided by the learned ratio (averaged over the
+muscles that have enough samples for that cell), so commanding the
+refined table delivers the measured pressures. It is written in the csv
+layout read by DistanceToPressure and compiled into its grid cache, so
+the refined table loads as fast as the original. The rows are taken on
+the calling thread; writing and compiling run on a background thread so
+a save does not hold up the control loop.
+"""
+
+import os
+import logging
+import threading
+import numpy as np
+
+from output.d_to_p import DistanceToPressure
+
+log = logging.getLogger(__name__)
+
+ALPHA = 0.02        # weight of a new reading in the moving average
+MIN_SAMPLES = 50    # readings a cell needs before it affects the table
+MIN_PRESSURE = 100  # millibar, lower commands are too noisy to learn from
+MAX_CORRECTION = 0.25  # learned ratios are limited to 1 +/- this
+
+
+class DtoPLearner(object):
+
+    def __init__(self, d_to_p, alpha=ALPHA, min_samples=MIN_SAMPLES):
+        self.d_to_p = d_to_p
+        self.alpha = alpha
+        self.min_samples = min_samples
+        columns = d_to_p.grid.shape[2]
+        self.ratio = np.ones((6, 2, columns))   # achieved / commanded per muscle, branch, compression
+        self.count = np.zeros((6, 2, columns), dtype=np.int32)
+        self.updates = 0
+        self._saved_updates = 0
+        self._muscles = np.arange(6)
+        self._pending = None   # (branches, indices, pressures) of this frame's command
+        self._previous = None  # the same for the frame before, what a reading is compared with
+        self._saver = None
+
+    def commanded(self, pressures):
+        """Note the pressures just looked up by d_to_p, call once per frame."""
+        self._previous = self._pending
+        self._pending = (self.d_to_p.active_row.copy(), self.d_to_p.last_indices.copy(),
+                         np.array(pressures, dtype=float))
+
+    def achieved(self, pressures):
+        """Pressures read back from the Festo controller, compared with the command of the frame before."""
+        previous, self._previous = self._previous, None
+        if previous is None:
+            return
+        branches, indices, commanded = previous
+        achieved = np.asarray(pressures[:6], dtype=float)
+        valid = (commanded >= MIN_PRESSURE) & (achieved > 0)  # zero means no reading
+        if not valid.any():
+            return
+        cell = (self._muscles[valid], branches[valid], indices[valid])
+        ratio = np.clip(achieved[valid] / commanded[valid], 1 - MAX_CORRECTION, 1 + MAX_CORRECTION)
+        self.count[cell] += 1
+        # a plain mean until there are 1/alpha readings, then a moving average that tracks aging
+        weight = np.maximum(self.alpha, 1.0 / self.count[cell])
+        self.ratio[cell] += weight * (ratio - self.ratio[cell])
+        self.updates += 1
+
+    def correction(self):
+        """Learned ratio per branch and compression, 1 where no muscle has enough samples."""
+        learned = self.count >= self.min_samples
+        muscles = learned.sum(axis=0)
+        total = np.where(learned, self.ratio, 0).sum(axis=0)
+        return np.where(muscles > 0, total / np.maximum(muscles, 1), 1.0)
+
+    def refined_rows(self):
+        """Table rows at the measured loads corrected by the learned ratios, shape [load, branch, mm]."""
+        loads = np.asarray(self.d_to_p.loads)
+        rows = self.d_to_p.grid[loads - loads[0]].astype(float)
+        return np.clip(np.round(rows / self.correction()), 0, np.iinfo(np.int16).max).astype(int)
+
+    def save(self, csv_path, wait=True):
+        """
+        Write the refined table if anything was learned since the last save.
+        The file is written on a background thread, waited for if wait is set;
+        returns True if a save was started.
+        """
+        if self.updates == self._saved_updates:
+            return False
+        if self._saver and self._saver.is_alive():
+            if not wait:
+                return False  # the last save is still writing, try again next time
+            self._saver.join()
+        d_to_p = self.d_to_p
+        snapshot = (csv_path, self.refined_rows(), [int(l) for l in d_to_p.loads], self.updates, self.report(),
+                    (d_to_p.nbr_columns, int(d_to_p.max_muscle_lengths[0]), d_to_p.cache_dir))
+        self._saver = threading.Thread(target=self._write, args=snapshot, name="pressure table save")
+        self._saver.daemon = True
+        self._saver.start()
+        if wait:
+            self._saver.join()
+        return True
+
+    def _write(self, csv_path, rows, loads, updates, report, table_args):
+        # runs on the save thread with a snapshot taken by save()
+        lines = ["# weights," + ",".join(str(l) for l in loads)]
+        for branch in (0, 1):  # all up rows, then all down rows
+            lines.extend(",".join(str(p) for p in row) for row in rows[:, branch])
+        try:
+            tmp = csv_path + '.tmp'
+            with open(tmp, 'w') as f:
+                f.write("\n".join(lines) + "\n")
+            os.replace(tmp, csv_path)
+            # compile it into the grid cache now so loading the refined table is instant
+            DistanceToPressure(*table_args).load_data(csv_path)
+        except (IOError, OSError) as e:
+            log.warning("Unable to save learned pressure table %s: %s", csv_path, e)
+            return
+        self._saved_updates = updates
+        log.info("Saved refined distance to pressure table %s (%s)", csv_path, report)
+
+    def report(self):
+        learned = self.count >= self.min_samples
+        if not learned.any():
+            return "%d readings, no cells learned yet" % self.updates
+        error = np.abs(self.ratio[learned] - 1) * 100
+        return ("%d readings, %d cells learned, pressure error mean %.1f%% max %.1f%%" %
+                (self.updates, int(learned.sum()), error.mean(), error.max()))
@@ -0,0 +1,220 @@
+"""
+festo_link.py  sequence numbered EasyIP exchange with the Festo controller
+
+Every packet sent through FestoLink gets the next value of a rolling
+counter (1-65535), and the Festo echoes it in its acknowledgement, so a
+reply is matched to the packet it answers rather than to whatever packet
+was sent last. Replies are read without blocking: acks that arrive after
+their frame are still matched when the next packet is sent. A caller
+that needs the reply (closed loop pressure readback) waits at most
+deadline seconds, a short part of the frame, instead of a socket timeout.
+
+Statistics kept per link:
+    lost        packets with no ack after loss_secs
+    late        acks that arrived after their packet was counted as lost
+    missed      waits for a reply that ran past the deadline
+    reordered   acks that arrived after an ack for a newer packet
+    errors      replies that are not responses or report an error
+    unexpected  datagrams that are not a valid reply, or acks with a counter
+                that was never sent or already acked
+    socket_errors  sends or receives that failed, e.g. the connection reset
+                Windows reports after an ICMP port unreachable while the
+                Festo is off or rebooting
+and a histogram of round trip times with the same percentiles as the NL2 link.
+"""
+
+import logging
+import select
+from collections import OrderedDict
+from struct import error as StructError
+
+from common.histogram import LatencyHistogram
+from common.scheduler import monotonic_ns
+from output.fstlib import easyip
+
+log = logging.getLogger(__name__)
+
+EXPIRED_KEEP = 256        # lost counters remembered to recognise late acks
+BUFFER_SIZE = 1024
+
+
+class FestoLink(object):
+
+    def __init__(self, sock, addr, deadline, loss_secs):
+        """deadline is the longest wait for a needed reply, loss_secs the time after which a packet is lost"""
+        self.sock = sock
+        self.addr = addr
+        self.deadline_ns = int(deadline * 1e9)
+        self.loss_ns = int(loss_secs * 1e9)
+        sock.setblocking(False)
+        self.counter = 0
+        self.pending = OrderedDict()  # counter -> send time in ns, oldest first
+        self.expired = OrderedDict()  # counters counted as lost -> send time
+        self.newest_acked = None
+        self.sent = 0
+        self.acked = 0
+        self.lost = 0
+        self.late = 0
+        self.missed = 0
+        self.reordered = 0
+        self.errors = 0
+        self.unexpected = 0
+        self.socket_errors = 0
+        self.rtt = LatencyHistogram()
+
+    def exchange(self, packet, wait=False):
+        """
+        Number and send packet (a Packet or FlagwordTemplate); returns its
+        reply if wait is set and it arrives within the deadline, else None.
+        """
+        self.counter = self.counter % 65535 + 1
+        packet.counter = self.counter
+        now = monotonic_ns()
+        try:
+            self.sock.sendto(packet.pack(), self.addr)
+        except OSError as e:
+            self._socket_error(e)
+            wait = False
+        else:
+            self.pending[self.counter] = now
+            self.sent += 1
+        reply = self._receive(self.counter, now + self.deadline_ns if wait else None)
+        self._expire(monotonic_ns())
+        return reply
+
+    def _receive(self, counter, until):
+        # handles every reply already received; with until set, also waits until the reply to counter arrives
+        found = None
+        while True:
+            timeout = 0
+            if until is not None and found is None:
+                timeout = max(0, until - monotonic_ns()) / 1e9
+            if not select.select([self.sock], [], [], timeout)[0]:
+                if until is not None and found is None:
+                    self.missed += 1
+                return found
+            try:
+                data, addr = self.sock.recvfrom(BUFFER_SIZE)
+            except BlockingIOError:
+                continue
+            except OSError as e:
+                # e.g. ConnectionResetError on Windows; the rest is drained next frame
+                self._socket_error(e)
+                if until is not None and found is None:
+                    self.missed += 1
+                return found
+            try:
+                reply = easyip.Packet(data)
+            except (StructError, easyip.PayloadDecodingException):
+                self.unexpected += 1  # stray or truncated datagram
+                continue
+            reply = self._ack(reply)
+            if reply is not None and reply.counter == counter:
+                found = reply
+
+    def _socket_error(self, e):
+        if not self.socket_errors:
+            log.warning("festo socket error: %s", e)
+        else:
+            log.debug("festo socket error: %s", e)
+        self.socket_errors += 1
+
+    def _ack(self, reply):
+        # matches reply to the packet it answers, returns None if it answers none still pending
+        now = monotonic_ns()
+        sent = self.pending.pop(reply.counter, None)
+        if sent is None:
+            sent = self.expired.pop(reply.counter, None)
+            if sent is None:
+                self.unexpected += 1
+                return None
+            self.late += 1
+            self.rtt.record_ns(now - sent)
+            return None
+        self.acked += 1
+        self.rtt.record_ns(now - sent)
+        if reply.flags != easyip.Flags.RESPONSE or reply.error:
+            self.errors += 1
+        if self.newest_acked is not None and _counter_diff(reply.counter, self.newest_acked) < 0:
+            self.reordered += 1
+        else:
+            self.newest_acked = reply.counter
+        return reply
+
+    def _expire(self, now):
+        while self.pending:
+            counter, sent = next(iter(self.pending.items()))
+            if now - sent < self.loss_ns:
+                break
+            del self.pending[counter]
+            self.expired[counter] = sent
+            if len(self.expired) > EXPIRED_KEEP:
+                self.expired.popitem(last=False)
+            self.lost += 1
+            log.debug("no ack from festo for packet %d", counter)
+
+    def loss_rate(self):
+        """Fraction of the packets old enough to judge that were never acked in time."""
+        judged = self.sent - len(self.pending)
+        return self.lost / float(judged) if judged else 0.0
+
+    def stats(self):
+        return {'sent': self.sent, 'acked': self.acked, 'lost': self.lost, 'loss_rate': self.loss_rate(),
+                'late': self.late, 'missed': self.missed, 'reordered': self.reordered,
+                'errors': self.errors, 'unexpected': self.unexpected, 'socket_errors': self.socket_errors,
+                'rtt': self.rtt.summary()}
+
+    def report(self):
+        stats = self.stats()
+        stats['loss_pct'] = stats['loss_rate'] * 100
+        return ("sent=%(sent)d acked=%(acked)d lost=%(lost)d (%(loss_pct).2f%%) late=%(late)d "
+                "missed=%(missed)d reordered=%(reordered)d errors=%(errors)d unexpected=%(unexpected)d "
+                "socket_errors=%(socket_errors)d" % stats +
+                " | rtt %s" % self.rtt)
+
+
+def _counter_diff(a, b):
+    """Signed distance from counter b to counter a on the 1-65535 cycle."""
+    return (a - b + 32767) % 65535 - 32767
+
+
+if __name__ == "__main__":
+    # loopback demo: a fake festo that drops every 10th packet and swaps some replies
+    import socket
+    import threading
+    import time
+
+    festo = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    festo.bind(('127.0.0.1', 0))
+
+    def serve():
+        held = None
+        while True:
+            data, addr = festo.recvfrom(BUFFER_SIZE)
+            request = easyip.Packet(data)
+            reply = easyip.Factory.response(request)
+            if request.counter % 10 == 0:
+                continue
+            if request.counter % 7 == 0:
+                held = reply  # sent after the next reply
+                continue
+            festo.sendto(reply.pack(), addr)
+            if held:
+                festo.sendto(held.pack(), addr)
+                held = None
+
+    server = threading.Thread(target=serve)
+    server.daemon = True
+    server.start()
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    client.bind(('127.0.0.1', 0))
+    link = FestoLink(client, festo.getsockname(), deadline=0.01, loss_secs=0.1)
+    words = easyip.FlagwordTemplate(7)
+    client.sendto(b'abc', client.getsockname())  # a stray datagram is counted, not raised
+    for i in range(200):
+        words.encode([i] * 7)
+        link.exchange(words, wait=i % 2 == 0)
+        time.sleep(0.005)
+    time.sleep(0.2)
+    link.exchange(words)
+    print(link.report())
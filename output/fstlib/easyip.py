@@ -8,7 +8,8 @@ Flags and Operands are enum classes just to keep track of various constants
 __autor__ = "Peter Magnusson"
 __copyright__ = "Copyright 2009-2010, Peter Magnusson <peter@birchroad.net>"
 __version__ = "1.0.0"
-__all__ = ['Flags', 'Operands', 'Factory', 'PayloadEncodingException', 'PayloadDecodingException', 'Packet']
+__all__ = ['Flags', 'Operands', 'Factory', 'PayloadEncodingException', 'PayloadDecodingException', 'Packet',
+           'FlagwordTemplate']
 
 #Copyright (c) 2009-2010 Peter Magnusson.
 #All rights reserved.
@@ -39,12 +40,28 @@ __all__ = ['Flags', 'Operands', 'Factory', 'PayloadEncodingException', 'PayloadD
 #SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 
-from struct import pack, unpack, calcsize
+from struct import Struct, error as StructError
 import logging
 import sys
 
 EASYIP_PORT=995
 
+log = logging.getLogger('fstlib.easyip')
+
+HEADER_FORMAT='<B B H H B B H H B B H H H'
+HEADER = Struct(HEADER_FORMAT)
+COUNTER = Struct('<H')
+COUNTER_OFFSET = 2  # after flags and error
+_word_structs = {}
+
+
+def word_struct(count):
+    """Precompiled struct for count little endian words, shared by all packets"""
+    words = _word_structs.get(count)
+    if words is None:
+        words = _word_structs[count] = Struct('<%dH' % count)
+    return words
+
 class Flags():
     """
     EasyIP flag enum
@@ -112,6 +129,18 @@ class Factory():
         packet.reqdata_offset_server = offset
         return packet
     
+    @classmethod
+    def send_req_flagword(cls, counter, words, offset, req_count, req_offset):
+        """
+        Send flagword(s) to offset and request 'req_count' flagwords
+        starting at 'req_offset' in the same packet
+        """
+        packet = cls.send_flagword(counter, words, offset)
+        packet.reqdata_type = Operands.FLAG_WORD
+        packet.reqdata_size = req_count
+        packet.reqdata_offset_server = req_offset
+        return packet
+    
     @classmethod
     def req_string(cls, counter, string_no):
         """
@@ -144,26 +173,32 @@ class PayloadDecodingException(Exception):
 
 class Packet(object):
     """Class for managing EasyIP packet
+
+    Packets are slotted and use the precompiled HEADER and word structs.
+    A received packet keeps its payload as a memoryview of the datagram,
+    so decoding does not copy it.
     """
     #L/H
-    HEADER_FORMAT='<B B H H B B H H B B H H H'
+    HEADER_FORMAT=HEADER_FORMAT
     _FIELDS=['flags', 'error', 'counter', 'index1', 'spare1', 
         'senddata_type', 'senddata_size', 'senddata_offset', 
         'spare2', 'reqdata_type', 'reqdata_size', 'reqdata_offset_server',
         'reqdata_offset_client']
+    __slots__ = tuple(_FIELDS) + ('payload',)
     DIRECTION_SEND=1
     DIRECTION_REQ=2
+    logger = log
    
     def __init__(self, data=None, **kwargs):
-        self.logger = logging.getLogger('fstlib.easyip')
         self.payload = None
-        for f in self._FIELDS:
-            setattr(self, f, 0)
+        self.flags = self.error = self.counter = self.index1 = self.spare1 = 0
+        self.senddata_type = self.senddata_size = self.senddata_offset = self.spare2 = 0
+        self.reqdata_type = self.reqdata_size = self.reqdata_offset_server = self.reqdata_offset_client = 0
         
         if data:
-            self.logger.debug("len(data)=%d" % len(data))
-            self.unpack(data);
-            self.payload=data[calcsize(self.HEADER_FORMAT):]
+            log.debug("len(data)=%d", len(data))
+            self.unpack(data)
+            self.payload = memoryview(data)[HEADER.size:]
         else:
             for key in kwargs:
                 if key in Packet._FIELDS:
@@ -171,24 +206,20 @@ class Packet(object):
 
     def unpack(self, data):
         """Unpacks a packet comming in a string buffer"""
-        self.logger.debug("Unpacking data")
-        data = unpack(self.HEADER_FORMAT, data[0:calcsize(self.HEADER_FORMAT)])
-        header=list(data)
-        index = 0
-        for f in self._FIELDS:
-            setattr(self, f, header[index])
-            index +=1
-            
-        self.logger.debug(self.__str__())
+        header = HEADER.unpack_from(data)
+        (self.flags, self.error, self.counter, self.index1, self.spare1,
+         self.senddata_type, self.senddata_size, self.senddata_offset,
+         self.spare2, self.reqdata_type, self.reqdata_size, self.reqdata_offset_server,
+         self.reqdata_offset_client) = header
+        log.debug("Unpacked %s", self)
         return header
     
     def pack(self):
-        header = []
-        for f in self._FIELDS:
-            header.append(getattr(self, f, 0))
-            
-        packed_header = pack(self.HEADER_FORMAT, *header)
-        if self.payload and len(self.payload)>0:
+        packed_header = HEADER.pack(self.flags, self.error, self.counter, self.index1, self.spare1,
+                                    self.senddata_type, self.senddata_size, self.senddata_offset,
+                                    self.spare2, self.reqdata_type, self.reqdata_size,
+                                    self.reqdata_offset_server, self.reqdata_offset_client)
+        if self.payload:
             return packed_header + self.payload
         else:
             return packed_header
@@ -219,11 +250,11 @@ class Packet(object):
         else:
             if not isinstance(data, list):
                 data = [data,]
-            for d in data:
-                if d>65535 or d<0: raise PayloadEncodingException("Word must be within 0 - 65535")
             count = len(data)
-            payload_format = '<' + "H "*count
-            self.payload = pack(payload_format, *data)
+            try:
+                self.payload = word_struct(count).pack(*data)
+            except StructError:
+                raise PayloadEncodingException("Word must be within 0 - 65535")
         return count
     
     def decode_payload(self, direction):
@@ -237,15 +268,14 @@ class Packet(object):
             type = self.reqdata_type
         
         if type == Operands.STRINGS:
-            strings = self.payload.split("\0",count)
+            strings = bytes(self.payload).split(b"\0",count)
             strings.pop()
             return strings
         else:
-            payload_format = '<' + ("H " * count)
             try:
-                return unpack(payload_format, self.payload[:count*2])
+                return word_struct(count).unpack_from(self.payload)
             except Exception as e:
-                raise PayloadDecodingException("Failed to decode payload with format='%s'" % payload_format, e)
+                raise PayloadDecodingException("Failed to decode %d words from payload" % count, e)
                 
     
     
@@ -260,4 +290,53 @@ class Packet(object):
         if len(errors)>0:
             return errors
         else:
-            return None
\ No newline at end of file
+            return None
+
+
+class FlagwordTemplate(object):
+    """
+    Preallocated send_flagword packet for sending the same number of words
+    repeatedly. The header is packed once into a bytearray; encode() only
+    packs the words (and the counter if given) in place, so pack() returns
+    the same bytes as Factory.send_flagword(counter, words, offset).pack()
+    without building a Packet.
+    With req_count the packet also requests req_count flagwords from
+    req_offset, as Factory.send_req_flagword, so the reply carries them.
+    """
+    __slots__ = ('count', 'reqdata_size', 'buffer', '_words', '_counter')
+
+    def __init__(self, count, offset=0, counter=0, req_count=0, req_offset=0):
+        self.count = count
+        self._counter = counter
+        self.reqdata_size = req_count
+        self._words = word_struct(count)
+        self.buffer = bytearray(HEADER.size + self._words.size)
+        HEADER.pack_into(self.buffer, 0,
+                         Flags.EMPTY, 0, counter, 0, 0,
+                         Operands.FLAG_WORD, count, offset,
+                         0, Operands.FLAG_WORD if req_count else Operands.EMPTY,
+                         req_count, req_offset if req_count else 0, 0)
+
+    def encode(self, words, counter=None):
+        """Store count words (0-65535) in the packet."""
+        try:
+            self._words.pack_into(self.buffer, HEADER.size, *words)
+        except StructError as e:
+            raise PayloadEncodingException("Words must be %d values within 0 - 65535 (%s)" % (self.count, e))
+        if counter is not None:
+            self.counter = counter
+
+    @property
+    def counter(self):
+        return self._counter
+
+    @counter.setter
+    def counter(self, counter):
+        COUNTER.pack_into(self.buffer, COUNTER_OFFSET, counter)
+        self._counter = counter
+
+    def pack(self):
+        return self.buffer
+
+    def response_errors(self, response):
+        return Packet.response_errors(self, response)
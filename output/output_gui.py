@@ -130,9 +130,6 @@ class OutputGui(object):
 
         info = "Orientation: X=%-4d Y=%-4d Z=%-4d  Roll=%-3d Pitch=%-3d Yaw=%-3d" % (pos[0], pos[1], pos[2], r, p, yaw)
         self.request_fields_lbl.config(text=info)
-        
-        self.master.update_idletasks()
-        self.master.update()
 
     def normalize(self, item):
         i = 2 * (item - self.MIN_ACTUATOR_LEN) / (self.MAX_ACTUATOR_LEN - self.MIN_ACTUATOR_LEN)
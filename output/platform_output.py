@@ -12,6 +12,8 @@ Muscle calculations use the following formula to convert % contraction to pressu
   pressure = 35 * percent*percent + 15 * percent + .03  # assume 25 Newtons for now
 percent is calculated as follows:
  percent =  1- (distance + MAX_MUSCLE_LEN - MAX_ACTUATOR_LEN)/ MAX_MUSCLE_LEN
+or, with PRESSURE_MODEL = 'table' in platform_config, pressures are looked up in
+a measured distance to pressure table (see d_to_p.py) interpolated for the payload.
 """
 
 import sys
@@ -21,8 +23,12 @@ import math
 import time
 import copy
 import numpy as np
-from output.output_gui import OutputGui
 import platform_config as cfg
+from common.frame_metrics import frame_metrics
+from output.trajectory import Trajectory
+from output.d_to_p import DistanceToPressure
+from output.d_to_p_learner import DtoPLearner
+from output.festo_link import FestoLink
 
 TESTING = False
 if not TESTING:
@@ -30,8 +36,12 @@ if not TESTING:
     from output.fstlib import easyip
 
 PRINT_MUSCLES = False
+MAX_PRESSURE = 6.0   # bar
+MIN_PRESSURE = .05  # 50 millibar is minimin pressure
 PRINT_PRESSURE_DELTA = True
 WAIT_FESTO_RESPONSE = False
+PRESSURE_WORDS = 10  # festo flag words 10-15 hold the actual pressures
+LIVE_HANDOVER_SECS = 5.0  # longest a transition follows live moves before handing over to them
 
 # modify following two lines for MEng output to monitor client
 MONITOR_PORT = 10020 # echo actuator lengths to this port
@@ -69,12 +79,24 @@ class OutputInterface(object):
         self.platform_disabled_pos = np.empty(6)   # position when platform is disabled
         self.platform_winddown_pos = np.empty(6)  # position for attaching stairs
         self.isEnabled = False  # platform disabled if False
-        self.prev_pos = [0, 0, 0, 0, 0, 0]  # requested distances stored here
+        self.prev_pos = np.zeros(6)  # requested actuator lengths stored here
+        # preallocated working arrays for the pressure conversion
+        self._dist_delta = np.zeros(6)
+        self._muscle_len = np.zeros(6)
+        self._accel = np.zeros(6)
+        self._percent = np.zeros(6)
+        self._pressure = np.zeros(6)
+        self._pressure_mb = np.zeros(6, dtype=np.int32)
+        self._coefs_key = None
+        self.d_to_p = None  # DistanceToPressure when using the table model
+        self.learner = None  # DtoPLearner refining the table from Festo readings
+        self._to_pressure = self._convert_MM_to_pressure
         self.requested_pressures = [0,0,0,0,0,0]
         self.actual_pressures =  [0,0,0,0,0,0]
         self.pressure_percent = [0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
         self.prev_time = time.perf_counter()
         self.netlink_ok = False # True if festo responds without error
+        self.festo_link = None
         self.ser = None
         self.monitor_client = None
         if MONITOR_PORT:
@@ -91,14 +113,25 @@ class OutputInterface(object):
             self.FSTs = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
             self.FST_addr = (FST_ip, FST_port)
             self.FSTs.bind(('0.0.0.0', 0))
-            self.FSTs.settimeout(1)  # timout after 1 second if no response
+            # numbered packets, replies are awaited for at most the deadline instead of a socket timeout
+            self.festo_link = FestoLink(self.FSTs, self.FST_addr, cfg.FESTO_ACK_DEADLINE_SECS, cfg.FESTO_LOSS_SECS)
+            self.flagwords = easyip.FlagwordTemplate(7)  # six pressures and the piston flag, reused every frame
+            # the same words plus a request for the actual pressures, one round trip when they are needed
+            self.flagwords_readback = easyip.FlagwordTemplate(7, req_count=6, req_offset=PRESSURE_WORDS)
         print("")
         self.prevMsg = []
         self.use_gui = False # defualt is no gui
         self.activate_piston_flag = 0  # park piston is extended when flag set to 1, parked when 0
         self.client_zpos = 0
+        self.trajectory = Trajectory()  # slow transitions, advanced by service()
+        self.follow_live = False  # transition hands over to live moves once it reaches them
+        self.handover_target = None  # target of a follow_live transition when it started
+        self.handover_deadline = 0.0
+        self.prev_step = None
+        self.after_moving = []  # (func, args) run by service() once the transition ends
         
     def init_gui(self, master):
+        from output.output_gui import OutputGui  # Tk (and PIL) only loaded with a GUI
         self.gui = OutputGui()
         self.gui.init_gui(master, self.min_actuator_len, self.max_actuator_len)
         self.use_gui = True
@@ -110,12 +143,16 @@ class OutputInterface(object):
         self.platform_winddown_pos.fill(propping_len)      # position for attaching stairs or moving prop
         self.fixed_len = fixed_len
         self.loaded_weight = loaded_weight
+        self._to_pressure = self._convert_MM_to_pressure
+        if getattr(cfg, 'PRESSURE_MODEL', 'formula') == 'table':
+            self._begin_table_model(cfg.PRESSURE_TABLE)
 
     def fin(self):
         """
         free resources used by ths module
         """
         global IS_SERIAL
+        self.save_learned_table(wait=True)
         if IS_SERIAL:
             try:
                 if self.ser and self.ser.isOpen():
@@ -168,6 +205,8 @@ class OutputInterface(object):
         set total weight in killograms
         """
         self.loaded_weight = payload_kg
+        if self.d_to_p:
+            self.d_to_p.set_load(payload_kg)  # interpolate the table for the new load
 
     def set_enable(self, state, actuator_lengths):
         """
@@ -180,10 +219,11 @@ class OutputInterface(object):
             print("Platform enabled state is", state)
             if state:
                 pass
-                #  self._slow_move(self.platform_disabled_pos, actuator_lengths, 1000)
+                #  self._start_transition(self.platform_disabled_pos, [(actuator_lengths, 0)])
             else:
                 self.activate_piston_flag = 0
-                self._slow_move(actuator_lengths, self.platform_disabled_pos, 1000)
+                self.after_moving = []  # a piston change queued for an earlier move no longer applies
+                self._start_transition(actuator_lengths, [(self.platform_disabled_pos, 0)])
 
     """
     def move_to_limits(self, pos):
@@ -195,14 +235,20 @@ class OutputInterface(object):
        print("move to idle pos")
        self.client_zpos = zpos
        print("zpos=", self.client_zpos)
-       self._slow_move(client_pos, self.platform_disabled_pos, 1000)
+       self._start_transition(client_pos, [(self.platform_disabled_pos, 0)])
 
 
     def move_to_ready(self, client_pos, zpos):
         print("move to ready pos")
         self.client_zpos = zpos
         print("zpos=", self.client_zpos)
-        self._slow_move(self.platform_disabled_pos, client_pos, 1000)
+        # ends when it catches up with live moves, see move_platform
+        self._start_transition(self.platform_disabled_pos, [(client_pos, 0)], follow_live=True)
+
+    def resume_live(self, start, client_pos):
+        """Ramp from start, where a watchdog fade or park left the platform, back to live moves."""
+        print("ramping back to live moves")
+        self._start_transition(start, [(client_pos, 0)], follow_live=True)
 
     def swell_for_access(self, interval, disengage_prop):
         """
@@ -210,15 +256,13 @@ class OutputInterface(object):
         if disengage is true then activate pistion to detach prop
         else if false, activate pistion
         
-        moves even if disabled
+        moves even if disabled, returns at once; service() runs the moves
         Args:
-          interval (int): time in ms before dropping back to start pos
+          interval (int): time in seconds before dropping back to start pos
         """ 
         print("Start swelling for access")
-        self._slow_move(self.platform_disabled_pos, self.platform_winddown_pos, 1000)
-        time.sleep(interval)
-        self._slow_move(self.platform_winddown_pos, self.platform_disabled_pos, 1000)
-        print("Finished swelling for access")
+        self._start_transition(self.platform_disabled_pos, [(self.platform_winddown_pos, interval),
+                                                            (self.platform_disabled_pos, 0)])
         
 
     def park_platform(self, state):
@@ -258,6 +302,10 @@ class OutputInterface(object):
         """
         if self.isEnabled:
             global IS_SERIAL
+            if self.trajectory.active:
+                if self.follow_live:
+                    self.trajectory.follow(lengths)  # transition converges on the live position
+                return  # the transition owns the output until it ends
             if IS_SERIAL:
                 self._move_to_serial(lengths)
             else:
@@ -291,30 +339,69 @@ class OutputInterface(object):
              # send pos as mm and radians, actuator lengths as mm
              self.monitor_client.sendto(msg, MONITOR_ADDR)
 
-    #  private methods
-    def _slow_move(self, start, end, duration):
-        global IS_SERIAL
-        if IS_SERIAL:
-            move_func = self._move_to_serial
+    def is_moving(self):
+        """True while a transition (enable, idle, ready, swell) is in progress."""
+        return self.trajectory.active
+
+    def after_transition(self, func, *args):
+        """
+        Call func(*args) from service() once the transition in progress has
+        ended, or at once if the platform is not moving. Used for piston
+        changes that must not happen while the platform is still moving.
+        """
+        if self.is_moving():
+            self.after_moving.append((func, args))
         else:
-            move_func = self._move_to
-       
-        #  caution, this moves even if disabled
-        interval = 50  # time between steps in ms
-        steps = duration / interval
-        if steps < 1:
-            self.move(end)
+            func(*args)
+
+    def service(self):
+        """
+        Advance a transition in progress by one step, call once per frame.
+        Transitions move the platform even if disabled.
+        """
+        if not self.trajectory.active:
+            self._run_after_moving()
+            return
+        now = time.perf_counter()
+        dt = now - self.prev_step if self.prev_step else cfg.FRAME_RATE_SECS
+        self.prev_step = now
+        lengths = self.trajectory.step(min(dt, 2 * cfg.FRAME_RATE_SECS))  # no leap after a stall
+        if self.follow_live and self._live_handover(now):
+            self.trajectory.reset(lengths)  # live moves take over
+        if IS_SERIAL:
+            self._move_to_serial(lengths.copy())
         else:
-            current = start
-            # print "moving from", start, "to", end, "steps", steps
-            # print "percent", (end[0]/start[0]) * 100
-            delta = [float(e - s)/steps for s, e in zip(start, end)]
-            for step in range(int(steps)):
-                current = [x + y for x, y in zip(current, delta)]
-                move_func(copy.copy(current))
-                # self.show_muscles([0,0,0,0,0,0], current)
-                #  self.echo_slow_move(start[0], end[0], current[0])
-                time.sleep(interval / 1000.0)
+            self._move_to(lengths)
+        if not self.trajectory.active:
+            self.prev_step = None
+            self._run_after_moving()
+
+    #  private methods
+    def _run_after_moving(self):
+        while self.after_moving and not self.is_moving():  # an action may start another transition
+            func, args = self.after_moving.pop(0)
+            func(*args)
+
+    def _start_transition(self, start, waypoints, follow_live=False):
+        # a transition in progress is retargeted from where it is, otherwise it starts at start
+        if not self.trajectory.active:
+            self.trajectory.reset(start)
+        target, hold = waypoints[0]
+        self.trajectory.move_to(target, hold)
+        for target, hold in waypoints[1:]:
+            self.trajectory.then(target, hold)
+        self.follow_live = follow_live
+        if follow_live:
+            self.handover_target = np.array(waypoints[-1][0], dtype=float)
+            self.handover_deadline = time.perf_counter() + LIVE_HANDOVER_SECS
+
+    def _live_handover(self, now):
+        # caught up with the live position, reached the position the transition was started
+        # for (the live target may keep moving faster than the transition) or ran out of time
+        traj = self.trajectory
+        return (traj.remaining() < 2 * traj.tolerance or
+                np.max(np.abs(traj.pos - self.handover_target)) < 2 * traj.tolerance or
+                now >= self.handover_deadline)
 
     def echo_slow_move(self, start, end, current):
         #increment =  max_z * current/self.max_actuator_len
@@ -352,51 +439,93 @@ class OutputInterface(object):
 
     def _move_to(self, lengths):
         #  print "lengths:\t ", ",".join('  %d' % item for item in lengths)
+        start = frame_metrics.now()
         now = time.perf_counter()
         timeDelta = now - self.prev_time
         self.prev_time = now
         load_per_muscle = self.loaded_weight / 6  # if needed we could calculate individual muscle loads
-        pressure = []
         #print "LENGTHS = ",lengths
         # print format("%0.3f,%s,%s" % (timeDelta,",".join('%d' % item for item in lengths), "Unpropped" if self.activate_piston_flag else "Propped"))
-        for idx, len in enumerate(lengths):
-            pressure.append(int(1000*self._convert_MM_to_pressure(idx, len-self.fixed_len, timeDelta, load_per_muscle)))
-        self._send(pressure)
-
-    def _convert_MM_to_pressure(self, idx, muscle_len, timeDelta, load):
-        #  returns pressure in bar
-        #  calculate the percent of muscle contraction to give the desired distance
-        percent = (self.max_actuator_len - self.fixed_len - muscle_len) / float(self.max_actuator_len - self.fixed_len)
-        #  check for range between 0 and .25
-        #  print "muscle Len =", muscle_len, "percent =", percent
+        pressure = self._to_pressure(lengths, timeDelta, load_per_muscle)
+        t = frame_metrics.since('pressure', start)
+        self._send(pressure.tolist())
+        frame_metrics.since('festo', t)
+
+    def _convert_MM_to_pressure(self, lengths, timeDelta, load):
         """
-        if percent < 0 or percent > 0.25:
-            print "%.2f percent contraction out of bounds for muscle length %.1f" % (percent, muscle_len)
+        Pressures for all six actuator lengths (mm) in one pass
+        returns int array of millibar, valid until the next call
         """
-        distDelta = muscle_len-self.prev_pos[idx]  # the change in length from the previous position
-        accel = (distDelta/1000) / timeDelta  # accleration units are meters per sec
-
-        if distDelta < 0:
-            force = load * (1-accel)  # TODO  here we assume force is same magnitude as expanding muscle ???
-            #  TODO modify formula for force
-            #  pressure = 30 * percent*percent + 12 * percent + .01  # assume 25 Newtons for now
-            pressure = 35 * percent*percent + 15 * percent + .03  # assume 25 Newtons for now
-            if PRINT_MUSCLES:
-                print(("muscle %d contracting %.1f mm to %.1f, accel is %.2f, force is %.1fN, pressure is %.2f"
-                      % (idx, distDelta, muscle_len, accel, force, pressure)))
-        else:
-            force = load * (1+accel)  # force in newtons not yet used
-            #  TODO modify formula for expansion
-            pressure = 35 * percent*percent + 15 * percent + .03  # assume 25 Newtons for now
-            if PRINT_MUSCLES:
-                print(("muscle %d expanding %.1f mm to %.1f, accel is %.2f, force is %.1fN, pressure is %.2f"
-                      % (idx, distDelta, muscle_len, accel, force, pressure)))
-
-        self.prev_pos[idx] = muscle_len  # store the muscle len
-        MAX_PRESSURE = 6.0 
-        MIN_PRESSURE = .05  # 50 millibar is minimin pressure
-        pressure = max(min(MAX_PRESSURE, pressure), MIN_PRESSURE)  # limit range 
-        return pressure
+        #  change in length from the previous position, acceleration units are meters per sec
+        np.subtract(lengths, self.prev_pos, out=self._dist_delta)
+        np.multiply(self._dist_delta, 0.001 / timeDelta, out=self._accel)
+        self.prev_pos[:] = lengths  # store the actuator len
+        #  TODO modify formula for force; same curve for contracting and expanding
+        #  pressure = 35 * percent*percent + 15 * percent + .03  # assume 25 Newtons for now
+        #  with percent the muscle contraction for the desired distance:
+        #  (max_actuator_len - fixed_len - muscle_len) / (max_actuator_len - fixed_len)
+        #  expanded to a quadratic in actuator length, evaluated in millibar and clamped
+        a, b, c = self._pressure_coefs()
+        pressure = np.multiply(lengths, a, out=self._pressure)
+        pressure += b
+        pressure *= lengths
+        pressure += c
+        np.minimum(pressure, MAX_PRESSURE * 1000, out=pressure)
+        np.maximum(pressure, MIN_PRESSURE * 1000, out=pressure)
+        if PRINT_MUSCLES:
+            #  force in newtons not yet used, same magnitude whether contracting or expanding
+            force = load * (1 + np.abs(self._accel))
+            for idx in range(6):
+                print(("muscle %d %s %.1f mm to %.1f, accel is %.2f, force is %.1fN, pressure is %.2f"
+                      % (idx, "contracting" if self._dist_delta[idx] < 0 else "expanding", self._dist_delta[idx],
+                         lengths[idx] - self.fixed_len, self._accel[idx], force[idx], pressure[idx] / 1000)))
+        np.copyto(self._pressure_mb, pressure, casting='unsafe')  # truncates as int() did
+        return self._pressure_mb
+
+    def _begin_table_model(self, csv_path):
+        # falls back to the formula if the table can't be used
+        columns = int(round(self.max_actuator_len - self.min_actuator_len)) + 1  # one per mm of compression
+        d_to_p = DistanceToPressure(columns, self.max_actuator_len - self.fixed_len)
+        try:
+            if not d_to_p.load_data(csv_path):
+                raise ValueError("no '# weights' line")
+        except (IOError, OSError, ValueError) as e:
+            print("Unable to use pressure table %s (%s), using formula" % (csv_path, e))
+            return
+        d_to_p.set_load(self.loaded_weight)
+        self.d_to_p = d_to_p
+        self._to_pressure = self._table_pressure
+        print("Using pressure table", csv_path)
+        if getattr(cfg, 'PRESSURE_LEARNING', False) and not TESTING and not IS_SERIAL:
+            self.learner = DtoPLearner(d_to_p)  # reads back pressures every frame, see _send
+            print("Learning pressure table corrections, saved to", cfg.PRESSURE_LEARNED_TABLE)
+
+    def _table_pressure(self, lengths, timeDelta, load):
+        #  same signature as _convert_MM_to_pressure, pressures in millibar from the measured table
+        np.subtract(lengths, self.fixed_len, out=self._muscle_len)
+        pressures = self.d_to_p.muscle_length_to_pressure(self._muscle_len)
+        if self.learner:
+            self.learner.commanded(pressures)
+        return pressures
+
+    def save_learned_table(self, wait=False):
+        # called periodically and on exit (waiting), only writes when something new was learned;
+        # the table is written and compiled on a background thread
+        if self.learner:
+            self.learner.save(cfg.PRESSURE_LEARNED_TABLE, wait)
+
+    def _pressure_coefs(self):
+        # millibar = a*len*len + b*len + c, recalculated when begin() changes the geometry
+        key = (self.max_actuator_len, self.fixed_len)
+        if self._coefs_key != key:
+            m = float(self.max_actuator_len)
+            r = float(self.max_actuator_len - self.fixed_len)
+            # percent = (m - len) / r
+            self._coefs = (35000 / (r * r),
+                           -(70000 * m / (r * r) + 15000 / r),
+                           35000 * m * m / (r * r) + 15000 * m / r + 30)
+            self._coefs_key = key
+        return self._coefs
 
     def _send(self, muscle_pressures):
         self.requested_pressures = muscle_pressures  # store this for display if required
@@ -404,44 +533,41 @@ class OutputInterface(object):
             try:
                 #print format("Muscle pressures %s,%s" % (",".join('%d' % item for item in muscle_pressures), "Unpropped" if self.activate_piston_flag else "Propped"))
                 muscle_pressures.append(self.activate_piston_flag)
-                packet = easyip.Factory.send_flagword(0, muscle_pressures)
-                try:
-                    self._send_packet(packet)
-                    #  print "festo output:", packet, FST_port
+                readback = WAIT_FESTO_RESPONSE or self.learner
+                packet = self.flagwords_readback if readback else self.flagwords
+                packet.encode(muscle_pressures)
+                resp = self._send_packet(packet)
+                #  print "festo output:", packet, FST_port
+                if readback and resp is not None:
+                    self.actual_pressures = list(resp.decode_payload(easyip.Packet.DIRECTION_REQ))
+                    if self.learner:
+                        self.learner.achieved(self.actual_pressures)
                     if WAIT_FESTO_RESPONSE:
-                        self.actual_pressures = self._get_pressure()
                         delta = [act - req for req, act in zip(muscle_pressures, self.actual_pressures)]
                         # todo - next line needs changing because park flag now appended to list
                         self.pressure_percent = [int(d * 100 / req) for d, req in zip(delta, muscle_pressures)]
                         if PRINT_PRESSURE_DELTA:
                             print(muscle_pressures, delta, self.pressure_percent)
 
-                except socket.timeout:
-                    print("timeout waiting for replay from", self.FST_addr)
-
             except:
                 e = sys.exc_info()[0]
                 s = traceback.format_exc()
                 print("error sending to Festo", e, s)
 
     def _send_packet(self, packet):
+        # returns the reply if one is needed and arrives within the link deadline, else None
         if not TESTING:
-            data = packet.pack()
-            #  print "sending to", self.FST_addr
-            self.FSTs.sendto(data, self.FST_addr)
-            if WAIT_FESTO_RESPONSE:
-                #  print "in sendpacket,waiting for response..."
-                data, srvaddr = self.FSTs.recvfrom(bufSize)
-                resp = easyip.Packet(data)
-                #  print "in senddpacket, response from Festo", resp
-                if packet.response_errors(resp) is None:
+            wait = WAIT_FESTO_RESPONSE or packet.reqdata_size  # requests always get a reply
+            resp = self.festo_link.exchange(packet, wait)
+            if wait:
+                if resp is None:
+                    self.netlink_ok = False
+                elif packet.response_errors(resp) is None:
                     self.netlink_ok = True
                     #  print "No send Errors"
                 else:
                     self.netlink_ok = False
                     print("errors=%r" % packet.response_errors(resp))
-            else:
-                resp = None
             return resp
 
     def _get_pressure(self):
@@ -455,12 +581,11 @@ class OutputInterface(object):
         if TESTING:
             return self.requested_pressures  # TEMP for testing
         #  print "attempting to get pressure"
-        try:
-            packet = easyip.Factory.req_flagword(1, 6, 10)
-            resp = self._send_packet(packet)
-            values = resp.decode_payload(easyip.Packet.DIRECTION_REQ)
-            #  print list(values)
-            return list(values)
-        except socket.timeout:
+        packet = easyip.Factory.req_flagword(1, 6, PRESSURE_WORDS)
+        resp = self._send_packet(packet)
+        if resp is None:
             print("timeout waiting for Pressures from Festo")
-        return [0,0,0,0,0,0]
+            return [0,0,0,0,0,0]
+        values = resp.decode_payload(easyip.Packet.DIRECTION_REQ)
+        #  print list(values)
+        return list(values)
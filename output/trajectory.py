@@ -0,0 +1,173 @@
+"""
+trajectory.py  jerk-limited platform transitions
+
+Trajectory moves the six actuator lengths towards a target in small steps,
+one call to step() per control frame, so slow transitions (enable, park,
+swell for access) run alongside everything else instead of sleeping.
+
+Each leg is driven by an online jerk-limited controller: every internal
+substep it picks the largest jerk (+J, 0 or -J) that still keeps the
+acceleration and speed limits and lets the leg stop at the target with
+jerk-limited braking, so every move is an S-curve without overshoot.
+Because the state (position, velocity, acceleration) is kept between
+steps a move can be retargeted at any time without a jump. On move_to()
+the limits of each leg are scaled by its share of the longest leg travel,
+so legs starting at rest arrive together as with the old linear slow move.
+
+Waypoints can be queued with an optional hold time at each, and follow()
+updates the target to track a moving (live) target, rescaling the legs
+for the new travel as move_to() does.
+"""
+
+import numpy as np
+
+MAX_VEL = 200.0     # mm per second
+MAX_ACCEL = 500.0   # mm per second squared
+MAX_JERK = 2500.0   # mm per second cubed
+TOLERANCE = 0.5     # mm, a leg this close to target and nearly stopped has arrived
+SUBSTEP = 0.01      # seconds, control interval inside step()
+
+
+class Trajectory(object):
+
+    def __init__(self, max_vel=MAX_VEL, max_accel=MAX_ACCEL, max_jerk=MAX_JERK, tolerance=TOLERANCE, legs=6):
+        self.limits = (float(max_vel), float(max_accel), float(max_jerk))
+        self.tolerance = tolerance
+        self.pos = np.zeros(legs)
+        self.vel = np.zeros(legs)
+        self.accel = np.zeros(legs)
+        self.target = np.zeros(legs)
+        self.scale = np.ones(legs)
+        self.hold = 0.0         # seconds to stay at the current target once reached
+        self.waypoints = []     # (target, hold) still to come
+        self.active = False
+
+    def reset(self, pos):
+        """Stop at pos with no motion in progress."""
+        self.pos[:] = pos
+        self.vel[:] = 0
+        self.accel[:] = 0
+        self.target[:] = pos
+        self.waypoints = []
+        self.hold = 0.0
+        self.active = False
+
+    def move_to(self, target, hold=0.0):
+        """Retarget from the current state, dropping any queued waypoints."""
+        self.waypoints = []
+        self._set_target(target, hold)
+
+    def then(self, target, hold=0.0):
+        """Queue a waypoint to move to after the current one."""
+        if self.active:
+            self.waypoints.append((np.array(target, dtype=float), hold))
+        else:
+            self._set_target(target, hold)
+
+    def follow(self, target):
+        """Update the target of the move in progress, eg to a live position."""
+        self.target[:] = target
+        self._rescale()
+
+    def remaining(self):
+        """Largest leg distance to the current target in mm."""
+        return float(np.max(np.abs(self.target - self.pos)))
+
+    def step(self, dt):
+        """Advance dt seconds; returns the new leg positions."""
+        if not self.active:
+            return self.pos
+        substeps = max(1, int(round(dt / SUBSTEP)))
+        h = dt / substeps
+        max_vel, max_accel, max_jerk = self.limits
+        v_lim = max_vel * self.scale
+        a_lim = max_accel * self.scale
+        j_lim = max_jerk * self.scale
+        for _ in range(substeps):
+            self._substep(h, v_lim, a_lim, j_lim)
+
+        arrived = np.abs(self.target - self.pos) < self.tolerance
+        if arrived.all() and (np.abs(self.vel) < max_vel * 0.05).all():
+            self.pos[:] = self.target
+            self.vel[:] = 0
+            self.accel[:] = 0
+            self.hold -= dt
+            if self.hold <= 0:
+                if self.waypoints:
+                    self._set_target(*self.waypoints.pop(0))
+                else:
+                    self.active = False
+        return self.pos
+
+    def _substep(self, h, v_lim, a_lim, j_lim):
+        # work in the direction of the target: x distance, u speed and w acceleration towards it
+        dist = self.target - self.pos
+        sign = np.where(dist < 0, -1.0, 1.0)
+        x = dist * sign
+        u = self.vel * sign
+        w = self.accel * sign
+        chosen = np.full(len(x), -1.0)  # brake hard if nothing fits
+        pending = np.ones(len(x), dtype=bool)
+        for jerk in (1.0, 0.0):  # prefer the fastest approach that can still stop in time
+            w_next = np.clip(w + jerk * j_lim * h, -a_lim, a_lim)
+            u_next = u + (w + w_next) * h / 2
+            x_next = x - (u + u_next) * h / 2
+            ok = (_stop_distance(u_next, w_next, a_lim, j_lim) <= x_next + 1e-6) & \
+                 (u_next + np.maximum(w_next, 0) ** 2 / (2 * j_lim) <= v_lim + 1e-6)
+            take = ok & pending
+            chosen[take] = jerk
+            pending &= ~take
+        w_next = np.clip(w + chosen * j_lim * h, -a_lim, a_lim)
+        u_next = u + (w + w_next) * h / 2
+        self.pos += sign * (u + u_next) * h / 2
+        self.vel = sign * u_next
+        self.accel = sign * w_next
+
+    def _set_target(self, target, hold):
+        self.target[:] = target
+        self.hold = hold
+        self._rescale()
+        self.active = True
+
+    def _rescale(self):
+        travel = np.abs(self.target - self.pos)
+        longest = travel.max()
+        max_vel, max_accel, max_jerk = self.limits
+        # synchronise arrival, but never below what a leg already moving needs to stop
+        scale = travel / longest if longest > 0 else np.ones(len(travel))
+        self.scale = np.clip(np.maximum.reduce([scale, np.abs(self.vel) / max_vel,
+                                                np.abs(self.accel) / max_accel,
+                                                np.full(len(scale), 0.05)]), 0, 1)
+
+
+def _stop_distance(u, w, a_lim, j_lim):
+    """
+    Shortest distance to come to rest from speed u and acceleration w with
+    the deceleration and jerk limits: ramp to peak deceleration, hold it,
+    then ramp back to zero as the speed reaches zero.
+    """
+    peak = np.sqrt(np.maximum(j_lim * u + w * w / 2, 0))  # triangular profile when the speed is low
+    peak = np.maximum(np.minimum(peak, a_lim), -w)         # already braking harder than needed
+    t1 = (w + peak) / j_lim
+    u1 = u + w * t1 - j_lim * t1 * t1 / 2
+    t2 = np.maximum(u1 - peak * peak / (2 * j_lim), 0) / np.maximum(peak, 1e-9)
+    u3 = u1 - peak * t2
+    t3 = peak / j_lim
+    return (u * t1 + w * t1 * t1 / 2 - j_lim * t1 ** 3 / 6 +
+            u1 * t2 - peak * t2 * t2 / 2 +
+            u3 * t3 - peak * t3 * t3 / 2 + j_lim * t3 ** 3 / 6)
+
+
+if __name__ == "__main__":
+    traj = Trajectory()
+    traj.reset([760, 760, 760, 760, 760, 760])
+    traj.move_to([700, 690, 680, 700, 690, 760])
+    dt, t, peak = 0.05, 0.0, 0.0
+    while traj.active and t < 10:
+        prev = traj.pos.copy()
+        traj.step(dt)
+        t += dt
+        peak = max(peak, np.max(np.abs(traj.pos - prev)) / dt)
+        if abs(t - 0.4) < dt / 2:
+            traj.move_to([740, 740, 740, 740, 740, 740])  # retarget mid-move
+    print("arrived at %s after %.2f s, peak speed %.0f mm/s" % (traj.pos, t, peak))
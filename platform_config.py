@@ -27,6 +27,21 @@ platform_selection = 'kinematics.ConfigV3'
 The following default values should be changed only if you know what you are doing
 """
 FRAME_RATE_SECS = .05
+HEADLESS = False  # True runs without a display or Tk, eg as a systemd service
+STARTUP_BUDGET_SECS = 0.3  # warn if the first frame takes longer than this after startup
+GUI_REFRESH_SECS = .1  # the GUI redraws from the latest control snapshot at this interval
+FRAME_METRICS_LOG_SECS = 10  # interval between per-stage frame timing log lines, 0 to disable
+WATCHDOG_FADE_MISSES = 3  # consecutive missed frame deadlines before motion fades to neutral
+WATCHDOG_PARK_MISSES = 20  # consecutive missed frame deadlines before the platform is parked, 0 never parks
+WATCHDOG_LOG = 'frame_watchdog.jsonl'  # missed frame episodes are appended here, None to disable
+
+PRESSURE_MODEL = 'formula'  # 'formula' for the contraction curve, 'table' for the measured PRESSURE_TABLE
+PRESSURE_TABLE = 'output/chair_DtoP.csv'  # distance to pressure table with up and down rows per load
+PRESSURE_LEARNING = False  # refine the table model from Festo pressure readings while running
+PRESSURE_LEARNED_TABLE = 'output/chair_DtoP_learned.csv'  # where the refined table is saved
+PRESSURE_LEARN_SAVE_SECS = 300  # interval between saves of the refined table
+FESTO_ACK_DEADLINE_SECS = 0.01  # longest wait within a frame for a Festo reply when one is needed
+FESTO_LOSS_SECS = 0.5  # a Festo packet not acknowledged after this is counted as lost
 
 Festo_IP_ADDR = '192.168.0.10'
 Festo_Port = 995
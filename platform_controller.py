@@ -7,9 +7,8 @@ This version requires NoLimits attraction license and NL ver 2.5.3.4 or later
 
 import sys
 import time
-import tkinter as tk
-import tkinter.ttk
-import tkinter.messagebox
+startup_time = time.perf_counter()  # for the startup time budget
+
 import traceback
 import numpy as np
 from math import degrees
@@ -17,21 +16,25 @@ import time
 import os
 import copy
 import logging
+import threading
+import signal
 
 import importlib
 
 from kinematics.kinematics import Kinematics
 from kinematics.shape import Shape
 from output.platform_output import OutputInterface
+from common.scheduler import FrameScheduler, TaskScheduler
+from common.gui_bridge import CallQueue, GuiProxy
+from common.frame_metrics import frame_metrics
+from common.watchdog import FrameWatchdog
 
 # from output.muscle_output import MuscleOutput
-# import d_to_p
+# table driven pressures (output/d_to_p.py) are selected with PRESSURE_MODEL in platform_config
 
 
 isActive = True  # set False to terminate
 
-processing_dur = 5  # time in ms to processes frame data (value updated in real time)
-
 # from  platform_config import *
 import platform_config
 
@@ -39,7 +42,6 @@ cfg = importlib.import_module(platform_config.platform_selection).PlatformConfig
 client = importlib.import_module(platform_config.client_selection).InputInterface()
 
 chair = OutputInterface()
-# DtoP = d_to_p.DistanceToPressure(201, 800)
 # chair = MuscleOutput(DtoP.muscle_length_to_pressure, time.sleep, )
 
 shape = Shape(platform_config.FRAME_RATE_SECS)
@@ -50,6 +52,18 @@ class Controller:
     def __init__(self):
         self.prevT = 0
         self.is_output_enabled = False
+        self.chair_status = None
+        self.snapshot = None    # latest (position request, actuator lengths) for the GUI
+        self.gui_calls = None   # CallQueue run on the Tk thread when the control loop has its own thread
+        self.control_calls = CallQueue()  # run between frames on the control thread
+        self.output_lock = threading.Lock()  # the watchdog thread moves the chair when the control loop stalls
+        self._fade_from = None  # actuator lengths when a watchdog fade started
+        self._fade_pos = None   # actuator lengths last sent by the fade
+        self._parked_by_watchdog = False  # the next enable ramps up from the disabled position
+        self._neutral = None    # actuator lengths for the neutral pose
+        self.watchdog = FrameWatchdog(platform_config.FRAME_RATE_SECS, self.fade_to_neutral, self.watchdog_park,
+                                      platform_config.WATCHDOG_FADE_MISSES, platform_config.WATCHDOG_PARK_MISSES,
+                                      log_path=platform_config.WATCHDOG_LOG)
         self._init_geometry()
 
     def _init_geometry(self):
@@ -90,6 +104,7 @@ class Controller:
             print((e, s))
 
     def init_gui(self, root):
+        import tkinter.ttk
         self.root = root
         self.root.geometry("800x480")
         if os.name == 'nt':
@@ -119,12 +134,28 @@ class Controller:
             print((e, s))
         return False
 
-    def update_gui(self):
-        self.root.update_idletasks()
-        self.root.update()
+    def check_output_status(self):
+        status = chair.get_output_status()
+        if status != self.chair_status:
+            self.chair_status = status
+            client.chair_status_changed(status)
+
+    def refresh_gui(self):
+        # runs on the Tk thread at GUI_REFRESH_SECS, never on the control thread
+        start = frame_metrics.now()
+        self.gui_calls.run_pending()
+        snapshot = self.snapshot
+        if snapshot and self.nb.index("current") == 2:  # the output tab
+            chair.show_muscles(*snapshot)
+        frame_metrics.record('gui', frame_metrics.now() - start)
+        if isActive:
+            self.root.after(int(platform_config.GUI_REFRESH_SECS * 1000), self.refresh_gui)
+        else:
+            self.root.quit()
 
     def quit(self):
         if client.USE_GUI:
+            import tkinter.messagebox
             result = tkinter.messagebox.askquestion("Shutting Down Platform Software", "Are You Sure you want to quit?", icon='warning')
             if result != 'yes':
                 return
@@ -136,14 +167,18 @@ class Controller:
         ##actuator_lengths = k.inverse_kinematics(self.process_request(pos))
         #  print "cp", pos, "->",actuator_lengths
         chair.set_enable(True, self.actuator_lengths)
+        if self._parked_by_watchdog:
+            self._parked_by_watchdog = False
+            chair.resume_live(chair.platform_disabled_pos, self.actuator_lengths)
         self.is_output_enabled = True
+        self.watchdog.reset()
         #  print "enable", pos
 
     def disable_platform(self):
         ##pos = client.get_current_pos()
         #  print "disable", pos
         ##actuator_lengths = k.inverse_kinematics(self.process_request(pos))
-        chair.set_enable(False, self.actuator_lengths)
+        chair.set_enable(False, self.actuator_lengths)  # transition to the disabled position
         self.is_output_enabled = False
     
     def move_to_idle(self):
@@ -159,10 +194,11 @@ class Controller:
         chair.move_to_ready(self.actuator_lengths, pos[2])
         
     def swell_for_access(self):
-        chair.swell_for_access(3, False)  # four seconds in up pos
+        chair.swell_for_access(3, False)  # three seconds in up pos
 
     def park_platform(self, state):
-        chair.park_platform(state)
+        with self.watchdog.suspended():  # waits for the piston when parking
+            chair.park_platform(state)
         print((format("Platform park state changed to %s" %("parked" if state else "unparked"))))
                      
     def set_intensity(self, intensity):
@@ -182,6 +218,7 @@ class Controller:
 
     def process_request(self, request):
         #  print "in process", request
+        start = frame_metrics.now()
         if client.is_normalized:
             #  print "pre shape", request,
             request = shape.shape(request)  # adjust gain & washout and convert from norm to real
@@ -189,24 +226,67 @@ class Controller:
         request = shape.smooth(request)
         #  print ", after smoothing", request
         ##if self.is_output_enabled:
+        frame_metrics.since('shape', start)
         return request
 
     def move(self, position_request):
         #  position_requests are in mm and radians (not normalized)
-        start = time.time()
         #  print "req= " + " ".join('%0.2f' % item for item in position_request)
+        start = frame_metrics.now()
         self.actuator_lengths = k.inverse_kinematics(position_request)
-        if self.nb.index("current") == 2: # the output tab
-            chair.show_muscles(position_request, self.actuator_lengths)
+        frame_metrics.since('ik', start)
+        self.snapshot = (position_request, self.actuator_lengths)  # the GUI draws it at its own rate
         if client.USE_UDP_MONITOR and client.USE_UDP_MONITOR == True:
             chair.echo_requests_to_udp(position_request) 
-        if client.USE_GUI:
-            self.update_gui()
-        chair.move_platform(self.actuator_lengths)
+        with self.output_lock:
+            if self._fade_pos is not None:
+                if chair.isEnabled:
+                    chair.resume_live(self._fade_pos, self.actuator_lengths)  # no step back to full motion
+                self._fade_from = self._fade_pos = None
+            chair.move_platform(self.actuator_lengths)
 
         #  print "dur =",  time.time() - start, "interval= ",  time.time() - self.prevT
         #  self.prevT =  time.time()
 
+    def service_output(self):
+        # advances enable, idle, ready and swell transitions, once per frame
+        with self.output_lock:
+            chair.service()
+
+    def fade_to_neutral(self, fraction):
+        # called from the watchdog thread while the control loop is stalled
+        if not chair.isEnabled or not self.output_lock.acquire(False):
+            return  # nothing to fade, or the stalled frame is still sending
+        try:
+            if self._fade_from is None:
+                self._fade_from = np.array(self.actuator_lengths, dtype=float)
+                self._neutral = k.inverse_kinematics(np.zeros(6))
+            self._fade_pos = self._fade_from + (self._neutral - self._fade_from) * fraction
+            chair.move_platform(self._fade_pos)
+        finally:
+            self.output_lock.release()
+
+    def watchdog_park(self):
+        # called from the watchdog thread, returns False to be retried if the output is busy
+        if not chair.isEnabled:
+            return True
+        if not self.output_lock.acquire(True, 0.5):
+            return False
+        try:
+            lengths = self._fade_pos if self._fade_pos is not None else self.actuator_lengths
+            chair.set_enable(False, lengths)  # transition to platform_disabled_pos
+            while chair.is_moving():  # driven from here, the control loop is stalled
+                chair.service()
+                time.sleep(platform_config.FRAME_RATE_SECS)
+            chair.park_platform(True)
+            self.is_output_enabled = False
+            self._parked_by_watchdog = True
+        finally:
+            self.output_lock.release()
+        if hasattr(client, 'deactivate'):
+            self.control_calls.post(client.deactivate)  # client state follows once the loop runs again
+        return True
+
     def cmd_func(self, cmd):  # command handler function called from Platform input
         global isActive
         if cmd == "exit":
@@ -225,17 +305,19 @@ class Controller:
              m,intensity = cmd.split('=',2)
              self.set_intensity(int(intensity)) 
         elif cmd == "parkPlatform":
-             self.park_platform(True)
+             chair.after_transition(self.park_platform, True)  # not while ready or disable is still moving
         elif cmd == "unparkPlatform":
-             self.park_platform(False)
+             chair.after_transition(self.park_platform, False)
         elif cmd == "quit":
-            # prompts with tk msg box to confirm 
-            self.quit() 
+            # prompts with tk msg box to confirm, so must run on the Tk thread
+            if self.gui_calls:
+                self.gui_calls.post(self.quit)
+            else:
+                self.quit()
 
     def move_func(self, request):  # move handler to position platform as requested by Platform input
         #  print "request is trans/rot list:", request
         try:
-            start = time.time()
             r = self.process_request(np.array(request))
             
             self.move(r)
@@ -250,8 +332,6 @@ class Controller:
                 request[4] = request[4]* 57.3
                 request[5] = request[5]* 57.3
                 client.log(request)
-            global processing_dur
-            processing_dur = time.time() - start
         except:
             e = sys.exc_info()[0]  # report error
             s = traceback.format_exc()
@@ -317,10 +397,16 @@ def setup_logging():
 
 
 def main():
+    global isActive
     setup_logging()
     log = logging.getLogger(__name__)  
+    if platform_config.HEADLESS:
+        client.USE_GUI = False
+    # systemd stops the service with SIGTERM, shut down as for the quit command
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop())
     try:
         if client.USE_GUI:
+            import tkinter as tk  # Tk is only imported when there is a display
             root = tk.Tk()
             if controller.init_gui(root) == False:
                 print("init gui returned false")
@@ -334,46 +420,88 @@ def main():
         s = traceback.format_exc()
         print((e, s)) 
 
-    previous = time.time()
-    chair_status = None
     ip_address = "192.168.1.117"
     print("attempting to connect to PC at:", ip_address)
     if client.begin(controller.cmd_func, controller.move_func, cfg.PLATFORM_1DOF_LIMITS, server_ip=ip_address) == False: 
         return  # exit if client forces exit
 
+    # absolute frame deadlines on the monotonic clock, no drift after an overrun
+    frame_metrics.set_budget(platform_config.FRAME_RATE_SECS)
+    tasks = TaskScheduler(FrameScheduler(platform_config.FRAME_RATE_SECS), frame_metrics)
+    # frame rate, critical path: telemetry -> shape -> IK -> output (client calls move_func)
+    tasks.add('client', client.service)
+    tasks.add('output transitions', controller.service_output)
+    # housekeeping at lower rates, deferred if the frame is running late
+    if hasattr(client, 'periodic_tasks'):
+        for name, func, rate, priority in client.periodic_tasks():
+            tasks.add(name, func, rate, priority)
+    tasks.add('chair status', controller.check_output_status, rate=2, priority=3)
+    if chair.learner:
+        tasks.add('pressure learning', chair.save_learned_table,
+                  rate=1.0 / platform_config.PRESSURE_LEARN_SAVE_SECS, priority=3, budget=0.02)
+    if platform_config.FRAME_METRICS_LOG_SECS:
+        tasks.add('frame metrics', lambda: log.info("frame %s", frame_metrics.status_line()),
+                  rate=1.0 / platform_config.FRAME_METRICS_LOG_SECS, priority=3)
+    # button presses and watchdog requests, run between frames
+    tasks.add('control requests', controller.control_calls.run_pending)
+    if client.USE_GUI:
+        # the control loop gets its own thread; Tk is only touched from this one
+        controller.gui_calls = CallQueue()
+        if hasattr(client, 'gui'):
+            client.gui = GuiProxy(client.gui, controller.gui_calls)
+        client.call_in_control = controller.control_calls.post
+        shape.call_in_control = controller.control_calls.post
+    if getattr(client, 'stats_server', None):
+        client.stats_server.add_provider('frame tasks', tasks.report)
+        client.stats_server.add_provider('frame metrics', frame_metrics.report)
+        client.stats_server.add_provider('frame watchdog', controller.watchdog.report)
+        if chair.festo_link:
+            client.stats_server.add_provider('festo link', chair.festo_link.report)
+
     print("starting main service loop")
-    while isActive: 
-        if client.USE_GUI:
-            controller.update_gui()
-            """
-            # todo - move into client?
-            delta = time.time() - previous 
-            percent = -100 * (1 - platform_config.FRAME_RATE_SECS / delta)
-            if percent >=0:
-                color = "green3"
-            elif percent > -10:
-                color = "orange"
-            else:
-                 color = "red"
-            if percent > 9:
-                percent = int(percent/10) * 10
-                client.chair_status_changed((format("Processing leeway is > %d percent" % (percent)),color ))
-            else:
-                client.chair_status_changed((format("Processing leeway is %d percent" % percent),color ))
-            """
-        #time_to_go =  time.time() - previous
-        #print "in controller, time to go=", time_to_go
-        # wait for start of next frame
-        while time.time() - previous < platform_config.FRAME_RATE_SECS:
-            if client.USE_GUI:
-                controller.update_gui()
-        previous = time.time()
-
-        if chair_status != chair.get_output_status():
-            chair_status = chair.get_output_status()
-            client.chair_status_changed(chair_status)
-
-        client.service()
+    if client.USE_GUI:
+        control_thread = threading.Thread(target=control_loop, args=(tasks,), name="control")
+        control_thread.daemon = True
+        control_thread.start()
+        controller.refresh_gui()
+        root.mainloop()
+        isActive = False  # window closed
+        control_thread.join(1.0)
+    else:
+        control_loop(tasks)
+
+    log.info("frame timing:\n%s", tasks.report())
+    log.info("frame stages:\n%s", frame_metrics.report())
+    log.info("frame watchdog: %s", controller.watchdog.report())
+    if chair.festo_link:
+        log.info("festo link: %s", chair.festo_link.report())
+
+
+def control_loop(tasks):
+    global isActive
+    log = logging.getLogger(__name__)
+    try:
+        tasks.run_frame()
+        startup = time.perf_counter() - startup_time
+        if startup > platform_config.STARTUP_BUDGET_SECS:
+            log.warning("first frame %.0f ms after startup, budget is %.0f ms",
+                        startup * 1000, platform_config.STARTUP_BUDGET_SECS * 1000)
+        else:
+            log.info("first frame %.0f ms after startup", startup * 1000)
+        controller.watchdog.start()  # startup is not held to the frame deadline
+        while isActive:
+            tasks.run_frame()
+            controller.watchdog.kick()
+    except Exception:
+        log.exception("control loop stopped")
+        isActive = False
+    finally:
+        controller.watchdog.stop()  # before shutdown looks like a stall; appends the summary to WATCHDOG_LOG
+
+
+def stop():
+    global isActive
+    isActive = False
 
 if __name__ == "__main__":
     main()
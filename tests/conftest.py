@@ -0,0 +1,5 @@
+# the modules are imported from the repository root, as the controller runs them
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
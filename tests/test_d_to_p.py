@@ -0,0 +1,96 @@
+"""
+DistanceToPressure load grid and its cache, rebuilt when the csv changes.
+Run from the repository root:
+    python -m pytest tests
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+import pytest
+
+from output import d_to_p
+from output.d_to_p import DistanceToPressure
+
+COLUMNS = 5
+
+TABLE = """#weights,20,40,,
+0,100,200,300,400
+0,300,400,500,600
+0,50,150,250,350
+0,250,350,450,550
+"""  # up rows for 20 and 40 kg, then the down rows
+
+
+def write_csv(tmp_path, text=TABLE):
+    path = tmp_path / 'chair_DtoP.csv'
+    path.write_text(text)
+    return str(path)
+
+
+def load(csv_path, cache_dir):
+    table = DistanceToPressure(COLUMNS, 1000, cache_dir=cache_dir)
+    assert table.load_data(csv_path)
+    return table
+
+
+def cached_files(cache_dir):
+    return sorted(os.listdir(cache_dir))
+
+
+def test_grid_interpolates_every_kg(tmp_path):
+    table = load(write_csv(tmp_path), None)
+    assert table.grid.shape == (21, 2, COLUMNS)
+    table.set_load(30)
+    assert list(table.d_to_p_up) == [0, 200, 300, 400, 500]
+    assert list(table.d_to_p_down) == [0, 150, 250, 350, 450]
+    table.set_load(100)  # clamped to the heaviest load measured
+    assert list(table.d_to_p_up) == [0, 300, 400, 500, 600]
+
+
+def test_unchanged_csv_uses_the_cache(tmp_path, monkeypatch):
+    csv_path, cache_dir = write_csv(tmp_path), str(tmp_path / 'cache')
+    first = load(csv_path, cache_dir)
+    key = hashlib.sha1(TABLE.encode('utf-8')).hexdigest()[:16]
+    assert cached_files(cache_dir) == ['chair_DtoP-%s.json' % key, 'chair_DtoP-%s.npy' % key]
+
+    def no_parse(*args):
+        raise AssertionError("csv parsed although the cache is valid")
+    monkeypatch.setattr(DistanceToPressure, '_parse', no_parse)
+    second = load(csv_path, cache_dir)
+    assert isinstance(second.grid, np.memmap)
+    assert (second.grid == first.grid).all()
+    assert list(second.loads) == [20, 40]
+
+
+def test_edited_csv_rebuilds_the_cache(tmp_path):
+    csv_path, cache_dir = write_csv(tmp_path), str(tmp_path / 'cache')
+    load(csv_path, cache_dir)
+    old = cached_files(cache_dir)
+    write_csv(tmp_path, TABLE.replace('0,100,200,300,400', '0,110,200,300,400'))
+    table = load(csv_path, cache_dir)
+    table.set_load(20)
+    assert table.d_to_p_up[1] == 110  # the edit, not the cached grid
+    new = cached_files(cache_dir)
+    assert len(new) == 2 and not set(old) & set(new)  # the stale grid was removed
+
+
+def test_cache_of_another_layout_is_ignored(tmp_path):
+    csv_path, cache_dir = write_csv(tmp_path), str(tmp_path / 'cache')
+    load(csv_path, cache_dir)
+    sidecar = [os.path.join(cache_dir, n) for n in cached_files(cache_dir) if n.endswith('.json')][0]
+    with open(sidecar) as f:
+        meta = json.load(f)
+    meta['version'] = d_to_p.CACHE_VERSION + 1
+    with open(sidecar, 'w') as f:
+        json.dump(meta, f)
+    table = load(csv_path, cache_dir)
+    assert not isinstance(table.grid, np.memmap)  # parsed again
+
+
+def test_wrong_column_count_is_rejected(tmp_path):
+    table = DistanceToPressure(COLUMNS + 1, 1000, cache_dir=None)
+    with pytest.raises(ValueError):
+        table.load_data(write_csv(tmp_path))
@@ -0,0 +1,65 @@
+"""
+FlagwordTemplate packs the same bytes as the easyip.Factory packets it replaces.
+Run from the repository root:
+    python -m pytest tests
+"""
+
+import numpy as np
+import pytest
+
+from output.fstlib import easyip
+from output.fstlib.easyip import Factory, FlagwordTemplate, Packet
+
+
+def random_words(count, frames=200, seed=1):
+    rng = np.random.RandomState(seed)
+    return [list(map(int, w)) for w in rng.randint(0, 65536, (frames, count))]
+
+
+@pytest.mark.parametrize('offset', [0, 10])
+def test_send_template_matches_factory(offset):
+    template = FlagwordTemplate(7, offset=offset)
+    for counter, words in enumerate(random_words(7)):
+        template.encode(words, counter + 1)
+        assert bytes(template.pack()) == Factory.send_flagword(counter + 1, words, offset).pack()
+
+
+def test_exchange_template_matches_factory():
+    template = FlagwordTemplate(7, req_count=6, req_offset=10)
+    for counter, words in enumerate(random_words(7)):
+        template.encode(words, counter)
+        assert bytes(template.pack()) == Factory.send_req_flagword(counter, words, 0, 6, 10).pack()
+
+
+def test_extreme_words_and_counters():
+    template = FlagwordTemplate(7)
+    for words in ([0] * 7, [65535] * 7):
+        for counter in (0, 1, 65535):
+            template.encode(words, counter)
+            assert bytes(template.pack()) == Factory.send_flagword(counter, words).pack()
+
+
+def test_counter_is_kept_until_set():
+    template = FlagwordTemplate(7, counter=5)
+    template.encode([1] * 7)
+    template.encode([2] * 7)  # no counter given, the previous one stays
+    assert template.counter == 5
+    assert Packet(bytes(template.pack())).counter == 5
+    template.counter = 6  # as FestoLink numbers it
+    assert bytes(template.pack()) == Factory.send_flagword(6, [2] * 7).pack()
+
+
+def test_bad_words_are_rejected():
+    template = FlagwordTemplate(7)
+    with pytest.raises(easyip.PayloadEncodingException):
+        template.encode([1] * 6)
+    with pytest.raises(easyip.PayloadEncodingException):
+        template.encode([65536] + [0] * 6)
+
+
+def test_response_errors_as_packet():
+    template = FlagwordTemplate(7, req_count=6, req_offset=10)
+    template.encode([1] * 7, 3)
+    request = Packet(bytes(template.pack()))
+    reply = Factory.response(request)
+    assert template.response_errors(reply) == request.response_errors(reply)
@@ -0,0 +1,184 @@
+"""
+FestoLink counter matching and loss accounting, without a network.
+Run from the repository root:
+    python -m pytest tests
+"""
+
+from output.festo_link import FestoLink, _counter_diff
+from output.fstlib import easyip
+
+
+class FakeSocket(object):
+    def __init__(self):
+        self.sent = []
+
+    def setblocking(self, flag):
+        pass
+
+    def sendto(self, data, addr):
+        self.sent.append(bytes(data))
+
+
+def make_link(loss_secs=0.5):
+    link = FestoLink(FakeSocket(), ('festo', 995), deadline=0.01, loss_secs=loss_secs)
+    link._receive = lambda counter, until: None  # replies are fed to _ack by the tests
+    return link
+
+
+def reply(counter, flags=easyip.Flags.RESPONSE, error=0):
+    return easyip.Packet(counter=counter, flags=flags, error=error)
+
+
+def send(link, count):
+    packet = easyip.FlagwordTemplate(7)
+    for _ in range(count):
+        packet.encode([1] * 7)
+        link.exchange(packet)
+    return packet
+
+
+def test_counter_diff_wraps():
+    assert _counter_diff(5, 3) == 2
+    assert _counter_diff(3, 5) == -2
+    assert _counter_diff(1, 65535) == 1  # 65535 is followed by 1, 0 is never used
+    assert _counter_diff(65535, 1) == -1
+    assert _counter_diff(100, 65500) == 135
+
+
+def test_counter_rolls_over_and_is_sent():
+    link = make_link()
+    link.counter = 65534
+    send(link, 3)
+    sent = [easyip.Packet(data).counter for data in link.sock.sent]
+    assert sent == [65535, 1, 2]
+
+
+def test_in_order_acks():
+    link = make_link()
+    send(link, 3)
+    for counter in (1, 2, 3):
+        assert link._ack(reply(counter)).counter == counter
+    assert (link.acked, link.reordered, link.unexpected, link.errors) == (3, 0, 0, 0)
+    assert link.rtt.count == 3
+
+
+def test_reordered_ack():
+    link = make_link()
+    send(link, 3)
+    link._ack(reply(2))
+    link._ack(reply(1))  # older than the newest ack
+    link._ack(reply(3))
+    assert (link.acked, link.reordered) == (3, 1)
+
+
+def test_reorder_across_wrap():
+    link = make_link()
+    link.counter = 65534
+    send(link, 2)  # 65535, 1
+    link._ack(reply(1))
+    link._ack(reply(65535))
+    assert link.reordered == 1
+
+
+def test_unexpected_and_duplicate_acks():
+    link = make_link()
+    send(link, 1)
+    assert link._ack(reply(7)) is None  # never sent
+    link._ack(reply(1))
+    assert link._ack(reply(1)) is None  # already acked
+    assert (link.acked, link.unexpected) == (1, 2)
+
+
+def test_error_reply_is_counted():
+    link = make_link()
+    send(link, 2)
+    link._ack(reply(1, error=1))
+    link._ack(reply(2, flags=easyip.Flags.EMPTY))
+    assert (link.acked, link.errors) == (2, 2)
+
+
+def test_lost_then_late():
+    link = make_link(loss_secs=0)  # every packet not acked by the next exchange is lost
+    send(link, 2)
+    assert link.lost == 2 and not link.pending
+    assert link.loss_rate() == 1.0
+    assert link._ack(reply(1)) is None
+    assert (link.late, link.acked, link.unexpected) == (1, 0, 0)
+    assert link._ack(reply(1)) is None  # a second copy is no longer expected
+    assert link.unexpected == 1
+
+
+def test_stray_datagram_is_counted():
+    import socket
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    peer = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.bind(('127.0.0.1', 0))
+        peer.bind(('127.0.0.1', 0))
+        link = FestoLink(sock, peer.getsockname(), deadline=0.01, loss_secs=0.5)
+        peer.sendto(b'abc', sock.getsockname())
+        packet = easyip.FlagwordTemplate(7)
+        packet.encode([1] * 7)
+        assert link.exchange(packet, wait=True) is None  # nobody answers, the wait ends at the deadline
+        assert (link.unexpected, link.missed) == (1, 1)
+    finally:
+        sock.close()
+        peer.close()
+
+
+def test_refused_peer_does_not_raise():
+    import socket
+    closed = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    closed.bind(('127.0.0.1', 0))
+    addr = closed.getsockname()
+    closed.close()  # nothing listens there, the host answers with port unreachable
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.connect(addr)  # a connected socket reports the ICMP error, as Windows does for any UDP socket
+        link = FestoLink(sock, addr, deadline=0.01, loss_secs=0.5)
+        packet = easyip.FlagwordTemplate(7)
+        for _ in range(5):
+            packet.encode([1] * 7)
+            assert link.exchange(packet, wait=True) is None
+        assert link.socket_errors >= 1
+        assert link.acked == 0
+    finally:
+        sock.close()
+
+
+class ErrorSocket(FakeSocket):
+    """Real descriptor for select, but every send or receive fails."""
+    def __init__(self, send_error=None, recv_error=None):
+        import socket
+        FakeSocket.__init__(self)
+        self.peer = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.peer.bind(('127.0.0.1', 0))
+        self.send_error, self.recv_error = send_error, recv_error
+        self.peer.sendto(b'x', self.peer.getsockname())  # keeps the descriptor readable
+
+    def fileno(self):
+        return self.peer.fileno()
+
+    def sendto(self, data, addr):
+        if self.send_error:
+            raise self.send_error
+        FakeSocket.sendto(self, data, addr)
+
+    def recvfrom(self, size):
+        raise self.recv_error
+
+
+def test_reset_and_unreachable_are_counted():
+    sock = ErrorSocket(recv_error=ConnectionResetError(10054, 'connection reset'))
+    try:
+        link = FestoLink(sock, ('festo', 995), deadline=0.01, loss_secs=0.5)
+        packet = send(link, 3)
+        assert link.exchange(packet, wait=True) is None
+        assert (link.sent, link.socket_errors, link.missed) == (4, 4, 1)
+        sock.send_error = OSError(10065, 'host unreachable')
+        send(link, 2)
+        assert (link.sent, link.socket_errors) == (4, 8)  # the failed send and the drain after it
+        assert len(link.pending) == 4  # failed sends are not pending
+        assert 'socket_errors=8' in link.report()
+    finally:
+        sock.peer.close()
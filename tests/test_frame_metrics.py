@@ -0,0 +1,53 @@
+"""
+FrameMetrics stage percentiles and the threads allowed to record them.
+Run from the repository root:
+    python -m pytest tests
+"""
+
+import threading
+
+import numpy as np
+
+from common.frame_metrics import FrameMetrics
+
+MS = 1000000  # ns
+
+
+def frame(metrics, **stages):
+    metrics.begin_frame()
+    for stage, ms in stages.items():
+        metrics.add(stage, ms * MS)
+    metrics.end_frame()
+
+
+def test_stage_that_did_not_run_is_not_a_zero():
+    m = FrameMetrics(capacity=10)
+    for i in range(8):
+        if i % 4 == 0:
+            frame(m, telemetry=1, ik=4)
+        else:
+            frame(m, telemetry=1)
+    p50 = m.percentiles((50,))[0]
+    assert p50[m.index['ik']] == 4.0  # over the two frames it ran in
+    assert p50[m.index['festo']] == 0.0  # never ran
+
+
+def test_other_threads_do_not_write_the_frame():
+    m = FrameMetrics(capacity=10)
+    m.begin_frame()
+    m.add('festo', 1 * MS)
+    fade = threading.Thread(target=lambda: [m.add('festo', 5 * MS) for _ in range(100)])
+    fade.start()
+    fade.join()
+    m.end_frame()
+    assert m.rows[0, m.index['festo']] == 1000.0  # microseconds, only the frame's own send
+    assert m.frames == 1
+
+
+def test_background_runs_have_their_own_buffer():
+    m = FrameMetrics(capacity=4)
+    for ms in (1, 2, 3, 4, 5, 6):
+        m.record('gui', ms * MS)
+    assert m.run_count['gui'] == 6
+    assert m.background_percentiles((100,))[0][0] == 6.0
+    assert np.isnan(m.rows).all()  # no frame was recorded
@@ -0,0 +1,92 @@
+"""
+CallQueue and GuiProxy marshal calls between the control and Tk threads.
+Run from the repository root:
+    python -m pytest tests
+"""
+
+import threading
+
+from common.gui_bridge import CallQueue, GuiProxy, NullGui
+
+
+def test_calls_run_on_the_draining_thread_in_order():
+    calls = CallQueue()
+    ran = []
+
+    def record(n):
+        ran.append((n, threading.current_thread()))
+
+    posters = [threading.Thread(target=lambda n=n: calls.post(record, n)) for n in range(5)]
+    for t in posters:
+        t.start()
+        t.join()  # one after another, so the posting order is known
+    assert ran == []  # nothing runs until the owner drains the queue
+    assert calls.run_pending() == 5
+    assert [n for n, _ in ran] == list(range(5))
+    assert all(thread is threading.current_thread() for _, thread in ran)
+    assert calls.run_pending() == 0
+
+
+def test_call_posted_while_draining_runs_next_time():
+    calls = CallQueue()
+    ran = []
+
+    def first():
+        ran.append('first')
+        calls.post(ran.append, 'second')
+
+    calls.post(first)
+    calls.run_pending()
+    assert ran == ['first', 'second']  # drained until the queue is empty
+
+
+class Gui(object):
+    def __init__(self):
+        self.label = 'idle'
+        self.thread = None
+
+    def set_label(self, text):
+        self.label = text
+        self.thread = threading.current_thread()
+
+
+def test_proxy_posts_method_calls_and_reads_attributes():
+    gui = Gui()
+    gui_calls = CallQueue()
+    proxy = GuiProxy(gui, gui_calls)
+    control = threading.Thread(target=lambda: proxy.set_label('ready'))
+    control.start()
+    control.join()
+    assert gui.label == 'idle'  # queued, not run on the control thread
+    assert proxy.label == 'idle'  # plain attributes are read directly
+    gui_calls.run_pending()  # the Tk thread's after() callback
+    assert gui.label == 'ready'
+    assert gui.thread is threading.current_thread()
+
+
+def test_null_gui_ignores_everything():
+    gui = NullGui()
+    assert gui.set_coaster_status_label(["text", "red"]) is None
+
+
+class Entry(object):
+    def __init__(self, text):
+        self.text = text
+
+    def get(self):
+        return self.text
+
+
+def test_shape_washout_entry_is_applied_on_the_control_thread():
+    from kinematics.shape import Shape
+    shape = Shape(0.05)
+    control_calls = CallQueue()
+    shape.call_in_control = control_calls.post
+    shape.wash_entry_widget = [Entry('12')] * 6
+    shape.wash_entry_widget[2] = Entry('6')
+    before = shape.washout_factor.copy()
+    shape.update_washouts()  # Tk thread: reads the entries, posts the changes
+    assert (shape.washout_factor == before).all()
+    control_calls.run_pending()  # between frames
+    assert shape.washout_time[2] == 6
+    assert shape.washout_factor[2] != before[2]
@@ -0,0 +1,45 @@
+"""
+Nl2LinkStats histograms read from another thread while the link adds them.
+Run from the repository root:
+    python -m pytest tests
+"""
+
+import threading
+
+from coaster.nl2_link import Nl2LinkStats, Nl2MsgType
+
+
+def test_report_while_histograms_are_added():
+    errors = []
+
+    def serve(stats, done):
+        # the stats server thread
+        try:
+            while not done.is_set():
+                stats.report()
+        except Exception as e:
+            errors.append(e)
+
+    for _ in range(10):
+        stats = Nl2LinkStats()
+        done = threading.Event()
+        server = threading.Thread(target=serve, args=(stats, done))
+        server.start()
+        try:
+            for msg_type in range(2000):  # a new key every call, as the link thread does on first use
+                stats.record_ns(msg_type, 1000000)
+        finally:
+            done.set()
+            server.join()
+    assert not errors
+    assert len(stats.items()) == 2000
+
+
+def test_report_lists_used_types():
+    stats = Nl2LinkStats()
+    stats.record_ns(Nl2MsgType.GET_TELEMETRY, 2000000)
+    stats.timeouts = 1
+    report = stats.report().splitlines()
+    assert report[0].startswith('GET_TELEMETRY')
+    assert report[-1].startswith('timeouts=1')
+    assert stats.summary()['max'] > 0
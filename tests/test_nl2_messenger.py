@@ -0,0 +1,102 @@
+"""
+Nl2Messenger manual mode handling against a scripted NoLimits, without a network.
+Run from the repository root:
+    python -m pytest tests
+"""
+
+from struct import Struct
+
+import pytest
+
+from coaster import nl2_messenger
+from coaster.nl2_link import Nl2MsgType, STATION_BOOL_STRUCT
+from coaster.nl2_messenger import Nl2Messenger, StationStatus
+
+STATE = Struct('>I')
+
+
+class Clock(object):
+    def __init__(self):
+        self.t = 100.0
+
+    def __call__(self):
+        return self.t
+
+
+class FakeNl2(Nl2Messenger):
+    """Answers station state from self.bits and records every message sent."""
+
+    def __init__(self):
+        Nl2Messenger.__init__(self)
+        self.bits = 0
+        self.sent = []
+
+    def send_msg(self, msg_type, data=None):
+        self.sent.append(msg_type)
+        if msg_type == Nl2MsgType.GET_STATION_STATE:
+            return STATE.pack(self.bits)
+        if msg_type == Nl2MsgType.SET_MANUAL_MODE:
+            self.manual_data = data
+        return b''
+
+    def send_msgs(self, requests):
+        return [self.send_msg(msg_type, data) for msg_type, data in requests]
+
+    def count(self, msg_type):
+        return self.sent.count(msg_type)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(nl2_messenger, 'perf_counter', clock)
+    return clock
+
+
+def test_manual_request_is_rate_limited(clock):
+    nl2 = FakeNl2()
+    assert not nl2.ensure_manual_mode(True)
+    assert nl2.manual_data == STATION_BOOL_STRUCT.pack(0, 0, True)
+    clock.t += 0.1
+    assert not nl2.ensure_manual_mode(True)  # still not manual, but asked too recently
+    assert nl2.count(Nl2MsgType.SET_MANUAL_MODE) == 1
+    clock.t += nl2.manual_retry_interval
+    assert not nl2.ensure_manual_mode(True)
+    assert nl2.count(Nl2MsgType.SET_MANUAL_MODE) == 2
+
+
+def test_manual_request_invalidates_station_cache(clock):
+    nl2 = FakeNl2()
+    nl2.ensure_manual_mode(True)
+    polls = nl2.count(Nl2MsgType.GET_STATION_STATE)
+    nl2.bits = StationStatus.bit_manual  # NoLimits switched
+    clock.t += 0.01  # well inside the cache age
+    assert nl2.ensure_manual_mode(True)
+    assert nl2.count(Nl2MsgType.GET_STATION_STATE) == polls + 1  # polled, not the stale cache
+
+
+def test_prepare_for_dispatch_waits_for_manual(clock):
+    nl2 = FakeNl2()
+    assert not nl2.prepare_for_dispatch()
+    clock.t += 0.3
+    assert not nl2.prepare_for_dispatch()
+    assert nl2.count(Nl2MsgType.SET_MANUAL_MODE) == 1  # not resent on every call
+    nl2.bits = StationStatus.bit_manual | StationStatus.bit_gates_can_close  # NoLimits switched
+    clock.t += 0.3
+    assert not nl2.prepare_for_dispatch()
+    assert nl2.count(Nl2MsgType.SET_GATES) == 1
+    assert nl2.count(Nl2MsgType.SET_MANUAL_MODE) == 1
+    nl2.bits = StationStatus.bit_manual | StationStatus.bit_can_dispatch
+    clock.t += 0.01
+    assert nl2.prepare_for_dispatch()
+
+
+def test_station_polling_restores_manual_mode(clock):
+    nl2 = FakeNl2()
+    nl2.bits = StationStatus.bit_manual
+    assert nl2.poll_station_state()
+    assert nl2.count(Nl2MsgType.SET_MANUAL_MODE) == 0
+    nl2.bits = 0  # someone switched NoLimits to auto
+    clock.t += 1.0
+    assert nl2.poll_station_state()
+    assert nl2.count(Nl2MsgType.SET_MANUAL_MODE) == 1
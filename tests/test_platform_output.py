@@ -0,0 +1,106 @@
+"""
+Piston changes queued behind the ready and disable transitions, without a Festo.
+Run from the repository root:
+    python -m pytest tests
+"""
+
+import numpy as np
+import pytest
+
+import platform_config as cfg
+from output import platform_output
+from output.platform_output import OutputInterface
+
+DISABLED_LEN = 950
+LIVE_LEN = 820
+
+
+class Clock(object):
+    def __init__(self):
+        self.t = 100.0
+
+    def __call__(self):
+        return self.t
+
+
+@pytest.fixture
+def chair(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(platform_output.time, 'perf_counter', clock)
+    chair = OutputInterface()
+    chair.begin(680, 1000, DISABLED_LEN, 920, 120, 100)
+    chair.events = []
+    chair._move_to = lambda lengths: chair.events.append(('move', np.array(lengths, dtype=float)))
+    chair.clock = clock
+    yield chair
+    chair.FSTs.close()
+
+
+def run_frames(chair, frames=400):
+    """Service the chair once per frame while it moves; returns the frames run."""
+    for frame in range(frames):
+        chair.clock.t += cfg.FRAME_RATE_SECS
+        chair.service()
+        if not chair.is_moving() and not chair.after_moving:
+            return frame
+    raise AssertionError("transition did not end")
+
+
+def park(chair, state):
+    chair.events.append(('park', state, chair.is_moving()))
+
+
+def test_unpark_waits_for_ready(chair):
+    live = [LIVE_LEN] * 6
+    chair.set_enable(True, live)
+    chair.move_to_ready(live, 0)
+    chair.after_transition(park, chair, False)
+    assert chair.after_moving  # queued, the rise has only started
+    run_frames(chair)
+    assert [e for e in chair.events if e[0] == 'park'] == [('park', False, False)]
+    assert chair.events[-1][0] == 'park'  # after the last step of the rise
+    assert np.allclose(chair.events[-2][1], live, atol=2 * chair.trajectory.tolerance)  # handed over to live
+
+
+def test_park_waits_for_disable(chair):
+    live = [LIVE_LEN] * 6
+    chair.set_enable(True, live)
+    chair.set_enable(False, live)
+    chair.after_transition(park, chair, True)
+    run_frames(chair)
+    assert chair.events[-1] == ('park', True, False)
+    assert np.allclose(chair.events[-2][1], DISABLED_LEN)
+
+
+def test_disable_drops_queued_unpark(chair):
+    live = [LIVE_LEN] * 6
+    chair.set_enable(True, live)
+    chair.move_to_ready(live, 0)
+    chair.after_transition(park, chair, False)
+    chair.set_enable(False, live)  # deactivated during the rise
+    chair.after_transition(park, chair, True)
+    run_frames(chair)
+    assert [e for e in chair.events if e[0] == 'park'] == [('park', True, False)]
+    assert chair.activate_piston_flag == 0
+
+
+def test_runs_at_once_when_still(chair):
+    chair.after_transition(park, chair, True)
+    assert chair.events == [('park', True, False)]
+    assert not chair.after_moving
+
+
+def test_resume_live_ramps_from_faded_pose(chair):
+    faded = np.array([LIVE_LEN + 80.0] * 6)
+    live = np.array([LIVE_LEN] * 6)
+    chair.set_enable(True, faded)
+    chair.resume_live(faded, live)
+    chair.move_platform(live)  # the live frame follows the ramp instead of being sent
+    assert chair.events == []
+    run_frames(chair)
+    lengths = np.array([e[1] for e in chair.events])
+    steps = np.abs(np.diff(np.vstack([faded, lengths]), axis=0))
+    assert steps.max() < 10  # mm per frame, the fade distance is 80
+    assert np.allclose(lengths[-1], live, atol=2 * chair.trajectory.tolerance)
+    chair.move_platform(live)
+    assert np.allclose(chair.events[-1][1], live)  # handed over to live moves
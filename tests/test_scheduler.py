@@ -0,0 +1,94 @@
+"""
+FrameScheduler pacing and TaskScheduler rates and priorities, on a fake clock.
+Run from the repository root:
+    python -m pytest tests
+"""
+
+import pytest
+
+from common import scheduler
+from common.scheduler import FrameScheduler, TaskScheduler
+
+MS = 1000000  # ns
+PERIOD = 0.05
+
+
+class Clock(object):
+    """Monotonic ns clock that moves only when slept on, or by tick per read while spinning."""
+
+    def __init__(self, tick=10000):
+        self.ns = 10 ** 12
+        self.tick = tick
+
+    def __call__(self):
+        self.ns += self.tick
+        return self.ns
+
+    def sleep(self, secs):
+        self.ns += int(secs * 1e9)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(scheduler, 'monotonic_ns', clock)
+    return clock
+
+
+def test_frames_do_not_drift(clock):
+    frames = FrameScheduler(PERIOD, sleep_func=clock.sleep)
+    first = frames.deadline
+    for n in range(100):
+        clock.ns += 7 * MS  # frame work
+        frames.wait()
+        assert 0 <= clock.ns - (first + n * PERIOD * 1e9) < 1 * MS  # on the absolute schedule
+    assert (frames.frames, frames.overruns, frames.skipped) == (100, 0, 0)
+
+
+def test_overrun_skips_missed_frames_and_keeps_phase(clock):
+    frames = FrameScheduler(PERIOD, sleep_func=clock.sleep)
+    first = frames.deadline
+    frames.wait()
+    clock.ns += 130 * MS  # a stall of more than two periods
+    late = frames.wait()
+    assert late >= 80 * MS
+    assert (frames.overruns, frames.skipped) == (1, 1)
+    assert (frames.deadline - first) % int(PERIOD * 1e9) == 0
+
+
+def test_task_rates(clock):
+    tasks = TaskScheduler(FrameScheduler(PERIOD, sleep_func=clock.sleep))
+    every = tasks.add('every frame', lambda: None)
+    twice = tasks.add('2 Hz', lambda: None, rate=2, priority=1)
+    once = tasks.add('1 Hz', lambda: None, rate=1, priority=2)
+    for _ in range(200):  # ten seconds
+        tasks.run_frame()
+    assert every.runs == 200
+    assert twice.runs in (20, 21)
+    assert once.runs in (10, 11)
+
+
+def test_priority_order_and_deferral(clock):
+    tasks = TaskScheduler(FrameScheduler(PERIOD, sleep_func=clock.sleep))
+    order = []
+
+    def work(name, ms):
+        def run():
+            order.append(name)
+            clock.ns += ms * MS
+        return run
+
+    tasks.add('low', work('low', 10), priority=2, budget=0.02)
+    tasks.add('critical', work('critical', 20), priority=0)
+    tasks.add('high', work('high', 1), priority=1, budget=0.001)
+    tasks.run_frame()
+    assert order == ['critical', 'high', 'low']
+    tasks.tasks[0].func = work('critical', 45)  # leaves no room for low's budget
+    del order[:]
+    for _ in range(TaskScheduler.MAX_DEFER):
+        tasks.run_frame()
+    assert 'low' not in order
+    assert tasks.tasks[2].defers == TaskScheduler.MAX_DEFER
+    del order[:]
+    tasks.run_frame()
+    assert order[-1] == 'low'  # deferred at most MAX_DEFER frames
@@ -0,0 +1,83 @@
+"""
+Trajectory limits, arrival and retargeting. Run from the repository root:
+    python -m pytest tests
+"""
+
+import numpy as np
+
+from output.trajectory import Trajectory, MAX_VEL, MAX_ACCEL
+
+DT = 0.05
+
+
+def run(traj, steps=400):
+    """Step until the move ends; returns the positions after every step."""
+    positions = []
+    while traj.active and len(positions) < steps:
+        positions.append(traj.step(DT).copy())
+        assert (np.abs(traj.vel) <= MAX_VEL * traj.scale + 1e-6).all()
+        assert (np.abs(traj.accel) <= MAX_ACCEL * traj.scale + 1e-6).all()
+    return np.array(positions)
+
+
+def test_move_arrives_without_overshoot():
+    traj = Trajectory()
+    traj.reset([760] * 6)
+    target = np.array([700, 690, 680, 700, 720, 760], dtype=float)
+    traj.move_to(target)
+    positions = run(traj)
+    assert not traj.active
+    assert np.allclose(traj.pos, target)
+    assert (positions >= target - 1e-6).all()  # moving down, never below the target
+    speeds = np.abs(np.diff(positions, axis=0)) / DT
+    assert speeds.max() <= MAX_VEL + 1e-6
+
+
+def test_legs_arrive_together():
+    traj = Trajectory()
+    traj.reset([760] * 6)
+    traj.move_to([600, 650, 700, 740, 755, 759])
+    positions = run(traj)
+    start, travel = 760.0, np.array([160, 110, 60, 20, 5, 1], dtype=float)
+    done = (start - positions) / travel  # fraction of its travel each leg has covered
+    halfway = [np.argmax(done[:, leg] >= 0.5) for leg in range(4)]  # the short legs hit the 5% scale floor
+    assert max(halfway) - min(halfway) <= 1
+
+
+def test_retarget_has_no_jump():
+    traj = Trajectory()
+    traj.reset([760] * 6)
+    traj.move_to([600] * 6)
+    for _ in range(8):
+        traj.step(DT)
+    before, vel = traj.pos.copy(), traj.vel.copy()
+    traj.move_to([740] * 6)  # reverse mid-move
+    assert np.array_equal(traj.vel, vel)
+    after = traj.step(DT)
+    assert np.abs(after - before).max() <= MAX_VEL * DT + 1e-6
+    run(traj)
+    assert np.allclose(traj.pos, 740)
+
+
+def test_follow_rescales_clipped_leg():
+    traj = Trajectory()
+    traj.reset([700] * 6)
+    traj.move_to([700.2] + [600] * 5)
+    assert traj.scale[0] == 0.05
+    traj.step(DT)
+    traj.follow([600] * 6)
+    assert traj.scale[0] == 1.0
+    positions = run(traj)
+    assert np.allclose(traj.pos, 600)
+    assert len(positions) * DT < 2.0  # at full speed, not crawling at 5%
+
+
+def test_waypoint_hold():
+    traj = Trajectory()
+    traj.reset([700] * 6)
+    traj.move_to([720] * 6, hold=0.5)
+    traj.then([700] * 6)
+    positions = run(traj)
+    at_first = np.all(np.abs(positions - 720) < 1e-9, axis=1)
+    assert at_first.sum() * DT >= 0.5
+    assert np.allclose(traj.pos, 700)
@@ -0,0 +1,65 @@
+"""
+FrameWatchdog miss counting and episode logging, with a fake clock and no thread.
+Run from the repository root:
+    python -m pytest tests
+"""
+
+import json
+
+import pytest
+
+from common import watchdog
+from common.watchdog import FrameWatchdog, WatchdogLevel
+
+PERIOD_NS = 50000000
+
+
+class Clock(object):
+    def __init__(self):
+        self.ns = 10 ** 12
+
+    def __call__(self):
+        return self.ns
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(watchdog, 'monotonic_ns', clock)
+    return clock
+
+
+def make_dog(tmp_path, **kwargs):
+    dog = FrameWatchdog(PERIOD_NS / 1e9, lambda fraction: None, lambda: True,
+                        log_path=str(tmp_path / 'watchdog.jsonl'), **kwargs)
+    dog._last_kick = watchdog.monotonic_ns()
+    return dog
+
+
+def frames(dog, clock, count, interval=PERIOD_NS):
+    for _ in range(count):
+        clock.ns += interval
+        dog.kick()
+
+
+def test_stall_escalates_and_recovers(tmp_path, clock):
+    dog = make_dog(tmp_path, fade_misses=3)
+    frames(dog, clock, 5)
+    assert dog.misses == 0
+    frames(dog, clock, 1, interval=4 * PERIOD_NS)  # one long frame holds three missed deadlines
+    assert (dog.misses, dog.level, dog.fades) == (3, WatchdogLevel.FADING, 1)
+    frames(dog, clock, 1)
+    assert (dog.level, dog.episodes, dog.worst) == (WatchdogLevel.OK, 1, 3)
+
+
+def test_kick_does_not_write_the_log(tmp_path, clock):
+    dog = make_dog(tmp_path)
+    path = tmp_path / 'watchdog.jsonl'
+    frames(dog, clock, 1, interval=2 * PERIOD_NS)
+    frames(dog, clock, 1)  # ends the episode on the control thread
+    assert not path.exists()
+    dog._write_records()  # what the watchdog thread does next
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [r['level'] for r in records] == ['LATE']
+    dog.stop()
+    assert 'summary' in json.loads(path.read_text().splitlines()[-1])